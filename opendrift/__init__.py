@@ -29,9 +29,14 @@ def get_model(model_name):
                 return model
 
 
-def open(filename):
-    '''Import netCDF output file as OpenDrift object of correct class'''
+def open(filename, **kwargs):
+    '''Import netCDF or Parquet output file as OpenDrift object of correct class
 
+    Keyword arguments (time, time_range, variables, elements) select the
+    part of the file to be read, see io_netcdf.import_file.
+    '''
+
+    import io
     import os
     import logging
     import pydoc
@@ -44,22 +49,30 @@ def open(filename):
             filename = 'opendrift_tmp.nc'
         except:
             raise ValueError('%s does not exist' % filename)
-    n = Dataset(filename)
-    try:
-        module_name = n.opendrift_module
-        class_name = n.opendrift_class
-    except:
+    with io.open(filename, 'rb') as f:  # Builtin open, shadowed here
+        iomodule = 'parquet' if f.read(4) == b'PAR1' else 'netcdf'
+    if iomodule == 'parquet':
+        import pyarrow.parquet as pq
+        n = {key.decode(): value.decode() for key, value in
+             pq.read_metadata(filename).metadata.items()}
+        module_name = n.get('opendrift_module')
+        class_name = n.get('opendrift_class')
+    else:
+        n = Dataset(filename)
+        module_name = getattr(n, 'opendrift_module', None)
+        class_name = getattr(n, 'opendrift_class', None)
+        n.close()
+    if module_name is None or class_name is None:
         raise ValueError(filename + ' does not contain '
                          'necessary global attributes '
                          'opendrift_module and opendrift_class')
-    n.close()
 
     cls = pydoc.locate(module_name + '.' + class_name)
     if cls is None:
         from models import oceandrift3D
         cls = oceandrift3D.OceanDrift3D
-    o = cls()
-    o.io_import_file(filename)
+    o = cls(iomodule=iomodule)
+    o.io_import_file(filename, **kwargs)
     logging.info('Returning ' + str(type(o)) + ' object')
     return o
 
@@ -14,6 +14,7 @@
 # 
 # Copyright 2015, Knut-Frode Dagestad, MET Norway
 
+import sys
 from collections import OrderedDict
 
 import numpy as np
@@ -37,6 +38,9 @@ class LagrangianArray(object):
             variables/properties of the current object. The values
             of the OrderedDict are dictionaries with names such as
             'dtype', 'unit', 'standard_name' (CF), 'default' etc.
+            Properties which do not change after seeding may be given
+            'constant': True, and are then stored once per element
+            in the output (history), instead of at each time step.
         All variable names will be added dynamically as attributes of
             the object after initialisation. These attributes will be
             numpy ndarrays of same length, or scalars. The core variables
@@ -47,6 +51,16 @@ class LagrangianArray(object):
         lat: latitude (np.float32)
         z: vertical position of the particle in m, 
             positive upwards (above sea surface)
+
+    Arrays are stored in buffers which may be larger than the number of
+    elements, and the attributes are views of the used part. Capacity
+    for all elements of a simulation may be preallocated with reserve(),
+    such that elements are appended (extend, move_elements) without
+    reallocation, and removed elements are compacted in place.
+    Assigning an array to a variable replaces the values (and not the
+    contents of the buffer); the preallocated buffer is kept, and reused
+    when appending, unless still referenced elsewhere.
+    The number of elements is kept, and not recalculated by __len__.
     """
 
     variables = OrderedDict([
@@ -87,6 +101,15 @@ class LagrangianArray(object):
             An empty object may be created by giving no input.
         """
 
+        # Storage of variables, see __getattr__ and __setattr__
+        self.__dict__['_buffers'] = {}  # Array buffers, or scalar values
+        self.__dict__['_offsets'] = {}  # Index of first element in buffer
+        self.__dict__['_lengths'] = {}  # Number of elements per variable
+        self.__dict__['_owned'] = set()  # Buffers which may be modified
+        self.__dict__['_spare'] = {}  # Owned buffers replaced by assignment
+        self.__dict__['_length'] = 0  # Number of elements, None if unknown
+        self.__dict__['_capacity'] = 0  # Preallocated number of elements
+
         # Collect default values in separate dict, for easier access
         default_values = {variable: self.variables[variable]['dtype'](
                           self.variables[variable]['default'])
@@ -145,6 +168,118 @@ class LagrangianArray(object):
         variables.update(new_variables)
         return variables
 
+    def __getattr__(self, name):
+        """Return view of used part of buffer, or scalar value."""
+        buffers = self.__dict__.get('_buffers')
+        if buffers is None or name not in buffers:
+            raise AttributeError('%s has no attribute %s' %
+                                 (type(self).__name__, name))
+        value = buffers[name]
+        if isinstance(value, np.ndarray) and value.ndim > 0:
+            offset = self._offsets[name]
+            return value[offset:offset + self._lengths[name]]
+        return value
+
+    def __setattr__(self, name, value):
+        if name in self.variables and '_buffers' in self.__dict__:
+            if name in self._owned:  # Keeping buffer for appending
+                self._spare[name] = self._buffers[name]
+            self._set_variable(name, value)
+        else:
+            object.__setattr__(self, name, value)
+
+    def _set_variable(self, name, value, offset=0, owned=False):
+        """Store array (as buffer, without copying) or scalar value."""
+        self._buffers[name] = value
+        if isinstance(value, np.ndarray) and value.ndim > 0:
+            self._offsets[name] = offset
+            self._set_length(name, len(value) - offset)
+        else:
+            self._offsets.pop(name, None)
+            self._set_length(name, len(np.atleast_1d(value)))
+        if owned is True:
+            self._owned.add(name)
+        else:
+            self._owned.discard(name)
+
+    def _new_buffer(self, name, dtype, length, size):
+        """Return spare buffer of variable if possible, else allocate.
+
+        The spare buffer is only reused if it is large enough, and not
+        referenced elsewhere (e.g. by a view of earlier values), since
+        these references shall not change.
+        """
+        spare = self._spare.pop(name, None)
+        # References: this local variable and argument of getrefcount
+        if spare is not None and spare.dtype == dtype and \
+                len(spare) >= length and sys.getrefcount(spare) <= 2:
+            return spare
+        return np.empty(size, dtype=dtype)
+
+    def _set_length(self, name, length):
+        self._lengths[name] = length
+        if self._length is not None:
+            if length > self._length:
+                self._length = length
+            elif length < self._length:
+                self._length = None  # To be recalculated
+
+    def reserve(self, capacity):
+        """Preallocate buffers for (at least) given number of elements."""
+        self.__dict__['_capacity'] = capacity
+        for var in self.variables:
+            value = self._buffers.get(var)
+            if not isinstance(value, np.ndarray) or value.ndim == 0:
+                continue  # Scalars remain scalars
+            length = self._lengths[var]
+            if var in self._owned and \
+                    len(value) - self._offsets[var] >= capacity:
+                continue
+            buffer = self._new_buffer(var, value.dtype, max(capacity, length),
+                                      max(capacity, length))
+            buffer[0:length] = getattr(self, var)
+            self._set_variable(var, buffer[0:length], owned=True)
+            self._buffers[var] = buffer
+
+    def _append(self, name, values):
+        """Append array of values to array variable."""
+        value = self._buffers[name]
+        if not isinstance(value, np.ndarray) or value.ndim == 0:
+            self._set_variable(name, np.atleast_1d(np.asarray(value)))
+        present = getattr(self, name)
+        length = len(present)
+        new_length = length + len(values)
+        buffer = self._buffers[name]
+        offset = self._offsets[name]
+        dtype = np.promote_types(present.dtype, values.dtype)
+        if name in self._owned and dtype == buffer.dtype and \
+                offset + new_length <= len(buffer):
+            buffer[offset + length:offset + new_length] = values
+            self._set_length(name, new_length)
+            return
+        # Spare or larger buffer, with room for future appending
+        buffer = self._new_buffer(name, dtype, new_length,
+                                  max(new_length, 2*length, self._capacity))
+        buffer[0:length] = present
+        buffer[length:new_length] = values
+        self._set_variable(name, buffer[0:new_length], owned=True)
+        self._buffers[name] = buffer
+
+    def _remove(self, name, indices, num_removed, is_prefix):
+        """Remove elements with given indices (boolean) from variable."""
+        present = getattr(self, name)
+        length = len(present)
+        if is_prefix is True:  # No copying needed
+            self._offsets[name] += num_removed
+        elif name in self._owned:  # Compacting in place
+            offset = self._offsets[name]
+            self._buffers[name][offset:offset + length - num_removed] = \
+                present[~indices]
+        else:
+            self._set_variable(name, present[~indices], owned=True)
+            return
+        self._set_length(name, length - num_removed)
+
     def extend(self, other):
         """Add elements from another object."""
         len_self = len(self)
@@ -161,11 +296,10 @@ class LagrangianArray(object):
 
             else:  # Otherwise we create arrays and concatenate
                 if not hasattr(present_data, '__len__'):
-                    present_data = present_data*np.ones(len_self)
+                    setattr(self, var, present_data*np.ones(len_self))
                 if not hasattr(new_data, '__len__'):
                     new_data = new_data*np.ones(len_other)
-                setattr(self, var, np.concatenate((present_data,
-                                                   new_data)))
+                self._append(var, np.asarray(new_data))
 
     def move_elements(self, other, indices):
         """Remove elements with given indices, and append to another object.
@@ -176,49 +310,35 @@ class LagrangianArray(object):
         # NB: scalars and 1D arrays are converted to ndarrays and concatenated
         self_len = len(self)
         other_len = len(other)
+        num_moved = np.sum(indices)
+        # Removing the first elements only requires moving offsets
+        is_prefix = bool(np.all(indices[0:num_moved]))
         for var in self.variables:
             self_var = getattr(self, var)
             other_var = getattr(other, var)
             if (not isinstance(self_var, np.ndarray) and
                 not isinstance(other_var, np.ndarray)) and \
                     (other_var == self_var):
-                    if np.sum(indices) == len(self):
+                    if num_moved == len(self):
                         setattr(self, var, [])  # Empty if all elements moved
                     continue  # Equal scalars - we do nothing
 
             # Copy elements to other
-            self_var = np.atleast_1d(self_var)
-            other_var = np.atleast_1d(other_var)
-            if len(self_var) < self_len:  # Convert scalar to array
-                self_var = self_var*np.ones(self_len)
-            if len(other_var) < other_len:  # Convert scalar to aray
-                other_var = other_var*np.ones(other_len)
-            if len(self_var) > 0:
-                setattr(other, var, np.concatenate((other_var,
-                                                    self_var[indices])))
-            else:
-                setattr(other, var, self_var[indices])
-            setattr(self, var, self_var[~indices])  # Remove from self
-
-            #if isinstance(self_var, np.ndarray) or\
-            #    isinstance(other_var, np.ndarray):  # Array
-            #    setattr(other, var,
-            #            np.concatenate((getattr(other, var),
-            #                            getattr(self, var)[indices])))
-            #    # Remove elements from self
-            #    setattr(self, var, getattr(self, var)[~indices])
-            #elif isinstance(getattr(other, var), np.ndarray):
-            #    setattr(other, var,
-            #            np.concatenate((getattr(other, var),
-            #                            np.atleast_1d(getattr(self, var)))))
-            #else:
-            #    setattr(other, var, getattr(self, var))  # Scalar
+            if np.ndim(self_var) == 0 or len(self_var) < self_len:
+                # Convert scalar to array
+                setattr(self, var, np.atleast_1d(self_var)*np.ones(self_len))
+            if np.ndim(other_var) == 0 or len(other_var) < other_len:
+                # Convert scalar to array
+                setattr(other, var,
+                        np.atleast_1d(other_var)*np.ones(other_len))
+            if self_len > 0:
+                other._append(var, getattr(self, var)[indices])
+                self._remove(var, indices, num_moved, is_prefix)
 
     def __len__(self):
-        length = 0
-        for var in self.variables:
-            length = np.maximum(length, len(np.atleast_1d(getattr(self, var))))
-        return length
+        if self._length is None:
+            self.__dict__['_length'] = max([0] + list(self._lengths.values()))
+        return self._length
 
     def __repr__(self):
         outStr = ''
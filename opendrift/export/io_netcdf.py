@@ -2,28 +2,97 @@ from future.utils import iteritems
 import sys
 from datetime import datetime, timedelta
 import string
-from shutil import move
 import logging
 
 import numpy as np
 from netCDF4 import Dataset, num2date, date2num
 
+from opendrift.history import RaggedHistory, FileHistory
+
 # Module with functions to export/import trajectory data to/from netCDF file
 # Strives to be compliant with netCDF CF-convention on trajectories
 # http://cfconventions.org/Data/cf-conventions/cf-conventions-1.6/build/cf-conventions.html#idp8377728
 # https://geo-ide.noaa.gov/wiki/index.php?title=NODC_NetCDF_Trajectory_Template
 
 skip_parameters = ['ID']  # Do not write to file
+time_units = 'seconds since 1970-01-01 00:00:00'
+
+
+encoding_settings = ['zlib', 'complevel', 'shuffle',
+                     'least_significant_digit', 'chunksizes']
+
+
+def variable_encoding(self, prop, dimensions, encoding):
+    """Return netCDF4 compression and chunking settings for a variable.
+
+    encoding is a dict with settings per variable name, settings with key
+    'default' apply to all variables. chunksizes may be given as a tuple,
+    or as 'trajectory' or 'time' to tune chunks for reading one trajectory
+    or one time step at a time.
+    """
+    if not encoding:
+        return {}
+    settings = dict(encoding.get('default', {}))
+    settings.update(encoding.get(prop, {}))
+    for key in settings:
+        if key not in encoding_settings:
+            raise ValueError('Unknown encoding setting "%s" for %s, '
+                             'allowed settings: %s' %
+                             (key, prop, str(encoding_settings)))
+    chunksizes = settings.get('chunksizes')
+    if isinstance(chunksizes, str):
+        settings['chunksizes'] = chunk_shape(self, chunksizes, dimensions)
+    elif chunksizes is not None and len(chunksizes) > len(dimensions):
+        # E.g. properties stored once per trajectory
+        settings['chunksizes'] = tuple(chunksizes[0:len(dimensions)])
+    elif chunksizes is not None and dimensions == ('trajectory', 'time') \
+            and self.export_buffer_length % chunksizes[1] != 0:
+        logging.warning('Time chunk length %s of %s does not divide '
+                        'export_buffer_length %s, chunks will be written '
+                        'several times' % (chunksizes[1], prop,
+                                           self.export_buffer_length))
+    return settings
 
 
-def init(self, filename, times=None):
+def chunk_shape(self, access, dimensions, chunk_values=2**16):
+    """Chunk shape for reading per 'trajectory' or per 'time' step.
+
+    Time chunks are no longer than the export buffer, so that each
+    buffer write fills complete chunks.
+    """
+    if access not in ['trajectory', 'time']:
+        raise ValueError('Chunking must be "trajectory" or "time", '
+                         'or a tuple of chunk sizes')
+    num_elements = max(self.num_elements_total(), 1)
+    if len(dimensions) == 1:
+        # Observations of each output step are appended contiguously
+        return (num_elements,)
+    if access == 'time':
+        return (num_elements, 1)
+    return (max(1, min(num_elements,
+                       chunk_values // self.export_buffer_length)),
+            self.export_buffer_length)
+
+
+def init(self, filename, times=None, encoding=None):
 
     self.outfile_name = filename
     self.outfile = Dataset(filename, 'w')
     self.outfile.createDimension('trajectory', self.num_elements_total())
     self.outfile.createVariable('trajectory', 'i4', ('trajectory',))
-    self.outfile.createDimension('time', None)  # Unlimited time dimension
-    self.outfile.createVariable('time', 'f8', ('time',))
+    if isinstance(self.history, RaggedHistory):
+        # Indexed ragged array, observations are appended in time order
+        self.outfile.createDimension('obs', None)
+        self.outfile.createVariable('trajectory_index', 'i4', ('obs',))
+        self.outfile.variables['trajectory_index'].instance_dimension = \
+            'trajectory'
+        self.outfile.createVariable('time', 'f8', ('obs',))
+        dimensions = ('obs',)
+    else:
+        # Fixed time dimension for CDM compliance, if size is known
+        self.outfile.createDimension('time', times)
+        self.outfile.createVariable('time', 'f8', ('time',))
+        dimensions = ('trajectory', 'time')
     # NB: trajectory_id must be changed for future ragged array representation
     self.outfile.variables['trajectory'][:] = \
         np.arange(self.num_elements_total())+1
@@ -49,18 +118,30 @@ def init(self, filename, times=None):
             value = str(value)
         self.outfile.setncattr('config_' + key, value)
 
-    # Add all element properties as variables
-    for prop in self.history.dtype.fields:
+    # Add all element properties as variables, where properties which are
+    # constant for each element are stored once per trajectory
+    properties = [(prop, self.history.dtype, dimensions)
+                  for prop in self.history.dtype.fields]
+    constants = getattr(self, 'history_constants', None)
+    if constants is not None:
+        properties.extend([(prop, constants.dtype, ('trajectory',))
+                           for prop in constants.dtype.fields])
+    for prop, prop_dtype, dims in properties:
         if prop in skip_parameters:
             continue
         # Note: Should use 'f8' if 'f4' is not accurate enough,
         #       at expense of larger files
         try:
-            dtype = self.history.dtype[prop]
+            dtype = prop_dtype[prop]
         except:
             dtype = 'f4'
-        var = self.outfile.createVariable(prop, dtype, ('trajectory', 'time'))
-        var.setncattr('coordinates', 'lat lon time')
+        if dtype == np.float16:
+            dtype = 'f4'  # Half precision is not supported by netCDF
+        var = self.outfile.createVariable(
+            prop, dtype, dims,
+            **variable_encoding(self, prop, dims, encoding))
+        if dims != ('trajectory',):
+            var.setncattr('coordinates', 'lat lon time')
         for subprop in self.history_metadata[prop].items():
             if subprop[0] not in ['dtype', 'constant', 'default']:
                 # Apparently axis attribute shall not be given for lon and lat:
@@ -68,23 +149,65 @@ def init(self, filename, times=None):
                     continue
                 var.setncattr(subprop[0], subprop[1])
 
-def write_buffer(self):
-    num_steps_to_export = self.steps_output - self.steps_exported
-    for prop in self.history_metadata:
-        if prop in skip_parameters:
-            continue
-        var = self.outfile.variables[prop]
-        var[:, self.steps_exported:self.steps_exported+num_steps_to_export] = \
-            self.history[prop][:, 0:num_steps_to_export]
+def write_buffer(self, history=None, steps_exported=None, steps_output=None):
+    """Write history buffer to file, and reset the buffer.
+
+    For asynchronous export, a full buffer is given with the steps
+    exported before it and the steps output when it was full; the
+    buffer is then returned, and self.steps_exported is not updated.
+    """
+    if history is None:
+        history = self.history
+        steps_exported = self.steps_exported
+        steps_output = self.steps_output
+    num_steps_to_export = steps_output - steps_exported
+    if isinstance(history, RaggedHistory):
+        write_ragged_buffer(self, history, steps_exported)
+    else:
+        for prop in history.dtype.names:
+            if prop in skip_parameters:
+                continue
+            var = self.outfile.variables[prop]
+            var[:, steps_exported:steps_exported+num_steps_to_export] = \
+                history[prop][:, 0:num_steps_to_export]
+        history.mask = True  # Reset history array, for new data
 
     logging.info('Wrote %s steps to file %s' % (num_steps_to_export,
                                                 self.outfile_name))
-    self.history.mask = True  # Reset history array, for new data
-    self.steps_exported = self.steps_exported + num_steps_to_export
+    if history is self.history:
+        self.steps_exported = self.steps_exported + num_steps_to_export
     self.outfile.sync()  # Flush from memory to disk
+    return history
+
+def write_ragged_buffer(self, history, steps_exported):
+    """Append observations of ragged history to the obs dimension."""
+    index = history.unique_observations()
+    start = len(self.outfile.dimensions['obs'])
+    end = start + len(index)
+    if end > start:
+        self.outfile.variables['trajectory_index'][start:end] = \
+            history.element_index[index]
+        steps = history.time_index[index] + steps_exported
+        self.outfile.variables['time'][start:end] = \
+            date2num(self.start_time, time_units) + \
+            steps*self.time_step_output.total_seconds()
+        for prop in history.dtype.names:
+            if prop in skip_parameters:
+                continue
+            data = history.observations[prop][index]
+            if data.dtype.kind == 'f':
+                data = np.ma.masked_invalid(data)
+            self.outfile.variables[prop][start:end] = data
+    history.clear()  # Reset history, for new data
 
 def close(self):
 
+    # Write properties which are constant for each element
+    constants = getattr(self, 'history_constants', None)
+    if constants is not None:
+        for prop in constants.dtype.names:
+            self.outfile.variables[prop][0:len(constants)] = constants[prop]
+
     # Write status categories metadata
     status_dtype = self.ElementType.variables['status']['dtype']
     self.outfile.variables['status'].valid_range = np.array([0]).astype(
@@ -96,23 +219,36 @@ def close(self):
         " ".join(self.status_categories)
     # Write timesteps to file
     self.outfile.time_coverage_end = str(self.time)
-    timeStr = 'seconds since 1970-01-01 00:00:00'
-    times = [self.start_time + n*self.time_step_output for n in
-             range(self.steps_output)]
-    self.outfile.variables['time'][0:len(times)] = date2num(times, timeStr)
-    self.outfile.variables['time'].units = timeStr
+    ragged = isinstance(self.history, RaggedHistory)
+    if not ragged:
+        # All times of the (fixed) time dimension must be valid
+        num_times = max(len(self.outfile.dimensions['time']),
+                        self.steps_output)
+        times = [self.start_time + n*self.time_step_output for n in
+                 range(num_times)]
+        self.outfile.variables['time'][0:len(times)] = date2num(times,
+                                                                time_units)
+    self.outfile.steps_output = self.steps_output
+    self.outfile.num_elements_activated = self.num_elements_activated()
+    self.outfile.variables['time'].units = time_units
     self.outfile.variables['time'].standard_name = 'time'
     self.outfile.variables['time'].long_name = 'time'
     # Apparently axis attribute shall not be given for time, lon and lat
     #self.outfile.variables['time'].axis = 'T'
 
     # Write bounds metadata
-    self.outfile.geospatial_lat_min = self.history['lat'].min()
-    self.outfile.geospatial_lat_max = self.history['lat'].max()
+    if ragged:
+        lat = self.outfile.variables['lat'][:]
+        lon = self.outfile.variables['lon'][:]
+    else:
+        lat = self.history['lat']
+        lon = self.history['lon']
+    self.outfile.geospatial_lat_min = lat.min()
+    self.outfile.geospatial_lat_max = lat.max()
     self.outfile.geospatial_lat_units = 'degrees_north'
     self.outfile.geospatial_lat_resolution = 'point'
-    self.outfile.geospatial_lon_min = self.history['lon'].min()
-    self.outfile.geospatial_lon_max = self.history['lon'].max()
+    self.outfile.geospatial_lon_min = lon.min()
+    self.outfile.geospatial_lon_max = lon.max()
     self.outfile.geospatial_lon_units = 'degrees_east'
     self.outfile.geospatial_lon_resolution = 'point'
     self.outfile.runtime = str(datetime.now() -
@@ -123,68 +259,93 @@ def close(self):
         for key, value in iteritems(self.metadata_dict):
             self.outfile.setncattr(key, str(value))
 
+    num_trajectories = len(self.outfile.dimensions['trajectory'])
     self.outfile.close()  # Finally close file
 
-    # Finally changing UNLIMITED time dimension to fixed, for CDM compliance.
-    # Fortunately this is quite fast.
-    # http://www.unidata.ucar.edu/software/thredds/current/netcdf-java/reference/FeatureDatasets/CFpointImplement.html
-    try:
-        logging.debug('Making netCDF file CDM compliant with fixed dimensions')
-        with Dataset(self.outfile_name) as src, \
-                Dataset(self.outfile_name + '_tmp', 'w') as dst:
-            for name, dimension in iteritems(src.dimensions):
-                if name=='trajectory':
-                    # Truncate dimension length to  number actually seeded
-                    dst.createDimension(name, self.num_elements_activated())
-                else:
-                    dst.createDimension(name, len(dimension))
-
-            for name, variable in iteritems(src.variables):
-                dstVar = dst.createVariable(name, variable.datatype,
-                                             variable.dimensions)
-                srcVar = src.variables[name]
-                # Truncate data to number actually seeded
-                if 'trajectory' in variable.dimensions:
-                    if len(variable.dimensions) == 2:
-                        dstVar[:] = srcVar[0:self.num_elements_activated(), :] 
-                    else:
-                        dstVar[:] = srcVar[0:self.num_elements_activated()]  # Copy data
-                else:
-                    dstVar[:] = srcVar[:]
-                for att in src.variables[name].ncattrs():
-                    # Copy variable attributes
-                    dstVar.setncattr(att, srcVar.getncattr(att))
-
-            for att in src.ncattrs():  # Copy global attributes
-                dst.setncattr(att, src.getncattr(att))
-
-        move(self.outfile_name + '_tmp', self.outfile_name)  # Replace original
-    except Exception as me:
-        print(me)
-        print('Could not convert netCDF file from unlimited to fixed dimension. Could be due to netCDF library incompatibility(?)')
-    
-
-def import_file(self, filename, time=None):
+    if not ragged and (self.steps_output < num_times or
+                       self.num_elements_activated() < num_trajectories):
+        logging.debug('Simulation stopped after %s of %s output steps, '
+                      'with %s of %s elements seeded. Remaining values in '
+                      'file are masked.' % (self.steps_output, num_times,
+                      self.num_elements_activated(), num_trajectories))
+
+
+def file_history(self, filename):
+    """History of last run, read on demand from output file."""
+    return FileHistory(filename, shape=(self.num_elements_activated(),
+                                        self.steps_output))
+
+
+def import_file(self, filename, time=None, variables=None, elements=None,
+                time_range=None):
+    """Import history and state of elements from file.
+
+    Only the requested parts of the file are read:
+        time: datetime of a single output time step to be read, from
+            which elements are initialised. Default is to read all time
+            steps, and initialise elements from their last state.
+        time_range: (start, end) datetimes of output time steps to read.
+        variables: list of variables to read, in addition to lon, lat
+            and status. Default is all variables.
+        elements: slice or list of indices (from 0) of elements to read.
+            Default is all elements.
+    """
 
     infile = Dataset(filename, 'r')
-    self.start_time = num2date(infile.variables['time'][0],
-                               infile.variables['time'].units)
-    if len(infile.variables['time']) > 1:
-        self.end_time = num2date(infile.variables['time'][-1],
-                             infile.variables['time'].units)
-        self.time_step_output = num2date(infile.variables['time'][1],
-            infile.variables['time'].units) - self.start_time
+    ragged = 'trajectory_index' in infile.variables
+    units = infile.variables['time'].units
+    if ragged:
+        obs_times = infile.variables['time'][:]
+        times = np.unique(obs_times)
+    else:
+        times = infile.variables['time'][:]
+    if len(times) > 1:
+        self.time_step_output = num2date(times[1], units) - \
+            num2date(times[0], units)
     else:
         self.time_step_output = timedelta(hours=1)
-        self.end_time = self.start_time
-    self.time = self.end_time  # Using end time as default
+    dt = self.time_step_output.total_seconds()
     self.status_categories = infile.variables['status'].flag_meanings.split()
 
-    num_elements = len(infile.dimensions['trajectory'])
-    num_timesteps = len(infile.dimensions['time'])
-    self.steps_output = num_timesteps
-    dtype = np.dtype([(var[0], var[1]['dtype'])
-                      for var in self.ElementType.variables.items()])
+    # Dimensions are sized before the run, and may include elements
+    # never seeded, and time steps after the simulation stopped. Elements
+    # and time steps without observations are not seen in ragged files.
+    attributes = infile.ncattrs()
+    if ragged:
+        trajectory_index = infile.variables['trajectory_index'][:]
+        time_index = np.round((obs_times - times[0]) / dt).astype(np.int32)
+        num_elements = trajectory_index.max() + 1
+        num_timesteps = time_index.max() + 1
+    else:
+        num_elements = len(infile.dimensions['trajectory'])
+        num_timesteps = len(infile.dimensions['time'])
+    if 'num_elements_activated' in attributes:
+        num_elements = int(infile.num_elements_activated)
+    if 'steps_output' in attributes:
+        num_timesteps = int(infile.steps_output)
+
+    # Output time steps and elements to be read
+    if time is not None:
+        first = int(np.round((date2num(time, units) - times[0]) / dt))
+        if first < 0 or first >= num_timesteps:
+            raise ValueError('Time %s is not covered by file %s' %
+                             (time, filename))
+        steps = slice(first, first + 1)
+    elif time_range is not None:
+        steps = slice(
+            max(0, int(np.ceil((date2num(time_range[0], units) -
+                                times[0]) / dt))),
+            min(num_timesteps, int(np.floor((date2num(time_range[1], units) -
+                                             times[0]) / dt)) + 1))
+        if steps.stop <= steps.start:
+            raise ValueError('Time range %s is not covered by file %s' %
+                             (str(time_range), filename))
+    else:
+        steps = slice(0, num_timesteps)
+    if elements is None:
+        elements = slice(0, num_elements)
+    element_index = np.arange(num_elements)[elements]
+    num_timesteps = steps.stop - steps.start
 
     history_dtype_fields = [
         (name, self.ElementType.variables[name]['dtype'])
@@ -194,30 +355,71 @@ def import_file(self, filename, time=None):
     for env_var in self.required_variables:
         history_dtype_fields.append((env_var, np.dtype('float32')))
         self.history_metadata[env_var] = {}
-    history_dtype = np.dtype(history_dtype_fields)
-
-    # Import whole dataset (history)
-    self.history = np.ma.array(
-        np.zeros([num_elements, num_timesteps]),
-        dtype=history_dtype, mask=[True])
-    for var in infile.variables:
-        if var in ['time', 'trajectory']:
-            continue
-        try:
-            self.history[var] = infile.variables[var][:, :]
-        except:
-            pass
+    if variables is None:
+        variables = [var for var in infile.variables
+                     if var in dict(history_dtype_fields)]
+    else:
+        variables = [var for var in infile.variables if var in
+                     set(variables) | set(['lon', 'lat', 'status'])]
+        history_dtype_fields = [field for field in history_dtype_fields
+                                if field[0] in variables]
+    # Properties stored once per element (trajectory)
+    constants = [var for var in variables if
+                 infile.variables[var].dimensions == ('trajectory',)]
+    history_dtype = np.dtype([field for field in history_dtype_fields
+                              if field[0] not in constants])
+    variables = [var for var in variables if var not in constants]
+    if len(constants) > 0:
+        self.history_constants = np.ma.array(
+            np.zeros(len(element_index)), dtype=np.dtype(
+                [field for field in history_dtype_fields
+                 if field[0] in constants]))
+        for var in constants:
+            self.history_constants[var] = \
+                infile.variables[var][:][element_index]
+    else:
+        self.history_constants = None
+
+    # Import requested part of dataset (history)
+    if ragged:
+        obs = np.isin(trajectory_index, element_index) & \
+            (time_index >= steps.start) & (time_index < steps.stop)
+        position = np.zeros(num_elements, dtype=np.int32)
+        position[element_index] = np.arange(len(element_index))
+        self.history = RaggedHistory(history_dtype,
+                                     (len(element_index), num_timesteps),
+                                     capacity=max(obs.sum(), 1))
+        self.history.append(position[trajectory_index[obs]],
+                            time_index[obs] - steps.start,
+                            {var: infile.variables[var][obs]
+                             for var in variables})
+    else:
+        if not isinstance(elements, slice):
+            elements = element_index
+        self.history = np.ma.array(
+            np.zeros([len(element_index), num_timesteps]),
+            dtype=history_dtype, mask=[True])
+        for var in variables:
+            self.history[var] = infile.variables[var][elements, steps]
+
+    self.start_time = num2date(times[0], units) + \
+        steps.start*self.time_step_output
+    self.steps_output = num_timesteps
+    self.end_time = self.start_time + \
+        (num_timesteps - 1)*self.time_step_output
+    self.time = self.end_time  # Using end time as default
 
     # Initialise elements from given (or last) state/time
-    firstlast = np.ma.notmasked_edges(self.history['status'], axis=1)
-    index_of_last = firstlast[1][1]
+    rows, cols = np.ma.notmasked_edges(self.history['status'], axis=1)[1]
     kwargs = {}
-    for var in infile.variables:
+    for var in variables:
+        if var in self.ElementType.variables:
+            kwargs[var] = self.history[var][rows, cols]
+    for var in constants:
         if var in self.ElementType.variables:
-            kwargs[var] = self.history[var][
-                np.arange(len(index_of_last)), index_of_last]
+            kwargs[var] = self.history_constants[var][rows]
     # Import element IDs, which are named 'trajectory' in netCDF CF convention
-    kwargs['ID'] = infile.variables['trajectory'][:]
+    kwargs['ID'] = infile.variables['trajectory'][:][element_index][rows]
     self.elements = self.ElementType(**kwargs)
     self.elements_deactivated = self.ElementType()
 
@@ -0,0 +1,307 @@
+import json
+import logging
+from datetime import datetime, timedelta
+
+import numpy as np
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    has_pyarrow = True
+except ImportError:
+    has_pyarrow = False
+
+from opendrift.history import RaggedHistory
+
+# Module with functions to export/import trajectory data to/from Apache
+# Parquet files, for analysis of output as columns (e.g. with pandas/Arrow).
+# The output is a table with one row per element and output time step,
+# with columns time, trajectory (element ID) and element and environment
+# variables. Each export buffer is written as one row group, sorted by
+# time and trajectory. Time and trajectory are delta encoded, and integer
+# properties (e.g. status) are dictionary encoded.
+# Usage: OceanDrift(iomodule='parquet'), and run(outfile='out.parquet')
+# export_encoding may give ParquetWriter options, e.g. {'compression': 'zstd'}
+
+skip_parameters = ['ID']  # Written as column trajectory
+epoch = datetime(1970, 1, 1)
+
+
+def _check_pyarrow():
+    if has_pyarrow is False:
+        raise ImportError('pyarrow is needed for Parquet output')
+
+
+def init(self, filename, times=None, encoding=None):
+
+    _check_pyarrow()
+    self.outfile_name = filename
+    fields = [pa.field('time', pa.timestamp('ms')),
+              pa.field('trajectory', pa.int32())]
+    dictionary_columns = []
+    # Properties which are constant per element are repeated in each row,
+    # which is cheap with dictionary/run length encoding
+    properties = [(prop, self.history.dtype[prop])
+                  for prop in self.history.dtype.names]
+    constants = getattr(self, 'history_constants', None)
+    if constants is not None:
+        properties.extend([(prop, constants.dtype[prop])
+                           for prop in constants.dtype.names])
+    for prop, dtype in properties:
+        if prop in skip_parameters:
+            continue
+        if dtype == np.float16:
+            dtype = np.dtype('float32')  # Half precision not supported
+        if dtype.kind in 'iu' or (constants is not None and
+                                  prop in constants.dtype.names):
+            dictionary_columns.append(prop)
+        fields.append(pa.field(prop, pa.from_numpy_dtype(dtype)))
+
+    metadata = {
+        'opendrift_class': self.__class__.__name__,
+        'opendrift_module': self.__class__.__module__,
+        'time_coverage_start': str(self.start_time),
+        'time_step_calculation': str(self.time_step.total_seconds()),
+        'time_step_output': str(self.time_step_output.total_seconds()),
+        'status_categories': ' '.join(self.status_categories),
+        'readers': str(self.readers.keys())}
+    # Write config settings
+    for key in self._config_hashstrings():
+        metadata['config_' + key] = json.dumps(self.get_config(key))
+
+    self.outfile = pq.ParquetWriter(
+        filename, pa.schema(fields, metadata=metadata),
+        use_dictionary=dictionary_columns,
+        column_encoding={'time': 'DELTA_BINARY_PACKED',
+                         'trajectory': 'DELTA_BINARY_PACKED'},
+        **(encoding or {}))
+
+
+def write_buffer(self, history=None, steps_exported=None, steps_output=None):
+    """Write history buffer to file as one row group, and reset buffer."""
+    if history is None:
+        history = self.history
+        steps_exported = self.steps_exported
+        steps_output = self.steps_output
+    num_steps_to_export = steps_output - steps_exported
+
+    if isinstance(history, RaggedHistory):
+        index = history.unique_observations()
+        element_index = history.element_index[index]
+        time_index = history.time_index[index]
+        order = np.lexsort((element_index, time_index))
+        index = index[order]
+        element_index = element_index[order]
+        time_index = time_index[order]
+        values = {prop: np.ma.masked_invalid(history.observations[prop][index])
+                  if history.dtype[prop].kind == 'f' else
+                  history.observations[prop][index]
+                  for prop in history.dtype.names}
+        history.clear()  # Reset history, for new data
+    else:
+        # Rows of seeded elements, sorted by time
+        time_index, element_index = np.nonzero(~np.ma.getmaskarray(
+            history['status'][:, 0:num_steps_to_export]).T)
+        values = {prop: history[prop][element_index, time_index]
+                  for prop in history.dtype.names}
+        history.mask = True  # Reset history array, for new data
+
+    constants = getattr(self, 'history_constants', None)
+    if constants is not None:
+        for prop in constants.dtype.names:
+            values[prop] = constants[prop][element_index]
+
+    if len(element_index) > 0:
+        seconds = np.round((steps_exported + time_index) *
+                           self.time_step_output.total_seconds())
+        columns = [
+            pa.array(np.datetime64(self.start_time, 's') +
+                     seconds.astype('timedelta64[s]'),
+                     type=pa.timestamp('ms')),
+            pa.array(element_index.astype(np.int32) + 1)]
+        for field in list(self.outfile.schema)[2:]:
+            data = values[field.name]
+            columns.append(pa.array(np.ma.getdata(data), type=field.type,
+                                    mask=np.ma.getmaskarray(data)))
+        table = pa.Table.from_arrays(columns, schema=self.outfile.schema)
+        self.outfile.write_table(table, row_group_size=len(table))
+
+    logging.info('Wrote %s steps to file %s' % (num_steps_to_export,
+                                                self.outfile_name))
+    if history is self.history:
+        self.steps_exported = self.steps_exported + num_steps_to_export
+    return history
+
+
+def close(self):
+
+    # Elements and output steps without rows are not seen from the table
+    metadata = {'time_coverage_end': str(self.time),
+                'steps_output': str(self.steps_output),
+                'num_elements_activated': str(self.num_elements_activated()),
+                'runtime': str(datetime.now() - self.timers['total time'])}
+    if hasattr(self, 'metadata_dict'):
+        for key, value in self.metadata_dict.items():
+            metadata[key] = str(value)
+    if hasattr(self.outfile, 'add_key_value_metadata'):  # pyarrow >= 17
+        self.outfile.add_key_value_metadata(metadata)
+    self.outfile.close()  # Finally close file
+
+
+def read_history(self, filename, time=None, variables=None, elements=None,
+                 time_range=None):
+    """Read (part of) Parquet file into RaggedHistory.
+
+    Returns history, file metadata, variables read and element IDs.
+    Only row groups and columns containing the selection are read.
+    """
+
+    _check_pyarrow()
+    parquetfile = pq.ParquetFile(filename)
+    metadata = {key.decode(): value.decode() for key, value in
+                parquetfile.metadata.metadata.items()}
+    dt = float(metadata['time_step_output'])
+    # Rows are sorted by time, first/last row has the start/end time
+    start_time, end_time = [parquetfile.read_row_group(
+        i, columns=['time']).column('time').to_numpy()[[0, -1]][j].astype(
+        'datetime64[s]').astype(np.int64) for i, j in
+        [(0, 0), (parquetfile.num_row_groups - 1, 1)]]
+    if 'steps_output' in metadata:
+        num_timesteps = int(metadata['steps_output'])
+    else:
+        num_timesteps = int(np.round((end_time - start_time) / dt)) + 1
+    num_elements = max([parquetfile.metadata.row_group(i).column(
+        1).statistics.max for i in range(parquetfile.num_row_groups)])
+    if 'num_elements_activated' in metadata:
+        num_elements = max(num_elements,
+                           int(metadata['num_elements_activated']))
+
+    filters = []
+    steps = slice(0, num_timesteps)
+    if time is not None:
+        first = int(np.round(((time - epoch).total_seconds() -
+                              start_time) / dt))
+        if first < 0 or first >= num_timesteps:
+            raise ValueError('Time %s is not covered by file %s' %
+                             (time, filename))
+        steps = slice(first, first + 1)
+        filters.append(('time', '==', epoch + timedelta(
+            seconds=start_time + first*dt)))
+    elif time_range is not None:
+        steps = slice(
+            max(0, int(np.ceil(((time_range[0] - epoch).total_seconds() -
+                                start_time) / dt))),
+            min(num_timesteps, int(np.floor(
+                ((time_range[1] - epoch).total_seconds() - start_time) /
+                dt)) + 1))
+        if steps.stop <= steps.start:
+            raise ValueError('Time range %s is not covered by file %s' %
+                             (str(time_range), filename))
+        filters.extend([('time', '>=', time_range[0]),
+                        ('time', '<=', time_range[1])])
+    ids = np.arange(num_elements)[
+        slice(None) if elements is None else elements] + 1
+    if elements is not None:
+        filters.append(('trajectory', 'in', ids.tolist()))
+
+    history_dtype_fields = [
+        (name, self.ElementType.variables[name]['dtype'])
+        for name in self.ElementType.variables]
+    # Add environment variables
+    for env_var in self.required_variables:
+        history_dtype_fields.append((env_var, np.dtype('float32')))
+    columns = None
+    if variables is not None:
+        variables = set(variables) | set(['lon', 'lat', 'status'])
+        history_dtype_fields = [field for field in history_dtype_fields
+                                if field[0] in variables]
+        columns = ['time', 'trajectory'] + [
+            name for name in parquetfile.schema_arrow.names
+            if name in variables]
+    history_dtype = np.dtype(history_dtype_fields)
+    table = pq.read_table(filename, columns=columns,
+                          filters=filters if len(filters) > 0 else None)
+
+    seconds = table.column('time').to_numpy().astype(
+        'datetime64[s]').astype(np.int64)
+    metadata['start_time'] = epoch + timedelta(
+        seconds=int(start_time + steps.start*dt))
+    time_index = np.round((seconds - start_time) / dt).astype(
+        np.int32) - steps.start
+    position = np.zeros(num_elements + 1, dtype=np.int32)
+    position[ids] = np.arange(len(ids))
+    element_index = position[table.column('trajectory').to_numpy()]
+
+    values = {}
+    for name in table.column_names:
+        if name in history_dtype.names:
+            column = table.column(name)
+            if history_dtype[name].kind in 'iu':
+                column = column.fill_null(0)
+            values[name] = np.ma.masked_array(
+                column.to_numpy(), mask=column.is_null().to_numpy())
+    history = RaggedHistory(history_dtype,
+                            (len(ids), steps.stop - steps.start),
+                            capacity=max(len(element_index), 1))
+    history.append(element_index, time_index, values)
+    return history, metadata, list(values), ids
+
+
+def file_history(self, filename):
+    """History of last run, read from output file."""
+    history = read_history(self, filename)[0]
+    history.truncate(self.num_elements_activated(), self.steps_output)
+    return history
+
+
+def import_file(self, filename, time=None, variables=None, elements=None,
+                time_range=None):
+    """Import history and state of elements from file.
+
+    time, time_range, variables and elements select the part of the
+    file to be read, as for io_netcdf.import_file.
+    """
+
+    self.history, metadata, variables, ids = read_history(
+        self, filename, time=time, variables=variables, elements=elements,
+        time_range=time_range)
+    self.history_constants = None  # Constants are columns of the history
+    self.history_metadata = self.ElementType.variables.copy()
+    for env_var in self.required_variables:
+        self.history_metadata[env_var] = {}
+    self.status_categories = metadata['status_categories'].split()
+    self.start_time = metadata['start_time']
+    self.time_step_output = timedelta(
+        seconds=float(metadata['time_step_output']))
+    num_elements, num_timesteps = self.history.shape
+    self.steps_output = num_timesteps
+    self.end_time = self.start_time + \
+        (num_timesteps - 1)*self.time_step_output
+    self.time = self.end_time  # Using end time as default
+
+    # Initialise elements from given (or last) state/time
+    rows, cols = np.ma.notmasked_edges(self.history['status'], axis=1)[1]
+    kwargs = {}
+    for var in variables:
+        if var in self.ElementType.variables:
+            kwargs[var] = self.history[var][rows, cols]
+    kwargs['ID'] = ids[rows]
+    self.elements = self.ElementType(**kwargs)
+    self.elements_deactivated = self.ElementType()
+
+    # Remove elements which are scheduled for deactivation
+    self.remove_deactivated_elements()
+
+    # Import and apply config settings
+    for key, value in metadata.items():
+        if key.startswith('config_'):
+            conf_key = key[7:]
+            try:
+                self.set_config(conf_key, json.loads(value))
+                logging.debug('Setting imported config: %s -> %s' %
+                              (conf_key, value))
+            except:
+                logging.warning('Could not set config: %s -> %s' %
+                                (conf_key, value))
+
+    self.time_step = timedelta(seconds=float(
+        metadata['time_step_calculation']))
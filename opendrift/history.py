@@ -0,0 +1,235 @@
+# This file is part of OpenDrift.
+#
+# OpenDrift is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2
+#
+# OpenDrift is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OpenDrift.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2015, Knut-Frode Dagestad, MET Norway
+
+"""Storage of element history as a ragged array of observations.
+
+The default history of a simulation is a masked array of shape
+(elements, time steps), where all element-steps before seeding and after
+deactivation are masked. For long simulations with staggered release,
+most of this array is masked. RaggedHistory stores only the recorded
+element-steps, corresponding to the CF indexed ragged array
+representation of trajectories. The dense (masked) array is built only
+when requested, for plotting and analysis.
+
+FileHistory gives the same view of a history which has been written to
+a netCDF file, reading variables only when requested.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+from netCDF4 import Dataset
+
+
+class RaggedHistory(object):
+    """History of elements, stored as observations with element/time index.
+
+    Indexing with a field name (e.g. history['lon']) returns a dense
+    masked array of shape (elements, time steps), as for the default
+    history array.
+
+    Attributes:
+        dtype: structured dtype of the recorded fields.
+        shape: shape (elements, time steps) of dense representation.
+        observations: structured array of recorded values.
+        element_index, time_index: element (row) and time step (column)
+            of each observation.
+        num_observations: number of recorded observations.
+    """
+
+    def __init__(self, dtype, shape, capacity=1024):
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(shape)
+        self.observations = np.zeros(capacity, dtype=self.dtype)
+        self.element_index = np.zeros(capacity, dtype=np.int32)
+        self.time_index = np.zeros(capacity, dtype=np.int32)
+        self.num_observations = 0
+        self._dense = {}  # Cached dense fields
+
+    def __len__(self):
+        return self.shape[0]
+
+    def append(self, element_index, time_index, values):
+        """Record values (dict of arrays) of elements at time step(s)."""
+        num = len(element_index)
+        if num == 0:
+            return
+        end = self.num_observations + num
+        if end > len(self.observations):
+            capacity = max(end, 2*len(self.observations))
+            for name in ['observations', 'element_index', 'time_index']:
+                old = getattr(self, name)
+                new = np.zeros(capacity, dtype=old.dtype)
+                new[0:self.num_observations] = old[0:self.num_observations]
+                setattr(self, name, new)
+        start = self.num_observations
+        self.element_index[start:end] = element_index
+        self.time_index[start:end] = time_index
+        for field in self.dtype.names:
+            if field in values:
+                self.observations[field][start:end] = np.ma.filled(
+                    values[field], np.nan) \
+                    if self.dtype[field].kind == 'f' else values[field]
+        self.num_observations = end
+        self._dense = {}
+
+    def clear(self):
+        """Remove all observations, e.g. after writing to file."""
+        self.num_observations = 0
+        self._dense = {}
+
+    def truncate(self, num_elements, num_times):
+        """Set shape of dense representation."""
+        self.shape = (num_elements, num_times)
+        self._dense = {}
+
+    def unique_observations(self):
+        """Return indices of observations, sorted by element and time.
+
+        If an element-step is recorded several times, only the last is
+        kept, as when writing to the dense array.
+        """
+        n = self.num_observations
+        if n == 0:
+            return np.array([], dtype=np.int64)
+        key = (self.element_index[0:n].astype(np.int64) *
+               (self.time_index[0:n].max() + 1) + self.time_index[0:n])
+        order = np.lexsort((np.arange(n), key))
+        last = np.append(key[order][1:] != key[order][0:-1], True)
+        return order[last]
+
+    def __getitem__(self, field):
+        if field not in self._dense:
+            index = self.unique_observations()
+            index = index[(self.element_index[index] < self.shape[0]) &
+                          (self.time_index[index] < self.shape[1])]
+            data = np.ma.masked_all(self.shape, dtype=self.dtype[field])
+            data[self.element_index[index], self.time_index[index]] = \
+                self.observations[field][index]
+            if self.dtype[field].kind == 'f':  # Missing values are NaN
+                data = np.ma.masked_invalid(data)
+            self._dense[field] = data
+        return self._dense[field]
+
+    def dense(self):
+        """Return dense masked structured array (elements x time steps)."""
+        history = np.ma.array(np.zeros(self.shape), dtype=self.dtype)
+        history.mask = True
+        for field in self.dtype.names:
+            history[field] = self[field]
+        return history
+
+
+class FileHistory(object):
+    """History of elements, read on demand from an OpenDrift netCDF file.
+
+    Indexing with a field name (e.g. history['lon']) reads the variable
+    from file, and returns a dense masked array of shape
+    (elements, time steps). Subsets may be read with method read.
+    Both the dense (trajectory, time) and the indexed ragged layout
+    are supported. The element and time index of a ragged file are read
+    once, and the last few fields read are kept in memory.
+    """
+
+    max_cached = 3  # Number of fields (or subsets) kept in memory
+
+    def __init__(self, filename, shape=None):
+        self.filename = filename
+        self._cache = OrderedDict()
+        with Dataset(filename) as f:
+            self.ragged = 'trajectory_index' in f.variables
+            fields = [(name, var.dtype) for name, var in f.variables.items()
+                      if name not in ['time', 'trajectory',
+                                      'trajectory_index'] and
+                      var.dimensions in [('trajectory', 'time'), ('obs',)]]
+            if self.ragged:
+                self.element_index = np.asarray(
+                    f.variables['trajectory_index'][:])
+                self.time_index = self._time_index(f)
+            if shape is None:
+                attributes = f.ncattrs()
+                if 'num_elements_activated' in attributes and \
+                        'steps_output' in attributes:
+                    shape = (int(f.num_elements_activated),
+                             int(f.steps_output))
+                elif self.ragged:
+                    shape = (self.element_index.max() + 1,
+                             self.time_index.max() + 1)
+                else:
+                    shape = (len(f.dimensions['trajectory']),
+                             len(f.dimensions['time']))
+        self.dtype = np.dtype(fields)
+        self.shape = tuple(shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, field):
+        return self.read(field)
+
+    @staticmethod
+    def _time_index(f):
+        """Output time step of each observation in ragged file."""
+        times = f.variables['time'][:]
+        unique_times = np.unique(times)
+        if len(unique_times) < 2:
+            return np.zeros(len(times), dtype=np.int32)
+        return np.round((times - unique_times[0]) /
+                        (unique_times[1] - unique_times[0])).astype(np.int32)
+
+    def read(self, field, elements=None, times=None):
+        """Read field for given elements and time steps.
+
+        elements and times are slices (or None, meaning all) of the
+        dense representation. Returns masked array (elements x times).
+        """
+        if field not in self.dtype.names:
+            raise KeyError('%s not in history file %s' %
+                           (field, self.filename))
+        elements = slice(0, self.shape[0]) if elements is None else elements
+        times = slice(0, self.shape[1]) if times is None else times
+        elements = slice(*elements.indices(self.shape[0]))
+        times = slice(*times.indices(self.shape[1]))
+        key = (field, elements.start, elements.stop, elements.step,
+               times.start, times.stop, times.step)
+        if key in self._cache:
+            self._cache[key] = self._cache.pop(key)  # Most recent last
+            return self._cache[key]
+        data = self._read(field, elements, times)
+        if len(self._cache) >= self.max_cached:
+            self._cache.popitem(last=False)
+        self._cache[key] = data
+        return data
+
+    def _read(self, field, elements, times):
+        with Dataset(self.filename) as f:
+            if not self.ragged:
+                return np.ma.masked_invalid(
+                    f.variables[field][elements, times]) \
+                    if self.dtype[field].kind == 'f' else \
+                    np.ma.array(f.variables[field][elements, times])
+            element_range = np.arange(self.shape[0])[elements]
+            time_range = np.arange(self.shape[1])[times]
+            obs = np.where(np.isin(self.element_index, element_range) &
+                           np.isin(self.time_index, time_range))[0]
+            data = np.ma.masked_all((len(element_range), len(time_range)),
+                                    dtype=self.dtype[field])
+            values = f.variables[field][obs]
+        data[np.searchsorted(element_range, self.element_index[obs]),
+             np.searchsorted(time_range, self.time_index[obs])] = values
+        if self.dtype[field].kind == 'f':
+            data = np.ma.masked_invalid(data)
+        return data
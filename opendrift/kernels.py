@@ -0,0 +1,235 @@
+# This file is part of OpenDrift.
+#
+# OpenDrift is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2
+#
+# OpenDrift is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OpenDrift.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2015, Knut-Frode Dagestad, MET Norway
+
+"""Kernels for the innermost loops of interpolation and element updates.
+
+Each kernel is available with two backends:
+    - numpy: vectorised NumPy implementation (always available)
+    - numba: loops over elements, compiled to parallel machine code
+      without temporary arrays, if numba is installed.
+      Without numba, these are plain (slow) Python loops, used
+      only for testing.
+
+The backend is selected with set_backend(), which is called by
+OpenDriftSimulation.run() with config setting general:kernel_backend.
+"""
+
+import logging
+from math import sin, cos, tan, atan2, sqrt, radians, degrees, floor
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+    has_numba = True
+except ImportError:
+    has_numba = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        """Replacement for numba.njit, returning function uncompiled."""
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
+
+###########################
+# Bilinear gather
+###########################
+
+def bilinear_gather_numpy(flat, indices, weights, layer_index,
+                          layer_weight, layer_size, weight, out):
+    """Add weight times interpolated values to out.
+
+    flat: 1D (raveled) data array
+    indices, weights: (4, n) flat horizontal indices and weights of corners
+    layer_index, layer_weight: (num_layers, n) vertical layers and weights
+    layer_size: number of values in each layer (nx*ny)
+    """
+    for layer in range(layer_index.shape[0]):
+        offset = layer_index[layer]*layer_size
+        for corner in range(4):
+            out += (weight*layer_weight[layer]*weights[corner] *
+                    flat[indices[corner] + offset])
+    return out
+
+
+@njit(parallel=True)
+def bilinear_gather_numba(flat, indices, weights, layer_index,
+                          layer_weight, layer_size, weight, out):
+    for i in prange(out.shape[0]):
+        value = 0.
+        for layer in range(layer_index.shape[0]):
+            offset = layer_index[layer, i]*layer_size
+            for corner in range(4):
+                value += (layer_weight[layer, i]*weights[corner, i] *
+                          flat[indices[corner, i] + offset])
+        out[i] += weight*value
+    return out
+
+
+###########################
+# Profile lookup
+###########################
+
+def profile_at_index_numpy(profiles, zi):
+    """Interpolate profiles (layers x elements) at fractional layer index.
+
+    Elements with zi NaN get the value of the upper layer.
+    """
+    upper = np.maximum(np.floor(zi).astype(np.int), 0)
+    lower = np.minimum(upper+1, profiles.shape[0]-1)
+    weight_upper = 1 - (zi - upper)
+    weight_upper[np.isnan(weight_upper)] = 1
+    return profiles[upper, range(profiles.shape[1])] * weight_upper + \
+        profiles[lower, range(profiles.shape[1])] * (1-weight_upper)
+
+
+@njit(parallel=True)
+def _profile_at_index_loop(profiles, zi, out):
+    num_layers = profiles.shape[0]
+    for i in prange(out.shape[0]):
+        if np.isnan(zi[i]):
+            out[i] = profiles[0, i]
+            continue
+        upper = max(int(floor(zi[i])), 0)
+        lower = min(upper + 1, num_layers - 1)
+        weight_upper = 1 - (zi[i] - upper)
+        out[i] = profiles[upper, i]*weight_upper + \
+            profiles[lower, i]*(1 - weight_upper)
+    return out
+
+
+def profile_at_index_numba(profiles, zi):
+    profiles = np.ascontiguousarray(np.ma.getdata(profiles),
+                                    dtype=np.float64)
+    zi = np.ascontiguousarray(zi, dtype=np.float64)
+    return _profile_at_index_loop(profiles, zi,
+                                  np.empty(profiles.shape[1]))
+
+
+###########################
+# Geodesic forward
+###########################
+
+def geod_fwd_numpy(lon, lat, azimuth, distance):
+    """Positions after moving distance (m) along azimuth (degrees).
+
+    On the WGS84 ellipsoid. Returns longitudes (-180 to 180) and latitudes.
+    """
+    from opendrift.readers.basereader import pyproj
+    geod = pyproj.Geod(ellps='WGS84')
+    lon, lat, back_az = geod.fwd(lon, lat, azimuth, distance)
+    return lon, lat
+
+
+@njit(parallel=True)
+def _vincenty_direct_loop(lon, lat, azimuth, distance, lon2, lat2):
+    a = 6378137.0
+    f = 1/298.257223563
+    b = (1 - f)*a
+    for i in prange(lon.shape[0]):
+        s = distance[i]
+        alpha1 = radians(azimuth[i])
+        sin_alpha1 = sin(alpha1)
+        cos_alpha1 = cos(alpha1)
+        tan_u1 = (1 - f)*tan(radians(lat[i]))
+        cos_u1 = 1/sqrt(1 + tan_u1*tan_u1)
+        sin_u1 = tan_u1*cos_u1
+        sigma1 = atan2(tan_u1, cos_alpha1)
+        sin_alpha = cos_u1*sin_alpha1
+        cos_sq_alpha = 1 - sin_alpha*sin_alpha
+        u_sq = cos_sq_alpha*(a*a - b*b)/(b*b)
+        A = 1 + u_sq/16384*(4096 + u_sq*(-768 + u_sq*(320 - 175*u_sq)))
+        B = u_sq/1024*(256 + u_sq*(-128 + u_sq*(74 - 47*u_sq)))
+        sigma = s/(b*A)
+        for iteration in range(100):
+            cos_2sigma_m = cos(2*sigma1 + sigma)
+            sin_sigma = sin(sigma)
+            cos_sigma = cos(sigma)
+            delta_sigma = B*sin_sigma*(cos_2sigma_m + B/4*(
+                cos_sigma*(-1 + 2*cos_2sigma_m*cos_2sigma_m) -
+                B/6*cos_2sigma_m*(-3 + 4*sin_sigma*sin_sigma) *
+                (-3 + 4*cos_2sigma_m*cos_2sigma_m)))
+            sigma_previous = sigma
+            sigma = s/(b*A) + delta_sigma
+            if abs(sigma - sigma_previous) < 1e-12:
+                break
+        cos_2sigma_m = cos(2*sigma1 + sigma)
+        sin_sigma = sin(sigma)
+        cos_sigma = cos(sigma)
+        tmp = sin_u1*sin_sigma - cos_u1*cos_sigma*cos_alpha1
+        lat2[i] = degrees(atan2(
+            sin_u1*cos_sigma + cos_u1*sin_sigma*cos_alpha1,
+            (1 - f)*sqrt(sin_alpha*sin_alpha + tmp*tmp)))
+        lamda = atan2(sin_sigma*sin_alpha1,
+                      cos_u1*cos_sigma - sin_u1*sin_sigma*cos_alpha1)
+        C = f/16*cos_sq_alpha*(4 + f*(4 - 3*cos_sq_alpha))
+        L = lamda - (1 - C)*f*sin_alpha*(sigma + C*sin_sigma*(
+            cos_2sigma_m + C*cos_sigma*(-1 + 2*cos_2sigma_m*cos_2sigma_m)))
+        lon2[i] = (lon[i] + degrees(L) + 180) % 360 - 180
+    return lon2, lat2
+
+
+def geod_fwd_numba(lon, lat, azimuth, distance):
+    num = len(lon)
+    lon = np.ascontiguousarray(np.broadcast_to(lon, num), dtype=np.float64)
+    lat = np.ascontiguousarray(np.broadcast_to(lat, num), dtype=np.float64)
+    azimuth = np.ascontiguousarray(np.broadcast_to(azimuth, num),
+                                   dtype=np.float64)
+    distance = np.ascontiguousarray(np.broadcast_to(distance, num),
+                                    dtype=np.float64)
+    return _vincenty_direct_loop(lon, lat, azimuth, distance,
+                                 np.empty(num), np.empty(num))
+
+
+###########################
+# Backend selection
+###########################
+
+kernel_backends = {
+    'numpy': {'bilinear_gather': bilinear_gather_numpy,
+              'profile_at_index': profile_at_index_numpy,
+              'geod_fwd': geod_fwd_numpy},
+    'numba': {'bilinear_gather': bilinear_gather_numba,
+              'profile_at_index': profile_at_index_numba,
+              'geod_fwd': geod_fwd_numba}}
+
+backend = 'numba' if has_numba else 'numpy'
+
+
+def set_backend(name='auto'):
+    """Select backend ('auto', 'numpy' or 'numba') for all kernels.
+
+    'auto' selects numba if installed, and numpy otherwise.
+    """
+    global backend
+    if name == 'auto':
+        name = 'numba' if has_numba else 'numpy'
+    if name not in kernel_backends:
+        raise ValueError('Valid kernel backends are: ' +
+                         str(list(kernel_backends)))
+    if name == 'numba' and has_numba is False:
+        logging.warning('numba is not installed, using numpy kernels')
+        name = 'numpy'
+    if name != backend:
+        logging.debug('Using %s kernels' % name)
+    backend = name
+
+
+def get_kernel(name):
+    """Return kernel function of given name, for the selected backend."""
+    return kernel_backends[backend][name]
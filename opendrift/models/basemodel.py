@@ -24,6 +24,10 @@ from datetime import datetime, timedelta
 from collections import OrderedDict
 from abc import ABCMeta, abstractmethod, abstractproperty
 import multiprocessing
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None  # Python 2 without futures backport
 import platform
 import netCDF4
 from future.utils import iteritems
@@ -54,9 +58,13 @@ except:
     print('Basemap is not available, can not make plots')
 
 import opendrift
-from opendrift.readers.basereader import pyproj, BaseReader, vector_pairs_xy
+from opendrift.readers.basereader import pyproj, BaseReader, \
+    vector_pairs_xy, coordinate_cache, read_lock
 from opendrift.readers import reader_from_url
 from opendrift.models.physics_methods import PhysicsMethods
+from opendrift.kernels import get_kernel, set_backend
+from opendrift.history import RaggedHistory
+from opendrift import statistics as statistics_module
 
 try:
     basestring
@@ -128,6 +136,11 @@ class OpenDriftSimulation(PhysicsMethods):
                 coastline_action = option('none', 'stranding', 'previous', default='stranding')
                 time_step_minutes = integer(min=1, max=1440, default=60)
                 time_step_output_minutes = integer(min=1, max=1440, default=None)
+                float_precision = option('float64', 'float32', 'float16', default='float64')
+                kernel_backend = option('auto', 'numpy', 'numba', default='auto')
+                reader_threads = integer(min=1, max=64, default=1)
+                history_storage = option('dense', 'ragged', default='dense')
+                async_export = boolean(default=False)
             [seed]
                 ocean_only = boolean(default=True)
             [drift]
@@ -208,6 +221,7 @@ class OpenDriftSimulation(PhysicsMethods):
         self.steps_output = 0
         self.elements_deactivated = self.ElementType()  # Empty array
         self.elements = self.ElementType()  # Empty array
+        self.statistics = []  # Online statistics, see add_statistics
 
         if loglevel != 'custom':
             logging.getLogger('').handlers = []
@@ -223,13 +237,15 @@ class OpenDriftSimulation(PhysicsMethods):
         try:
             io_module = __import__('opendrift.export.io_' + iomodule,
                                    fromlist=['init', 'write_buffer',
-                                             'close', 'import_file'])
+                                             'close', 'import_file',
+                                             'file_history'])
         except ImportError:
             logging.info('Could not import iomodule ' + iomodule)
         self.io_init = types.MethodType(io_module.init, self)
         self.io_write_buffer = types.MethodType(io_module.write_buffer, self)
         self.io_close = types.MethodType(io_module.close, self)
         self.io_import_file = types.MethodType(io_module.import_file, self)
+        self.io_file_history = types.MethodType(io_module.file_history, self)
 
         self.timer_start('total time')
         self.timer_start('configuration')
@@ -400,6 +416,20 @@ class OpenDriftSimulation(PhysicsMethods):
             self.metadata_dict = OrderedDict()
         self.metadata_dict[key] = value
 
+    def add_statistics(self, statistics):
+        """Add statistics to be aggregated at each output time step.
+
+        statistics is an object, or list of objects, from module
+        opendrift.statistics (e.g. StatusCounts, Sums, Moments, Histogram).
+        """
+        if not isinstance(statistics, list):
+            statistics = [statistics]
+        self.statistics.extend(statistics)
+
+    def write_statistics(self, filename):
+        """Write statistics of last run to netCDF file."""
+        statistics_module.write_netcdf(self, filename)
+
     def prepare_run(self):
         pass  # to be overloaded when needed
 
@@ -463,6 +493,8 @@ class OpenDriftSimulation(PhysicsMethods):
                     np.copy(self.previous_lon[on_land_ID - 1])
                 self.elements.lat[on_land] = \
                     np.copy(self.previous_lat[on_land_ID - 1])
+                coordinate_cache.new_positions(self.elements.lon,
+                                               self.elements.lat)
                 self.environment.land_binary_mask[on_land] = 0
 
     @abstractmethod
@@ -502,13 +534,17 @@ class OpenDriftSimulation(PhysicsMethods):
         if self.proj.is_latlong():
             return lon, lat
         else:
-            x, y = self.proj(lon, lat, inverse=False)
-            if 'ob_tran' in self.proj4:
-                # NB: should check if ob_tran is sufficient condition;
-                # may need lonlat as well?
-                return np.degrees(x), np.degrees(y)
-            else:
-                return x, y
+            return coordinate_cache.lonlat2xy(self.proj.srs, lon, lat,
+                                              self._lonlat2xy)
+
+    def _lonlat2xy(self, lon, lat):
+        x, y = self.proj(lon, lat, inverse=False)
+        if 'ob_tran' in self.proj4:
+            # NB: should check if ob_tran is sufficient condition;
+            # may need lonlat as well?
+            return np.degrees(x), np.degrees(y)
+        else:
+            return x, y
 
     def xy2lonlat(self, x, y):
         """Calculate lon,lat from given x,y (scalars/arrays) in own projection.
@@ -654,23 +690,41 @@ class OpenDriftSimulation(PhysicsMethods):
             logging.info('Setting SRS to latlong, since not defined before.')
             self.set_projection('+proj=latlong')
 
-    def add_readers_from_list(self, urls, timeout=10, lazy=True):
-        '''Make readers from a list of URLs or paths to netCDF datasets'''
+    def add_readers_from_list(self, urls, timeout=10, lazy=True,
+                              catalogue=None):
+        '''Make readers from a list of URLs or paths to netCDF datasets
+
+        catalogue: optional filename of a persistent source catalogue
+            (or SourceCatalogue object), from which lazy readers may
+            tell their coverage without being initialised.
+        '''
 
         if lazy is True:
-            from opendrift.readers.reader_lazy import Reader
-            readers = [Reader(u) for u in urls]
+            from opendrift.readers.reader_lazy import Reader, \
+                SourceCatalogue
+            if isinstance(catalogue, basestring):
+                catalogue = SourceCatalogue(catalogue)
+            readers = [Reader(u, catalogue=catalogue) for u in urls]
             self.add_reader(readers)
             return
 
         readers = [reader_from_url(u, timeout) for u in urls]
         self.add_reader([r for r in readers if r is not None])
 
-    def add_readers_from_file(self, filename, timeout=10, lazy=True):
+    def add_readers_from_file(self, filename, timeout=10, lazy=True,
+                              catalogue=None):
+        '''Make readers from file listing URLs or paths to datasets
+
+        If catalogue is True, the coverage of each source is
+        catalogued in <filename>.catalogue the first time it is opened.
+        '''
         fp = open(filename, 'r')
         sources = fp.readlines()
         sources = [line.strip() for line in sources if line[0] != '#']
-        self.add_readers_from_list(sources, timeout, lazy=lazy)
+        if catalogue is True:
+            catalogue = filename + '.catalogue'
+        self.add_readers_from_list(sources, timeout, lazy=lazy,
+                                   catalogue=catalogue)
 
     def list_environment_variables(self):
         """Return list of all variables provided by the added readers."""
@@ -721,6 +775,20 @@ class OpenDriftSimulation(PhysicsMethods):
 
         return variable_groups, reader_groups, missing_variables
 
+    def get_float_precision(self):
+        '''Return dtypes of reader data and history, from configuration
+
+        Reader data blocks and interpolation use float32 if
+        general:float_precision is float32 or float16 (interpolation
+        in half precision is not safe), and float64 (None) otherwise.
+        Environment variables in history are stored with float16
+        or else float32. Element positions are not affected.
+        '''
+        precision = self.get_config('general:float_precision')
+        if precision == 'float64':
+            return None, np.dtype('float32')
+        return np.dtype('float32'), np.dtype(precision)
+
     def _lazy_readers(self):
         return [r for r in self.readers
                 if self.readers[r].is_lazy is True]
@@ -734,10 +802,31 @@ class OpenDriftSimulation(PhysicsMethods):
 
         lazy_readers = self._lazy_readers()
 
-        if len(lazy_readers) == 0:
+        # Skip readers known from catalogue to be irrelevant,
+        # without initialising them
+        lazyname = None
+        for name in lazy_readers:
+            reader = self.readers[name]
+            if reader.is_catalogued():
+                if self.discard_reader_if_not_relevant(reader):
+                    continue
+                if hasattr(self, 'time') and not reader.covers_time(
+                        self.time):
+                    logging.debug('Catalogue: %s does not cover time %s' %
+                                  (name, self.time))
+                    continue
+                if self.num_elements_active() > 0 and len(
+                        reader.covers_positions(self.elements.lon,
+                                                self.elements.lat)) == 0:
+                    logging.debug('Catalogue: %s does not cover elements' %
+                                  name)
+                    continue
+            lazyname = name
+            break
+
+        if lazyname is None:
             return None
 
-        lazyname = lazy_readers[0]
         reader = self.readers[lazyname]
 
         try:
@@ -809,6 +898,66 @@ class OpenDriftSimulation(PhysicsMethods):
             if self.discard_reader_if_not_relevant(reader):
                 logging.debug('DISCARDED: ' + readername)
 
+    def _profiles_from_reader(self, variable_group, profiles):
+        """Return those of profiles which are in variable group, or None"""
+        if profiles is None:
+            return None
+        profiles_from_reader = list(set(variable_group) & set(profiles))
+        if profiles_from_reader == []:
+            return None
+        return profiles_from_reader
+
+    def prefetch_environment(self, variable_groups, reader_groups,
+                             time, lon, lat, z, profiles):
+        """Fetch variable groups from their first reader concurrently.
+
+        Each reader is handled by one thread, fetching (in sequence)
+        all groups for which it is the first reader, such that the
+        data blocks of a reader are never accessed from two threads.
+        Returns dictionary of (env, env_profiles), or of the raised
+        exception, per index of variable group. Empty if fewer than two
+        readers or if general:reader_threads is 1.
+        """
+        max_workers = self.get_config('general:reader_threads')
+        tasks = OrderedDict()
+        for i, reader_group in enumerate(reader_groups):
+            reader = self.readers[reader_group[0]]
+            if reader.is_lazy or not reader.covers_time(time):
+                continue
+            tasks.setdefault(reader_group[0], []).append(i)
+        if ThreadPoolExecutor is None or max_workers < 2 or len(tasks) < 2:
+            return {}
+
+        dtype = self.get_float_precision()[0]
+
+        def fetch(reader_name):
+            reader = self.readers[reader_name]
+            results = {}
+            for i in tasks[reader_name]:
+                try:
+                    results[i] = reader.get_variables_interpolated(
+                        variable_groups[i],
+                        self._profiles_from_reader(variable_groups[i],
+                                                   profiles),
+                        self.required_profiles_z_range, time,
+                        lon, lat, z, self.use_block, self.proj,
+                        dtype=dtype)
+                except Exception as e:
+                    results[i] = e
+            return results
+
+        logging.debug('Fetching data concurrently from %i readers' %
+                      len(tasks))
+        self.timer_start('main loop:readers:concurrent fetching')
+        prefetched = {}
+        with ThreadPoolExecutor(
+                max_workers=min(max_workers, len(tasks))) as executor:
+            for results in executor.map(fetch, tasks):
+                prefetched.update(results)
+        self.timer_end('main loop:readers:concurrent fetching')
+
+        return prefetched
+
     def get_environment(self, variables, time, lon, lat, z, profiles):
         '''Retrieve environmental variables at requested positions.
 
@@ -844,8 +993,11 @@ class OpenDriftSimulation(PhysicsMethods):
                 logging.debug('Variables not covered by any reader: ' +
                               str(missing_variables))
                 reader = 'NotNone'
+                initialised_any = False
                 while reader is not None:
                     reader = self._initialise_next_lazy_reader()
+                    if reader is not None:
+                        initialised_any = True
                     if reader is not None:
                         if self.discard_reader_if_not_relevant(reader):
                             reader = None
@@ -859,6 +1011,8 @@ class OpenDriftSimulation(PhysicsMethods):
                                 set(reader.variables))
                             if len(missing_variables) == 0:
                                 break  # We cover now all variables
+                if initialised_any is False:
+                    break  # Remaining lazy readers are not relevant
 
         # For each variable/reader group:
         variable_groups, reader_groups, missing_variables = \
@@ -869,6 +1023,10 @@ class OpenDriftSimulation(PhysicsMethods):
                 env[variable] = np.ma.ones(env[variable].shape)\
                     * self.fallback_values[variable]
 
+        # Fetching from first reader of each group concurrently
+        prefetched = self.prefetch_environment(
+            variable_groups, reader_groups, time, lon, lat, z, profiles)
+
         for i, variable_group in enumerate(variable_groups):
             logging.debug('----------------------------------------')
             logging.debug('Variable group %s' % (str(variable_group)))
@@ -898,19 +1056,21 @@ class OpenDriftSimulation(PhysicsMethods):
                     logging.debug('Data needed for %i elements' %
                                   len(missing_indices))
                     # Check if vertical profiles are requested from reader
-                    if profiles is not None:
-                        profiles_from_reader = list(
-                            set(variable_group) & set(profiles))
-                        if profiles_from_reader == []:
-                            profiles_from_reader = None
+                    profiles_from_reader = self._profiles_from_reader(
+                        variable_group, profiles)
+                    if reader_name == reader_group[0] and i in prefetched:
+                        if isinstance(prefetched[i], Exception):
+                            raise prefetched[i]
+                        env_tmp, env_profiles_tmp = prefetched[i]
                     else:
-                        profiles_from_reader = None
-                    env_tmp, env_profiles_tmp = \
-                        reader.get_variables_interpolated(
-                            variable_group, profiles_from_reader,
-                            self.required_profiles_z_range, time,
-                            lon[missing_indices], lat[missing_indices],
-                            z[missing_indices], self.use_block, self.proj)
+                        env_tmp, env_profiles_tmp = \
+                            reader.get_variables_interpolated(
+                                variable_group, profiles_from_reader,
+                                self.required_profiles_z_range, time,
+                                lon[missing_indices], lat[missing_indices],
+                                z[missing_indices], self.use_block,
+                                self.proj,
+                                dtype=self.get_float_precision()[0])
 
                 except Exception as e:
                     logging.info('========================')
@@ -1232,7 +1392,14 @@ class OpenDriftSimulation(PhysicsMethods):
             self.elements_scheduled.lon[indices],
             self.elements_scheduled.lat[indices])
         self.elements_scheduled.move_elements(self.elements, indices)
-        self.elements_scheduled_time = self.elements_scheduled_time[~indices]
+        coordinate_cache.new_positions(self.elements.lon, self.elements.lat)
+        num_released = np.sum(indices)
+        if np.all(indices[0:num_released]):  # First elements, no copy
+            self.elements_scheduled_time = \
+                self.elements_scheduled_time[num_released:]
+        else:
+            self.elements_scheduled_time = \
+                self.elements_scheduled_time[~indices]
         logging.debug('Released %i new elements.' % np.sum(indices))
 
     def closest_ocean_points(self, lon, lat):
@@ -1784,6 +1951,7 @@ class OpenDriftSimulation(PhysicsMethods):
             return  # No elements scheduled for deactivation
         # Basic, but some more housekeeping will be required later
         self.elements.move_elements(self.elements_deactivated, indices)
+        coordinate_cache.new_positions(self.elements.lon, self.elements.lat)
         logging.debug('Removed %i elements.' % (sum(indices)))
         if hasattr(self, 'environment'):
             self.environment = self.environment[~indices]
@@ -1803,7 +1971,8 @@ class OpenDriftSimulation(PhysicsMethods):
 
     def run(self, time_step=None, steps=None, time_step_output=None,
             duration=None, end_time=None, outfile=None, export_variables=None,
-            export_buffer_length=100, stop_on_error=False):
+            export_buffer_length=100, export_encoding=None,
+            statistics_file=None, stop_on_error=False):
         """Start a trajectory simulation, after initial configuration.
 
         Performs the main loop:
@@ -1837,6 +2006,18 @@ class OpenDriftSimulation(PhysicsMethods):
                 - end_time: datetime object defining the end of the simulation
             export_variables: list of variables and parameter names to be
                 saved to file. Default is None (all variables are saved)
+                An empty list means that no history is stored, e.g. if
+                only statistics are needed (see add_statistics)
+            export_encoding: dict with netCDF compression and chunking
+                per variable name, or for all variables with key 'default',
+                e.g. {'default': {'zlib': True, 'chunksizes': 'trajectory'},
+                      'lon': {'least_significant_digit': 5}}
+                Allowed settings are zlib, complevel, shuffle,
+                least_significant_digit and chunksizes (tuple, or
+                'trajectory' or 'time' to tune for reading per trajectory
+                or per time step). Default is None (no compression)
+            statistics_file: netCDF file to which statistics added with
+                add_statistics are written at the end of the run.
         """
 
         # Exporting software and hardware specification, for possible debugging
@@ -1867,6 +2048,9 @@ class OpenDriftSimulation(PhysicsMethods):
         else:
             raise ValueError('Configuration error: ' + str(validation))
 
+        # Select backend (numpy or numba) of computational kernels
+        set_backend(self.get_config('general:kernel_backend'))
+
         if self.num_elements_scheduled() == 0:
             raise ValueError('Please seed elements before starting a run.')
         self.elements = self.ElementType()
@@ -2077,8 +2261,11 @@ class OpenDriftSimulation(PhysicsMethods):
             # Forward simulation, start time has been set when seeding
             self.time = self.start_time
 
+        if export_variables == [] and outfile is not None:
+            raise ValueError('No history to write to %s, as '
+                             'export_variables is empty' % outfile)
         # Add the output variables which are always required
-        if export_variables is not None:
+        if export_variables is not None and export_variables != []:
             export_variables = list(set(export_variables +
                                         ['lon', 'lat', 'ID', 'status']))
         self.export_variables = export_variables
@@ -2089,8 +2276,9 @@ class OpenDriftSimulation(PhysicsMethods):
                                 for name in self.ElementType.variables]
         # Add environment variables
         self.history_metadata = self.ElementType.variables.copy()
+        history_env_dtype = self.get_float_precision()[1]
         for env_var in self.required_variables:
-            history_dtype_fields.append((env_var, np.dtype('float32')))
+            history_dtype_fields.append((env_var, history_env_dtype))
             self.history_metadata[env_var] = {}
 
         # Remove variables from output array, if only subset is requested
@@ -2101,18 +2289,58 @@ class OpenDriftSimulation(PhysicsMethods):
                 if m not in self.export_variables:
                     del self.history_metadata[m]
 
+        # Preallocating space for all elements, to avoid reallocation
+        # and copying when elements are released and deactivated
+        self.elements.reserve(len(self.elements_scheduled) +
+                              len(self.elements))
+        self.elements_deactivated.reserve(len(self.elements_scheduled) +
+                                          len(self.elements))
+
+        # Properties not changing after seeding are stored once per element
+        constant_fields = [f for f in history_dtype_fields if
+                           self.history_metadata.get(f[0], {}).get(
+                               'constant') is True]
+        history_dtype_fields = [f for f in history_dtype_fields
+                                if f not in constant_fields]
+        if len(constant_fields) > 0:
+            self.history_constants = np.ma.array(
+                np.zeros(len(self.elements_scheduled)),
+                dtype=np.dtype(constant_fields))
+            self.history_constants.mask = True
+        else:
+            self.history_constants = None
+
         history_dtype = np.dtype(history_dtype_fields)
-        self.history = np.ma.array(np.zeros((len(self.elements_scheduled),
-                                             self.export_buffer_length)),
-                                   dtype=history_dtype)
-        self.history.mask = True
+        if self.export_variables == []:
+            self.history = None  # Only statistics are collected
+            self.history_constants = None
+        elif self.get_config('general:history_storage') == 'ragged':
+            # Storing only element-steps, dense array built on request
+            self.history = RaggedHistory(
+                history_dtype, (len(self.elements_scheduled),
+                                self.export_buffer_length))
+        else:
+            self.history = np.ma.array(
+                np.zeros((len(self.elements_scheduled),
+                          self.export_buffer_length)), dtype=history_dtype)
+            self.history.mask = True
         self.steps_exported = 0
+        for statistics in self.statistics:
+            statistics.allocate(self, self.expected_steps_output)
 
         if outfile is not None:
-            self.io_init(outfile, times=self.expected_steps_output)
+            self.io_init(outfile, times=self.expected_steps_output,
+                         encoding=export_encoding)
         else:
             self.outfile = None
 
+        self.export_executor = None
+        self.export_future = None
+        if outfile is not None and ThreadPoolExecutor is not None and \
+                self.get_config('general:async_export') is True:
+            # Writer thread, flushing a full buffer while the next is filled
+            self.export_executor = ThreadPoolExecutor(max_workers=1)
+
         #############################
         # Check validity domain
         #############################
@@ -2255,6 +2483,10 @@ class OpenDriftSimulation(PhysicsMethods):
 
         if outfile is not None:
             logging.debug('Writing and closing output file: %s' % outfile)
+            if self.export_executor is not None:
+                self.wait_for_export()
+                self.export_executor.shutdown()
+                self.export_executor = None
             # Write buffer to outfile, and close
             if self.steps_output >= self.steps_exported:
                 # Write last lines, if needed
@@ -2264,18 +2496,31 @@ class OpenDriftSimulation(PhysicsMethods):
         # Remove any elements scheduled for deactivation during last step
         #self.remove_deactivated_elements()
 
-        if export_buffer_length is None:
-            # Remove columns for unseeded elements in history array
-            self.history = self.history[
-                range(self.num_elements_activated()), :]
-            # Remove rows for unreached timsteps in history array
-            self.history = self.history[:, range(self.steps_output)]
-        else:  # If output has been flushed to file during run, we
-               # need to reimport from file to get all data in memory
+        if self.history_constants is not None:
+            self.history_constants = \
+                self.history_constants[0:self.num_elements_activated()]
+
+        if statistics_file is not None:
+            self.write_statistics(statistics_file)
+
+        if self.history is None:
+            pass  # No history stored
+        elif export_buffer_length is None:
+            if isinstance(self.history, RaggedHistory):
+                self.history.truncate(self.num_elements_activated(),
+                                      self.steps_output)
+            else:
+                # Remove columns for unseeded elements in history array
+                self.history = self.history[
+                    range(self.num_elements_activated()), :]
+                # Remove rows for unreached timsteps in history array
+                self.history = self.history[:, range(self.steps_output)]
+        else:  # If output has been flushed to file during run,
+               # history is read from file when needed
             del self.environment
             if hasattr(self, 'environment_profiles'):
                 del self.environment_profiles
-            self.io_import_file(outfile)
+            self.history = self.io_file_history(outfile)
 
         if self.dynamical_landmask is True:
             self.zoom_map(buffer=.2)  # Zooming to extent of trajectories
@@ -2314,6 +2559,12 @@ class OpenDriftSimulation(PhysicsMethods):
              self.time_step_output.total_seconds()) + 1
         self.steps_output = int(np.floor(steps_calculation_float))
 
+        if steps_calculation_float.is_integer():
+            for statistics in self.statistics:
+                statistics.update(self, self.steps_output - 1)
+        if self.history is None:
+            return  # Only statistics are collected
+
         ID_ind = self.elements.ID - 1
         time_ind = self.steps_output - 1 - self.steps_exported
 
@@ -2330,30 +2581,84 @@ class OpenDriftSimulation(PhysicsMethods):
             element_ind = deactivated
             time_ind = np.minimum(time_ind + 1, self.history.shape[1] - 1)
 
-        # Store present state in history recarray
-        for i, var in enumerate(self.elements.variables):
-            if self.export_variables is not None and \
-                    var not in self.export_variables:
-                continue
-            # Temporarily assuming elements numbered
-            # from 0 to num_elements_active()
-            # Does not hold when importing ID from a saved file, where
-            # some elements have been deactivated
-            self.history[var][ID_ind, time_ind] = \
-                getattr(self.elements, var)[element_ind]
-        # Copy environment data to history array
-        for i, var in enumerate(self.environment.dtype.names):
-            if self.export_variables is not None and \
-                    var not in self.export_variables:
-                continue
-            self.history[var][ID_ind, time_ind] = \
-                getattr(self.environment, var)[element_ind]
+        if isinstance(self.history, RaggedHistory):
+            values = {}
+            for var in self.history.dtype.names:
+                if var in self.elements.variables:
+                    values[var] = getattr(self.elements, var)[element_ind]
+                elif var in self.environment.dtype.names:
+                    values[var] = getattr(self.environment, var)[element_ind]
+            self.history.append(ID_ind, time_ind, values)
+        else:
+            # Store present state in history recarray
+            for i, var in enumerate(self.elements.variables):
+                if var not in self.history.dtype.names:
+                    continue  # Not exported, or constant
+                # Temporarily assuming elements numbered
+                # from 0 to num_elements_active()
+                # Does not hold when importing ID from a saved file, where
+                # some elements have been deactivated
+                self.history[var][ID_ind, time_ind] = \
+                    getattr(self.elements, var)[element_ind]
+            # Copy environment data to history array
+            for i, var in enumerate(self.environment.dtype.names):
+                if self.export_variables is not None and \
+                        var not in self.export_variables:
+                    continue
+                self.history[var][ID_ind, time_ind] = \
+                    getattr(self.environment, var)[element_ind]
+
+        if self.history_constants is not None:
+            for var in self.history_constants.dtype.names:
+                self.history_constants[var][ID_ind] = \
+                    getattr(self.elements, var)[element_ind]
 
         # Call writer if buffer is full
         if (self.outfile is not None) and \
                 ((self.steps_output - self.steps_exported) ==
                     self.export_buffer_length):
+            self.export_buffer()
+
+    def export_buffer(self):
+        """Write full history buffer to file.
+
+        With config general:async_export, the full buffer is swapped with
+        a spare buffer, and written by a writer thread while the
+        simulation continues. If the previous buffer is still being
+        written, we wait for it, as there is no third buffer.
+        """
+        if self.export_executor is None:
             self.io_write_buffer()
+            return
+
+        spare = self.wait_for_export()
+        if spare is None:  # First export, allocating spare buffer
+            if isinstance(self.history, RaggedHistory):
+                spare = RaggedHistory(self.history.dtype, self.history.shape)
+            else:
+                spare = np.ma.array(np.zeros(self.history.shape),
+                                    dtype=self.history.dtype)
+                spare.mask = True
+
+        def write(history, steps_exported, steps_output):
+            with read_lock:  # netCDF library is not thread safe
+                return self.io_write_buffer(history, steps_exported,
+                                            steps_output)
+
+        self.export_future = self.export_executor.submit(
+            write, self.history, self.steps_exported, self.steps_output)
+        self.history = spare
+        self.steps_exported = self.steps_output
+
+    def wait_for_export(self):
+        """Wait for writer thread, and return the emptied buffer."""
+        if self.export_future is None:
+            return None
+        self.timer_start('main loop:waiting for export')
+        history = self.export_future.result()  # Raises any write error
+        self.timer_end('main loop:waiting for export')
+        self.export_future = None
+        return history
 
     def report_missing_variables(self):
         """Issue warning if some environment variables missing."""
@@ -2929,7 +3234,7 @@ class OpenDriftSimulation(PhysicsMethods):
                 # Color lines according to given parameter
                 try:
                     if isinstance(linecolor, basestring):
-                        param = self.history[linecolor]
+                        param = self.history_property(linecolor)
                     else:
                         param = linecolor
                 except:
@@ -3407,7 +3712,7 @@ class OpenDriftSimulation(PhysicsMethods):
         plt.xticks(rotation='vertical')
         times = [self.start_time + n*self.time_step_output
                  for n in range(self.steps_output)]
-        data = self.history[prop].T[0:len(times), :]
+        data = self.history_property(prop).T[0:len(times), :]
         if mean is True:  # Taking average over elements
             data = np.mean(data, axis=1)
         plt.plot(times, data)
@@ -3422,9 +3727,23 @@ class OpenDriftSimulation(PhysicsMethods):
         plt.grid()
         plt.show()
 
+    def history_property(self, propname):
+        """Get property from history, as array (elements x time steps).
+
+        Properties stored once per element are repeated for each time
+        step, masked where the element is not seeded or deactivated.
+        """
+        constants = getattr(self, 'history_constants', None)
+        if constants is None or propname not in constants.dtype.names:
+            return self.history[propname]
+        mask = np.ma.getmaskarray(self.history['lon'])
+        return np.ma.array(np.repeat(np.ma.getdata(
+            constants[propname])[0:mask.shape[0], np.newaxis],
+            mask.shape[1], axis=1), mask=mask)
+
     def get_property(self, propname):
         """Get property from history, sorted by status."""
-        prop = self.history[propname].copy()
+        prop = self.history_property(propname).copy()
         status = self.history['status'].copy()
         index_of_first, index_of_last = \
             self.index_of_activation_and_deactivation()
@@ -3466,9 +3785,11 @@ class OpenDriftSimulation(PhysicsMethods):
             azimuth = azimuth + azimuth_srs
 
         # Calculate new positions
-        self.elements.lon, self.elements.lat, back_az = geod.fwd(
+        self.elements.lon, self.elements.lat = get_kernel('geod_fwd')(
             self.elements.lon, self.elements.lat,
             azimuth, velocity*self.time_step.total_seconds())
+        # Transformed positions are outdated
+        coordinate_cache.new_positions(self.elements.lon, self.elements.lat)
 
         # Check that new positions are valid
         if (self.elements.lon.min() < -180) or (
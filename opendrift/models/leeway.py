@@ -35,30 +35,37 @@ class LeewayObj(LagrangianArray):
     """
     variables = LagrangianArray.add_variables([
         ('objectType', {'dtype': np.int16,
+                        'constant': True,
                         'unit': '1',
                         'default': 0}),
         ('orientation', {'dtype': np.int16,
                          'unit': '1',
                          'default': 1}),
         ('jibeProbability', {'dtype': np.float32,
+                             'constant': True,
                              'unit': '1/h',
                              'default': 0.04}),
         ('downwindSlope', {'dtype': np.float32,
+                           'constant': True,
                            'unit': '%',
                            'default': 1}),
         ('crosswindSlope', {'dtype': np.float32,
                             'unit': '1',
                             'default': 1}),
         ('downwindOffset', {'dtype': np.float32,
+                            'constant': True,
                             'unit': 'cm/s',
                             'default': 0}),
         ('crosswindOffset', {'dtype': np.float32,
+                             'constant': True,
                              'unit': 'cm/s',
                              'default': 0}),
         ('downwindEps', {'dtype': np.float32,
+                         'constant': True,
                          'unit': 'cm/s',
                          'default': 0}),
         ('crosswindEps', {'dtype': np.float32,
+                          'constant': True,
                           'unit': 'cm/s',
                           'default': 0})
         ])
@@ -23,6 +23,7 @@ from opendrift.elements.passivetracer import PassiveTracer
 PassiveTracer.variables = PassiveTracer.add_variables([
                             ('wind_drift_factor', {'dtype': np.float32,
                                                    'unit': '%',
+                                                   'constant': True,
                                                    'default': 0.02})])
 
 
@@ -19,6 +19,7 @@ import logging
 from scipy.interpolate import interp1d
 from opendrift.models.basemodel import OpenDriftSimulation
 from opendrift.elements import LagrangianArray
+from opendrift.kernels import get_kernel
 
 
 # Defining the oil element properties
@@ -195,6 +196,7 @@ class OpenDrift3DSimulation(OpenDriftSimulation):
                       'scheme using ' + str(ntimes_mix) +
                       ' fast time steps of dt=' + str(dt_mix) + 's')
 
+        profile_at_index = get_kernel('profile_at_index')
         for i in range(0, ntimes_mix):
             #remember which particles belong to the exact surface
             surface = self.elements.z == 0
@@ -212,44 +214,20 @@ class OpenDrift3DSimulation(OpenDriftSimulation):
             w = self.elements.terminal_velocity
 
             # diffusivity K at depth z+dz
-
-
             dz = 1e-3
-            zi = z_index(-self.elements.z+0.5*dz)
-            upper = np.maximum(np.floor(zi).astype(np.int), 0)
-            lower = np.minimum(upper+1, Kprofiles.shape[0]-1)
-            weight_upper = 1 - (zi - upper)
-            weight_upper[np.isnan(weight_upper)] = 1
-            K1 = Kprofiles[upper, range(Kprofiles.shape[1])] * \
-                weight_upper + \
-                Kprofiles[lower, range(Kprofiles.shape[1])] * \
-                (1-weight_upper)
+            K1 = profile_at_index(Kprofiles,
+                                  z_index(-self.elements.z+0.5*dz))
 
             # diffusivity K at depth z-dz
-            zi = z_index(-self.elements.z-0.5*dz)
-            upper = np.maximum(np.floor(zi).astype(np.int), 0)
-            lower = np.minimum(upper+1, Kprofiles.shape[0]-1)
-            weight_upper = 1 - (zi - upper)
-            weight_upper[np.isnan(weight_upper)] = 1
-            K2 = Kprofiles[upper, range(Kprofiles.shape[1])] * \
-                weight_upper + \
-                Kprofiles[lower, range(Kprofiles.shape[1])] * \
-                (1-weight_upper)
+            K2 = profile_at_index(Kprofiles,
+                                  z_index(-self.elements.z-0.5*dz))
 
             # diffusivity gradient
             dKdz = (K1 - K2) / dz
 
             # K at depth z+dKdz*dt/2 
-            zi = z_index(-(self.elements.z+dKdz*dt_mix/2))
-            upper = np.maximum(np.floor(zi).astype(np.int), 0)
-            lower = np.minimum(upper+1, Kprofiles.shape[0]-1)
-            weight_upper = 1 - (zi - upper)
-            weight_upper[np.isnan(weight_upper)] = 1
-            K3 = Kprofiles[upper, range(Kprofiles.shape[1])] * \
-                weight_upper + \
-                Kprofiles[lower, range(Kprofiles.shape[1])] * \
-                (1-weight_upper)
-
+            K3 = profile_at_index(Kprofiles,
+                                  z_index(-(self.elements.z+dKdz*dt_mix/2)))
 
             # Visser et al. 1996 random walk mixing
             # requires an inner loop time step dt such that
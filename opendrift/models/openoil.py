@@ -47,6 +47,7 @@ class Oil(LagrangianArray):
                      'default': 880}),
         ('wind_drift_factor', {'dtype': np.float32,
                                'units': '%',
+                               'constant': True,
                                'default': 0.03}),
         ('age_exposure_seconds', {'dtype': np.float32,
                                   'units': 's',
@@ -199,7 +200,8 @@ class OpenOil(OpenDriftSimulation):
                                 self.environment.y_wind**2)
 
             # Store evaporation fraction at beginning of timestep
-            fraction_evaporated_previous = self.elements.fraction_evaporated
+            fraction_evaporated_previous = \
+                np.copy(self.elements.fraction_evaporated)
 
             # Evaporate only elements at surface
             at_surface = (self.elements.z == 0)
@@ -18,6 +18,7 @@ from future.utils import iteritems
 import sys
 import logging
 import copy
+import threading
 from bisect import bisect_left
 from abc import abstractmethod, ABCMeta
 from datetime import datetime, timedelta
@@ -27,7 +28,8 @@ from scipy.interpolate import LinearNDInterpolator
 from scipy.ndimage import map_coordinates
 import numpy as np
 
-from opendrift.readers.interpolation import ReaderBlock
+from opendrift.readers.interpolation import ReaderBlock, \
+    interpolate_blocks_in_time
 
 try:
     import pyproj  # Import pyproj
@@ -52,6 +54,27 @@ standard_names = {
     'x_sea_water_velocity': {'valid_min': -10, 'valid_max': 10},
     'y_sea_water_velocity': {'valid_min': -10, 'valid_max': 10}}
 
+
+def mask_invalid_values(env, var):
+    """Replace values of var outside the valid range by NaN."""
+    if var not in standard_names.keys():
+        return
+    invalid = np.where((env[var] < standard_names[var]['valid_min'])
+                       | (env[var] > standard_names[var]['valid_max']))[0]
+    if len(invalid) > 0:
+        logging.warning('Invalid values found for ' + var)
+        logging.warning(env[var][invalid])
+        logging.warning('(allowed range: [%s, %s])' %
+                        (standard_names[var]['valid_min'],
+                         standard_names[var]['valid_max']))
+        logging.warning('Replacing with NaN')
+        env[var][invalid] = np.nan
+
+
+# The netCDF/HDF5 libraries are generally not thread safe, hence
+# readers fetching data concurrently take turns reading from files
+read_lock = threading.Lock()
+
 # Identify x-y vector components/pairs for rotation (NB: not east-west pairs!)
 vector_pairs_xy = [
     ['x_wind', 'y_wind'],
@@ -61,6 +84,81 @@ vector_pairs_xy = [
     ]
 
 
+class CoordinateCache(object):
+    """Memo of x, y coordinates transformed from element positions.
+
+    The simulation registers the element positions (lon, lat) with
+    new_positions() whenever they change, which increments a version
+    counter. Transformations of the registered positions are stored
+    per (version, projection), hence readers (and the simulation)
+    sharing the same projection share the transformed coordinates.
+    Only x and y are stored, for the last few projections, and copies
+    are returned. Other arrays of lon, lat are transformed directly.
+    """
+
+    max_entries = 4
+
+    def __init__(self):
+        self.version = 0
+        self.lon = None  # Registered positions (references, not copies)
+        self.lat = None
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # Readers may be accessed from several threads
+        self.lock = threading.Lock()
+
+    def new_positions(self, lon=None, lat=None):
+        """Register new (or no) element positions, discarding entries."""
+        with self.lock:
+            self.version += 1
+            self.lon = lon
+            self.lat = lat
+            self.entries.clear()
+
+    def clear(self):
+        self.new_positions()
+
+    def is_registered(self, lon, lat):
+        if self.lon is None or not isinstance(lon, np.ndarray) or \
+                not isinstance(lat, np.ndarray) or \
+                lon.shape != self.lon.shape or lat.shape != self.lat.shape:
+            return False
+        return (lon is self.lon or np.array_equal(lon, self.lon)) and \
+            (lat is self.lat or np.array_equal(lat, self.lat))
+
+    def lonlat2xy(self, projection, lon, lat, transform):
+        """Return transform(lon, lat), from cache if available."""
+        with self.lock:
+            version = self.version
+            registered = self.is_registered(lon, lat)
+            key = (version, projection)
+            entry = self.entries.get(key) if registered else None
+            if entry is not None:
+                self.hits += 1
+                self.entries[key] = self.entries.pop(key)  # Most recent
+                return entry[0].copy(), entry[1].copy()
+        x, y = transform(lon, lat)
+        if not registered:
+            return x, y
+        with self.lock:
+            self.misses += 1
+            if self.version == version:  # Positions not changed meanwhile
+                if len(self.entries) >= self.max_entries:
+                    self.entries.popitem(last=False)
+                self.entries[key] = (np.array(x), np.array(y))
+        return x, y
+
+
+# Transformed coordinates shared by all readers and simulations
+coordinate_cache = CoordinateCache()
+
+
+def _is_monotonic(values):
+    differences = np.diff(values)
+    return np.all(differences > 0) or np.all(differences < 0)
+
+
 class fakeproj():
     # For readers with unprojected domain, we emulate a
     # pyproj class with needed functions
@@ -127,6 +225,20 @@ class BaseReader(object):
         # Dictionaries to store blocks of data for reuse (buffering)
         self.var_block_before = {}  # Data for last timestep before present
         self.var_block_after = {}   # Data for first timestep after present
+        self.seafloor_cache = {}    # Indices for extrapolation of blocks
+                                    # towards seafloor, per grid window
+
+        # Time-independent variables (e.g. sea floor depth) are read
+        # only once per window, and stored in permanent blocks
+        if not hasattr(self, 'static_variables'):
+            self.static_variables = []
+        self.var_block_static = {}
+        self.rotation_cache = {}    # Vector rotation angles per grid window
+
+        # Fetch separate blocks for distant clusters of elements, if
+        # total area is less than this fraction of one common block
+        self.clustered_blocks = True
+        self.cluster_area_fraction = 0.5
 
         self.always_valid = False  # Set to True if a single field should
                                    # be valid at all times
@@ -269,12 +381,13 @@ class BaseReader(object):
         """
 
     def _get_variables(self, variables, profiles, profiles_depth,
-                       time, x, y, z, block):
+                       time, x, y, z, block, dtype=None):
         """Wrapper around reader-specific function get_variables()
 
         Performs some common operations which should not be duplicated:
         - monitor time spent by this reader
         - convert any numpy arrays to masked arrays
+        - convert floating point data to dtype, if given
         """
 
         logging.debug('Fetching variables from ' + self.name)
@@ -286,7 +399,8 @@ class BaseReader(object):
             x = np.append(x, [x[-1], x[-1]])
             y = np.append(y, [y[-1], y[-1]])
             z = np.append(z, [profiles_depth[0], profiles_depth[1]])
-        env = self.get_variables(variables, time, x, y, z, block)
+        with read_lock:
+            env = self.get_variables(variables, time, x, y, z, block)
 
         # Make sure x and y are floats (and not e.g. int64)
         if 'x' in env.keys():
@@ -297,6 +411,11 @@ class BaseReader(object):
         for variable in env.keys():
             if isinstance(env[variable], np.ma.MaskedArray):
                 env[variable] = env[variable].filled(np.nan)
+            if dtype is not None and variable not in \
+                    ['x', 'y', 'z', 'time'] and \
+                    isinstance(env[variable], np.ndarray) and \
+                    np.issubdtype(env[variable].dtype, np.floating):
+                env[variable] = env[variable].astype(dtype, copy=False)
 
         # Convolve arrays with a kernel, if reader.convolve is set
         if hasattr(self, 'convolve'):
@@ -327,7 +446,8 @@ class BaseReader(object):
     def get_variables_interpolated(self, variables, profiles=None,
                                    profiles_depth=None, time=None,
                                    lon=None, lat=None, z=None,
-                                   block=False, rotate_to_proj=None):
+                                   block=False, rotate_to_proj=None,
+                                   dtype=None, _cluster=None):
 
         self.timer_start('total')
         self.timer_start('preparing')
@@ -344,6 +464,18 @@ class BaseReader(object):
                              (len(lon), lon.min(), lon.max(), lat.min(),
                               lat.max(), self.name, self.coverage_string()))
 
+        if block is True and self.return_block is True and \
+                _cluster is None:
+            static_variables = self.static_block_variables(variables,
+                                                           profiles)
+            if len(static_variables) > 0:
+                self.timer_end('preparing')
+                self.timer_end('total')
+                return self._get_variables_interpolated_static(
+                    static_variables, ind_covered, variables, profiles,
+                    profiles_depth, time, lon, lat, z, block,
+                    rotate_to_proj, dtype)
+
         # Find reader time_before/time_after
         time_nearest, time_before, time_after, i1, i2, i3 = \
             self.nearest_time(time)
@@ -357,90 +489,119 @@ class BaseReader(object):
         z = z.copy()[ind_covered]  # Send values and not reference
                                    # to avoid modifications
 
+        if block is True and self.return_block is True and \
+                self.clustered_blocks is True and _cluster is None:
+            # Separate blocks for distant clusters of elements
+            clusters = self.cluster_elements(reader_x, reader_y)
+            self._discard_cluster_blocks(variables, len(clusters))
+            if len(clusters) > 1:
+                self.timer_end('preparing')
+                self.timer_end('total')
+                return self._get_variables_interpolated_clusters(
+                    clusters, ind_covered, variables, profiles,
+                    profiles_depth, time, lon, lat, z, block,
+                    rotate_to_proj, dtype)
+
+        if _cluster is None:
+            block_key = str(variables)
+        else:
+            block_key = '%s cluster %i' % (str(variables), _cluster)
+            # Discard blocks of a previous cluster at other positions
+            for var_block in [self.var_block_before, self.var_block_after]:
+                if block_key in var_block and \
+                        var_block[block_key].covers_positions(
+                            reader_x, reader_y) is False:
+                    del var_block[block_key]
+
         if block is False or self.return_block is False:
             # Analytical reader, continous in space and time
             self.timer_end('preparing')
-            env_before = self._get_variables(variables, profiles,
-                                             profiles_depth,
-                                             time,
-                                             #time_before,
-                                             reader_x, reader_y, z,
-                                             block=block)
-            logging.debug('Fetched env-before')
+            env = self._get_variables(variables, profiles,
+                                      profiles_depth,
+                                      time,
+                                      #time_before,
+                                      reader_x, reader_y, z,
+                                      block=block, dtype=dtype)
+            env_profiles = None
+            logging.debug('Fetched env at requested time')
             self.timer_start('preparing')
 
         else:
             # Swap before- and after-blocks if matching times
-            if str(variables) in self.var_block_before:
+            if block_key in self.var_block_before:
                 block_before_time = self.var_block_before[
-                    str(variables)].time
-                if str(variables) in self.var_block_after:
+                    block_key].time
+                if block_key in self.var_block_after:
                     block_after_time = self.var_block_after[
-                        str(variables)].time
+                        block_key].time
                     if block_before_time != time_before:
                         if block_after_time == time_before:
-                            self.var_block_before[str(variables)] = \
-                                self.var_block_after[str(variables)]
+                            self.var_block_before[block_key] = \
+                                self.var_block_after[block_key]
                     if block_after_time != time_after:
                         if block_before_time == time_before:
-                            self.var_block_after[str(variables)] = \
-                                self.var_block_before[str(variables)]
+                            self.var_block_after[block_key] = \
+                                self.var_block_before[block_key]
             # Fetch data, if no buffer is available
-            if (not str(variables) in self.var_block_before) or \
-                    (self.var_block_before[str(variables)].time !=
+            if (not block_key in self.var_block_before) or \
+                    (self.var_block_before[block_key].time !=
                      time_before):
                 self.timer_end('preparing')
                 reader_data_dict = \
                     self._get_variables(variables, profiles,
                                         profiles_depth, time_before,
                                         reader_x, reader_y, z,
-                                        block=block)
+                                        block=block, dtype=dtype)
                 self.timer_start('preparing')
-                self.var_block_before[str(variables)] = \
+                self.var_block_before[block_key] = \
                     ReaderBlock(reader_data_dict,
-                                interpolation_horizontal=self.interpolation)
+                                interpolation_horizontal=self.interpolation,
+                                seafloor_cache=self.seafloor_cache,
+                                dtype=dtype)
                 try:
-                    len_z = len(self.var_block_before[str(variables)].z)
+                    len_z = len(self.var_block_before[block_key].z)
                 except:
                     len_z = 1
                 logging.debug(('Fetched env-block (size %ix%ix%i) ' +
                               'for time before (%s)') %
-                              (len(self.var_block_before[str(variables)].x),
-                               len(self.var_block_before[str(variables)].y),
+                              (len(self.var_block_before[block_key].x),
+                               len(self.var_block_before[block_key].y),
                                len_z, time_before))
-            if not str(variables) in self.var_block_after or \
-                    self.var_block_after[str(variables)].time != time_after:
+            if not block_key in self.var_block_after or \
+                    self.var_block_after[block_key].time != time_after:
                 if time_after is None:
-                    self.var_block_after[str(variables)] = \
-                        self.var_block_before[str(variables)]
+                    self.var_block_after[block_key] = \
+                        self.var_block_before[block_key]
                 else:
                     self.timer_end('preparing')
                     reader_data_dict = \
                         self._get_variables(variables, profiles,
                                             profiles_depth, time_after,
                                             reader_x, reader_y, z,
-                                            block=block)
+                                            block=block, dtype=dtype)
                     self.timer_start('preparing')
-                    self.var_block_after[str(variables)] = \
+                    self.var_block_after[block_key] = \
                         ReaderBlock(
                             reader_data_dict,
-                            interpolation_horizontal=self.interpolation)
+                            interpolation_horizontal=self.interpolation,
+                            seafloor_cache=self.seafloor_cache,
+                            dtype=dtype)
                     try:
-                        len_z = len(self.var_block_after[str(variables)].z)
+                        len_z = len(self.var_block_after[block_key].z)
                     except:
                         len_z = 1
 
                     logging.debug(('Fetched env-block (size %ix%ix%i) ' +
                                   'for time after (%s)') %
                                   (len(self.var_block_after[
-                                       str(variables)].x),
+                                       block_key].x),
                                    len(self.var_block_after[
-                                       str(variables)].y),
+                                       block_key].y),
                                    len_z, time_after))
 
-            if self.var_block_before[str(variables)].covers_positions(
+            if self.var_block_before[block_key].covers_positions(
                 reader_x, reader_y) is False or \
-                self.var_block_after[str(variables)].covers_positions(
+                self.var_block_after[block_key].covers_positions(
                     reader_x, reader_y) is False:
                 logging.warning('Data block from %s not large enough to '
                                 'cover element positions within timestep. '
@@ -452,20 +613,26 @@ class BaseReader(object):
             # Interpolate before/after blocks onto particles in space
             ############################################################
             self.timer_start('interpolation')
-            logging.debug('Interpolating before (%s) in space  (%s)' %
-                          (self.var_block_before[str(variables)].time,
-                           self.interpolation))
-            env_before, env_profiles_before = self.var_block_before[
-                str(variables)].interpolate(
-                    reader_x, reader_y, z, variables,
-                    profiles, profiles_depth)
-
             if (time_after is not None) and (time_before != time):
-                logging.debug('Interpolating after (%s) in space  (%s)' %
-                              (self.var_block_after[str(variables)].time,
+                weight_after = ((time - time_before).total_seconds() /
+                                (time_after - time_before).total_seconds())
+                logging.debug(('Interpolating before (%s, weight %.2f) and'
+                               '\n\t\t      after (%s, weight %.2f) in '
+                               'space and time (%s)') %
+                              (self.var_block_before[block_key].time,
+                               1 - weight_after,
+                               self.var_block_after[block_key].time,
+                               weight_after, self.interpolation))
+                env, env_profiles = interpolate_blocks_in_time(
+                    self.var_block_before[block_key],
+                    self.var_block_after[block_key],
+                    weight_after, reader_x, reader_y, z, profiles)
+            else:
+                logging.debug('Interpolating before (%s) in space  (%s)' %
+                              (self.var_block_before[block_key].time,
                                self.interpolation))
-                env_after, env_profiles_after = self.var_block_after[
-                    str(variables)].interpolate(
+                env, env_profiles = self.var_block_before[
+                    block_key].interpolate(
                         reader_x, reader_y, z, variables,
                         profiles, profiles_depth)
 
@@ -475,63 +642,20 @@ class BaseReader(object):
         # Time interpolation
         #######################
         self.timer_start('interpolation_time')
-        env_profiles = None
         if (time_after is not None) and (time_before != time):
-            weight_after = ((time - time_before).total_seconds() /
-                            (time_after - time_before).total_seconds())
-            logging.debug(('Interpolating before (%s, weight %.2f) and'
-                           '\n\t\t      after (%s, weight %.2f) in time') %
-                          (self.var_block_before[str(variables)].time,
-                           1 - weight_after,
-                           self.var_block_after[str(variables)].time,
-                           weight_after))
-            env = {}
             for var in variables:
-                # Weighting together, and masking invalid entries
-                env[var] = np.ma.masked_invalid((env_before[var] *
-                                                (1 - weight_after) +
-                                                env_after[var] * weight_after))
-
-                if var in standard_names.keys():
-                    invalid = np.where((env[var] < standard_names[var]['valid_min']) 
-                               | (env[var] > standard_names[var]['valid_max']))[0]
-                    if len(invalid) > 0:
-                        logging.warning('Invalid values found for ' + var)
-                        logging.warning(env[var][invalid])
-                        logging.warning('(allowed range: [%s, %s])' %
-                                        (standard_names[var]['valid_min'],
-                                         standard_names[var]['valid_max']))
-                        logging.warning('Replacing with NaN')
-                        env[var][invalid] = np.nan
-            # Interpolating vertical profiles in time
-            if profiles is not None:
-                env_profiles = {}
-                logging.info('Interpolating profiles in time')
-                # Truncating layers not present both before and after
-                numlayers = np.minimum(len(env_profiles_before['z']),
-                                       len(env_profiles_after['z']))
-                env_profiles['z'] = env_profiles_before['z'][0:numlayers+1]
-                for var in env_profiles_before.keys():
-                    if var == 'z':
-                        continue
-                    env_profiles[var] = (
-                        env_profiles_before[var][0:numlayers, :] *
-                        (1 - weight_after) +
-                        env_profiles_after[var][0:numlayers, :]*weight_after)
-            else:
-                env_profiles = None
+                # Masking invalid entries
+                env[var] = np.ma.masked_invalid(env[var])
+
+                mask_invalid_values(env, var)
 
         else:
             logging.debug('No time interpolation needed - right on time.')
-            env = env_before
-            if profiles is not None:
-                if 'env_profiles_before' in locals():
-                    env_profiles = env_profiles_before
-                else:
-                    # Copying data from environment to vertical profiles
-                    env_profiles = {'z': profiles_depth}
-                    for var in profiles:
-                        env_profiles[var] = np.ma.array([env[var], env[var]])
+        if profiles is not None and env_profiles is None:
+            # Copying data from environment to vertical profiles
+            env_profiles = {'z': profiles_depth}
+            for var in profiles:
+                env_profiles[var] = np.ma.array([env[var], env[var]])
         self.timer_end('interpolation_time')
 
         ####################
@@ -559,12 +683,22 @@ class BaseReader(object):
 
                 if len(vector_pairs) > 0:
                     self.timer_start('rotating vectors')
+                    # Same rotation angle for all vector pairs
+                    if block is True and self.return_block is True:
+                        rot_angle = self.rotation_angle_from_block(
+                            reader_x, reader_y,
+                            self.var_block_before[block_key],
+                            rotate_to_proj)
+                    else:
+                        rot_angle = self.rotation_angle(
+                            reader_x, reader_y, self.proj, rotate_to_proj)
                     for vector_pair in vector_pairs:
                         env[vector_pair[0]], env[vector_pair[1]] = \
                             self.rotate_vectors(reader_x, reader_y,
                                                 env[vector_pair[0]],
                                                 env[vector_pair[1]],
-                                                self.proj, rotate_to_proj)
+                                                self.proj, rotate_to_proj,
+                                                rot_angle)
                         if profiles is not None and vector_pair[0] in profiles:
                             sys.exit('Rotating profiles of vectors '
                                      'is not yet implemented')
@@ -591,10 +725,199 @@ class BaseReader(object):
         self.timer_end('total')
         return env, env_profiles
 
-    def rotate_vectors(self, reader_x, reader_y,
-                       u_component, v_component,
-                       proj_from, proj_to):
-        """Rotate vectors from one srs to another."""
+    def cluster_elements(self, x, y):
+        """Split elements into clusters, to be covered by separate blocks
+
+        Elements are split recursively along x and y where there are
+        gaps wider than two buffers between them. Returns list of
+        indices of elements for each cluster, or of all elements in one
+        cluster if the total area of the cluster blocks is not smaller
+        than cluster_area_fraction of the area of one common block.
+        """
+        all_elements = [np.arange(len(x))]
+        if getattr(self, 'delta_x', None) is None or len(x) < 2:
+            return all_elements
+        delta_x = self.delta_x
+        delta_y = getattr(self, 'delta_y', None) or delta_x
+        gap_x = (2*self.buffer + 1)*delta_x
+        gap_y = (2*self.buffer + 1)*delta_y
+
+        def split(values, gap):
+            order = np.argsort(values)
+            return np.split(order,
+                            np.where(np.diff(values[order]) > gap)[0] + 1)
+
+        clusters = all_elements
+        num_clusters = 0
+        while len(clusters) > num_clusters:
+            num_clusters = len(clusters)
+            new_clusters = []
+            for cluster in clusters:
+                parts = split(x[cluster], gap_x)
+                if len(parts) == 1:
+                    parts = split(y[cluster], gap_y)
+                new_clusters.extend([cluster[part] for part in parts])
+            clusters = new_clusters
+
+        if len(clusters) == 1:
+            return all_elements
+
+        def area(c):
+            return ((x[c].max() - x[c].min() + 2*self.buffer*delta_x) *
+                    (y[c].max() - y[c].min() + 2*self.buffer*delta_y))
+
+        if sum([area(c) for c in clusters]) >= \
+                self.cluster_area_fraction*area(all_elements[0]):
+            return all_elements
+        # Sorting for stable order of clusters between calls
+        clusters.sort(key=lambda c: (x[c].min(), y[c].min()))
+        logging.debug('Elements are split into %i clusters with '
+                      'separate blocks' % len(clusters))
+        return clusters
+
+    def _discard_cluster_blocks(self, variables, num_clusters):
+        """Delete stored blocks not used with given number of clusters.
+
+        With one cluster, blocks of all clusters are deleted, and with
+        several clusters, the block covering all elements is deleted.
+        """
+        prefix = '%s cluster ' % str(variables)
+        for var_block in [self.var_block_before, self.var_block_after]:
+            for key in list(var_block):
+                if key.startswith(prefix) and \
+                        (num_clusters == 1 or
+                         int(key[len(prefix):]) >= num_clusters):
+                    del var_block[key]
+                elif key == str(variables) and num_clusters > 1:
+                    del var_block[key]
+
+    def _get_variables_interpolated_clusters(
+            self, clusters, ind_covered, variables, profiles,
+            profiles_depth, time, lon, lat, z, block, rotate_to_proj,
+            dtype):
+        """Interpolate each cluster of elements from its own blocks."""
+
+        env = {}
+        for var in variables:
+            env[var] = np.nan*np.ones(lon.shape)
+        cluster_profiles = []
+        for i, cluster in enumerate(clusters):
+            indices = ind_covered[cluster]
+            env_cluster, env_profiles_cluster = \
+                self.get_variables_interpolated(
+                    variables, profiles, profiles_depth, time,
+                    lon[indices], lat[indices], z[cluster], block,
+                    rotate_to_proj, dtype, _cluster=i)
+            for var in variables:
+                env[var][indices] = np.ma.filled(env_cluster[var], np.nan)
+            if env_profiles_cluster is not None:
+                cluster_profiles.append((indices, env_profiles_cluster))
+        for var in variables:
+            env[var] = np.ma.masked_invalid(env[var])
+
+        env_profiles = None
+        if len(cluster_profiles) > 0:
+            # Truncating layers not present for all clusters
+            numlayers = min([len(p[1]['z']) for p in cluster_profiles])
+            env_profiles = {'z': cluster_profiles[0][1]['z'][0:numlayers]}
+            for var in cluster_profiles[0][1]:
+                if var == 'z':
+                    continue
+                tmp = np.nan*np.ones((numlayers, len(lon)))
+                for indices, p in cluster_profiles:
+                    tmp[:, indices] = np.ma.filled(p[var][0:numlayers],
+                                                   np.nan)
+                env_profiles[var] = np.ma.masked_invalid(tmp)
+
+        return env, env_profiles
+
+    def static_block_variables(self, variables, profiles=None):
+        """Return those of variables to be read from permanent blocks.
+
+        These are the time-independent variables of the reader, except
+        vector components and variables requested as profiles.
+        """
+        vector_components = [v for pair in vector_pairs_xy for v in pair]
+        return [var for var in variables if var in self.static_variables
+                and var not in vector_components
+                and (profiles is None or var not in profiles)]
+
+    def _get_variables_interpolated_static(
+            self, static_variables, ind_covered, variables, profiles,
+            profiles_depth, time, lon, lat, z, block, rotate_to_proj,
+            dtype):
+        """Interpolate time-independent variables from permanent blocks.
+
+        The blocks are read once, and replaced only when elements move
+        outside. Remaining variables are interpolated in space and time
+        as usual.
+        """
+        dynamic_variables = [var for var in variables
+                             if var not in static_variables]
+        if len(dynamic_variables) > 0:
+            env, env_profiles = self.get_variables_interpolated(
+                dynamic_variables, profiles, profiles_depth, time,
+                lon, lat, z, block, rotate_to_proj, dtype)
+        else:
+            env = {}
+            env_profiles = None
+
+        self.timer_start('total')
+        self.timer_start('preparing')
+        reader_x, reader_y = self.lonlat2xy(lon[ind_covered],
+                                            lat[ind_covered])
+        z = z[ind_covered]
+        if self.clustered_blocks is True:
+            clusters = self.cluster_elements(reader_x, reader_y)
+        else:
+            clusters = [np.arange(len(reader_x))]
+        key = str(static_variables)
+        blocks = self.var_block_static.get(key, [])[0:len(clusters)]
+        self.var_block_static[key] = blocks
+        for var in static_variables:
+            env[var] = np.nan*np.ones(lon.shape)
+        for i, cluster in enumerate(clusters):
+            if i == len(blocks) or blocks[i].covers_positions(
+                    reader_x[cluster], reader_y[cluster]) is False:
+                self.timer_end('preparing')
+                reader_data_dict = self._get_variables(
+                    static_variables, None, None, time, reader_x[cluster],
+                    reader_y[cluster], z[cluster], block=block, dtype=dtype)
+                self.timer_start('preparing')
+                static_block = ReaderBlock(
+                    reader_data_dict,
+                    interpolation_horizontal=self.interpolation,
+                    seafloor_cache=self.seafloor_cache, dtype=dtype)
+                logging.debug('Fetched static env-block (size %ix%i) '
+                              'for %s' % (len(static_block.x),
+                                          len(static_block.y),
+                                          static_variables))
+                if i == len(blocks):
+                    blocks.append(static_block)
+                else:
+                    blocks[i] = static_block
+            self.timer_end('preparing')
+            self.timer_start('interpolation')
+            env_static, dummy = blocks[i].interpolate(
+                reader_x[cluster], reader_y[cluster], z[cluster],
+                static_variables)
+            self.timer_end('interpolation')
+            self.timer_start('preparing')
+            for var in static_variables:
+                env[var][ind_covered[cluster]] = np.ma.filled(
+                    env_static[var], np.nan)
+        for var in static_variables:
+            mask_invalid_values(env, var)
+            env[var] = np.ma.masked_invalid(env[var])
+            if dtype is not None:
+                env[var] = env[var].astype(dtype)
+        self.timer_end('preparing')
+        self.timer_end('total')
+
+        return env, env_profiles
+
+    def rotation_angle(self, reader_x, reader_y, proj_from, proj_to):
+        """Angle (radians) of y-axis of proj_to relative to proj_from."""
 
         if type(proj_from) is str:
             proj_from = pyproj.Proj(proj_from)
@@ -620,14 +943,71 @@ class BaseReader(object):
                 geod.inv(x2, y2, x2_delta, y2_delta)[0])
         else:
             rot_angle_vectors_rad = np.arctan2(x2_delta - x2, y2_delta - y2)
+
+        return rot_angle_vectors_rad
+
+    def rotation_angle_from_block(self, reader_x, reader_y, block, proj_to,
+                                  max_points=33):
+        """Rotation angle interpolated from a field cached per block grid.
+
+        The field is calculated once for each grid window and target
+        projection, on at most max_points along each axis of the block,
+        since the rotation angle varies smoothly in space.
+        Cosine and sine are interpolated (bilinearly) to avoid
+        discontinuity at +/- pi.
+        """
+        block_x = np.asarray(block.x, dtype=np.float64)
+        block_y = np.asarray(block.y, dtype=np.float64)
+        if not (_is_monotonic(block_x) and _is_monotonic(block_y)):
+            return self.rotation_angle(reader_x, reader_y,
+                                       self.proj, proj_to)
+        key = (block_x[0], block_x[-1], len(block_x),
+               block_y[0], block_y[-1], len(block_y),
+               getattr(proj_to, 'srs', str(proj_to)))
+        if key not in self.rotation_cache:
+            if len(self.rotation_cache) >= 8:
+                self.rotation_cache.clear()
+            ix = np.unique(np.linspace(0, len(block_x) - 1, min(
+                len(block_x), max_points)).round().astype(int))
+            iy = np.unique(np.linspace(0, len(block_y) - 1, min(
+                len(block_y), max_points)).round().astype(int))
+            grid_x, grid_y = np.meshgrid(block_x[ix], block_y[iy])
+            angle = self.rotation_angle(
+                grid_x.ravel(), grid_y.ravel(), self.proj,
+                proj_to).reshape(grid_x.shape)
+            logging.debug('Calculated rotation angles on %ix%i grid' %
+                          (len(ix), len(iy)))
+            self.rotation_cache[key] = (block_x[ix], block_y[iy],
+                                        np.cos(angle), np.sin(angle))
+
+        grid_x, grid_y, cos_angle, sin_angle = self.rotation_cache[key]
+        order_x = np.argsort(grid_x)
+        order_y = np.argsort(grid_y)
+        coords = [np.interp(reader_y, grid_y[order_y], order_y),
+                  np.interp(reader_x, grid_x[order_x], order_x)]
+        return np.arctan2(
+            map_coordinates(sin_angle, coords, order=1, mode='nearest'),
+            map_coordinates(cos_angle, coords, order=1, mode='nearest'))
+
+    def rotate_vectors(self, reader_x, reader_y,
+                       u_component, v_component,
+                       proj_from, proj_to, rot_angle_vectors_rad=None):
+        """Rotate vectors from one srs to another.
+
+        The rotation angle is calculated if not provided.
+        """
+
+        if rot_angle_vectors_rad is None:
+            rot_angle_vectors_rad = self.rotation_angle(
+                reader_x, reader_y, proj_from, proj_to)
         logging.debug('Rotating vectors between %s and %s degrees.' %
                       (np.degrees(rot_angle_vectors_rad).min(),
                        np.degrees(rot_angle_vectors_rad).max()))
         rot_angle_rad = - rot_angle_vectors_rad
-        u_rot = (u_component*np.cos(rot_angle_rad) -
-                 v_component*np.sin(rot_angle_rad))
-        v_rot = (u_component*np.sin(rot_angle_rad) +
-                 v_component*np.cos(rot_angle_rad))
+        cos_angle = np.cos(rot_angle_rad)
+        sin_angle = np.sin(rot_angle_rad)
+        u_rot = u_component*cos_angle - v_component*sin_angle
+        v_rot = u_component*sin_angle + v_component*cos_angle
 
         return u_rot, v_rot
 
@@ -668,11 +1048,20 @@ class BaseReader(object):
             if self.proj.is_latlong():
                 return lon, lat
             else:
-                x, y = self.proj(lon, lat, inverse=False)
-                if 'ob_tran' in self.proj4:
-                    return np.degrees(x), np.degrees(y)
-                else:
-                    return x, y
+                return coordinate_cache.lonlat2xy(
+                    self.proj.srs, lon, lat, self._lonlat2xy)
+        else:
+            # Keyed by reader itself, which is kept while cached
+            return coordinate_cache.lonlat2xy(
+                ('splines', self), lon, lat, self._lonlat2xy)
+
+    def _lonlat2xy(self, lon, lat):
+        if self.projected is True:
+            x, y = self.proj(lon, lat, inverse=False)
+            if 'ob_tran' in self.proj4:
+                return np.degrees(x), np.degrees(y)
+            else:
+                return x, y
         else:
             x = self.spl_x(lon, lat)
             y = self.spl_y(lon, lat)
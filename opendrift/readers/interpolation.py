@@ -1,4 +1,6 @@
 import logging
+import copy
+from collections import OrderedDict
 
 from future.utils import iteritems
 import numpy as np
@@ -6,6 +8,11 @@ from scipy.ndimage import map_coordinates
 import scipy.ndimage as ndimage
 from scipy.interpolate import interp1d, LinearNDInterpolator
 
+from opendrift.kernels import get_kernel
+
+
+max_fill_distance = 10  # Cells, for filling NaN-values from valid cells
+
 
 def expand_numpy_array(data):
     if isinstance(data, np.ma.MaskedArray):
@@ -15,9 +22,36 @@ def expand_numpy_array(data):
         logging.warning('Only NaNs, returning')
         return
     mask = ~np.isfinite(data)
-    data[mask] = np.finfo(np.float64).min
+    data[mask] = np.finfo(data.dtype).min
     data[mask] = ndimage.morphology.grey_dilation(data, size=3)[mask]
-    data[data==np.finfo(np.float64).min] = np.nan
+    data[data==np.finfo(data.dtype).min] = np.nan
+
+
+def fill_NaN_from_nearest(data, mask=None, indices=None,
+                          max_distance=max_fill_distance):
+    """Replace NaN-values of 2D array in place with nearest valid values.
+
+    Indices of the nearest valid cells are calculated with a distance
+    transform of the mask of invalid cells. Only cells within
+    max_distance cells from valid data are filled, as with 10 iterations
+    of expand_numpy_array. Elements further away (e.g. far inland) then
+    get NaN, and values from other readers or fallback values.
+    Previously calculated indices may be given for an array with
+    identical mask. Returns the mask and indices, for reuse with the
+    next array.
+    """
+    invalid = ~np.isfinite(data)
+    if not invalid.any() or invalid.all():
+        return mask, indices
+    if indices is None or mask is None or not np.array_equal(invalid, mask):
+        distances, nearest = ndimage.distance_transform_edt(
+            invalid, return_distances=True, return_indices=True)
+        fill = invalid & (distances <= max_distance)
+        indices = (fill, tuple(nearest[:, fill]))
+        mask = invalid
+    fill, source = indices
+    data[fill] = data[source]
+    return mask, indices
 
 
 ###########################
@@ -101,6 +135,11 @@ class LinearND2DInterpolator():
         
 class Linear2DInterpolator():
 
+    # Number of times NaN-values are expanded from valid values. Set to 0
+    # for data which have already been filled with fill_NaN_from_nearest,
+    # NaN-values then remain where valid data are further away.
+    max_expansions = max_fill_distance
+
     def __init__(self, xgrid, ygrid, x, y):
         self.x = x
         self.y = y
@@ -120,11 +159,18 @@ class Linear2DInterpolator():
         interp = map_coordinates(array2d, [self.yi, self.xi],
                                  cval=np.nan, order=1)
         missing = np.where(~np.isfinite(interp))[0]
+        if len(missing) > 0 and self.max_expansions == 0:
+            # Data already filled, only positions at the grid edges
+            interp[missing] = map_coordinates(
+                array2d, [self.yi[missing], self.xi[missing]],
+                cval=np.nan, order=1, mode='nearest')
+            return interp
         i=0
         while len(missing) > 0:
             i += 1
-            if i > 10:
-                logging.warning('Still NaN-values after 10 iterations, exiting!')
+            if i > self.max_expansions:
+                logging.warning('Still NaN-values after %i iterations, '
+                                'exiting!' % self.max_expansions)
                 return interp
             logging.debug('NaN values for %i elements, expanding data %i' %
                           (len(missing), i))
@@ -164,6 +210,8 @@ class Nearest1DInterpolator():
         self.zi = np.round(z_interpolator(z)).astype(np.int)
         self.zi[self.zi < 0] = 0
         self.zi[self.zi >= len(zgrid)] = len(zgrid) - 1
+        # Layer index and weight for each element
+        self.bracketing_layers = [(self.zi, np.ones(len(self.zi)))]
 
     def __call__(self, array2d):
         return array2d[self.zi, range(len(self.zi))]
@@ -188,6 +236,9 @@ class Linear1DInterpolator():
         self.index_below = np.minimum(self.index_above + 1, len(zgrid) - 1)
         self.weight_above = 1 - (interp_zi - self.index_above)
         self.xi = range(len(z))
+        # Layer indices and weights for each element
+        self.bracketing_layers = [(self.index_above, self.weight_above),
+                                  (self.index_below, 1 - self.weight_above)]
 
     def __call__(self, array2d):
         return array2d[self.index_above, self.xi]*self.weight_above + \
@@ -198,15 +249,176 @@ vertical_interpolation_methods = {
     'linear': Linear1DInterpolator}
 
 
-def fill_NaN_towards_seafloor(array):
-    """Extrapolate NaN-values (missing) towards seafloor"""
-    filled = False
-    for i in range(1, array.shape[0]):
-        mask = np.isnan(array[i,:,:])
-        if np.sum(mask) > 0:
-            array[i, mask] = array[i-1, mask]
-            filled = True
-    return filled
+def fill_NaN_towards_seafloor(array, cache=None, max_masks=2):
+    """Extrapolate NaN-values (missing) towards seafloor
+
+    Missing values are replaced by the nearest valid value above, in one
+    vectorized step, using the index of the deepest valid layer at or
+    above each cell. These indices are stored in cache (dict) if given,
+    and reused for arrays (e.g. other variables and times) with the
+    same mask. Only the max_masks most recently used masks are kept.
+    """
+    invalid = np.isnan(array)
+    if not invalid[1:].any():
+        return False
+    key = hash(invalid.tobytes())
+    if cache is not None and key in cache and \
+            np.array_equal(cache[key][0], invalid):
+        source = cache[key][1]
+        cache[key] = cache.pop(key)  # Most recently used is last
+    else:
+        layers = np.arange(array.shape[0]).reshape(
+            (-1,) + (1,)*(array.ndim - 1))
+        # Index of deepest valid layer at or above each cell
+        layer_index = np.maximum.accumulate(
+            np.where(invalid, 0, layers), axis=0)
+        # Flat indices of cells to copy from
+        cells = np.arange(array[0].size).reshape(array.shape[1:])
+        source = (layer_index*array[0].size + cells)[invalid]
+        if cache is not None:
+            while len(cache) >= max_masks:
+                del cache[next(iter(cache))]  # Least recently used
+            cache[key] = (invalid, source)
+    array[invalid] = array.reshape(-1)[source]
+    return True
+
+
+###########################
+# Interpolation plan
+###########################
+
+def bilinear_weights(xi, yi, nx, ny):
+    """Corner indices and weights for bilinear interpolation.
+
+    xi, yi are fractional grid indices, as in Linear2DInterpolator.
+    Positions outside the grid are clamped to the nearest grid edge,
+    as map_coordinates with mode='nearest'. Returns flat indices (4 x n)
+    into a 2D (ny, nx) array, and corresponding weights (4 x n).
+    """
+    xi = np.clip(xi, 0, nx - 1)
+    yi = np.clip(yi, 0, ny - 1)
+    i0 = np.minimum(np.floor(xi), nx - 2).astype(np.int)
+    j0 = np.minimum(np.floor(yi), ny - 2).astype(np.int)
+    fx = xi - i0
+    fy = yi - j0
+    indices = np.array([j0*nx + i0, j0*nx + i0 + 1,
+                        (j0 + 1)*nx + i0, (j0 + 1)*nx + i0 + 1])
+    weights = np.array([(1 - fx)*(1 - fy), fx*(1 - fy),
+                        (1 - fx)*fy, fx*fy])
+    return indices, weights
+
+
+class InterpolationPlan():
+    """Interpolators and weights for a grid and given element positions.
+
+    Calculated once, and applied to all variables and time levels
+    (ReaderBlocks) on the same grid.
+    """
+
+    def __init__(self, block, x, y, z=None):
+        self.xgrid = block.x
+        self.ygrid = block.y
+        self.zgrid = block.z
+        self.x = x
+        self.y = y
+        self.z = z
+        self.Interpolator2DClass = block.Interpolator2DClass
+        self.Interpolator1DClass = block.Interpolator1DClass
+        self.dtype = block.dtype
+        self.interpolator2d = self.Interpolator2DClass(self.xgrid, self.ygrid,
+                                                       x, y)
+        if self.Interpolator2DClass is Linear2DInterpolator:
+            # Blocks are filled with fill_NaN_from_nearest
+            self.interpolator2d.max_expansions = 0
+        self._interpolator2d_nearest = None
+        self._ensemble_plans = {}
+        self.interpolator1d = None
+        self.bracketing_layers = None
+        if self.zgrid is not None and len(np.atleast_1d(self.zgrid)) > 1 \
+                and z is not None:
+            # Sending copy, as z is truncated by 1D interpolators
+            self.interpolator1d = self.Interpolator1DClass(self.zgrid,
+                                                           z.copy())
+            self.bracketing_layers = [
+                (index, weight.astype(self.dtype)) for index, weight in
+                self.interpolator1d.bracketing_layers]
+            # Arrays (layers x elements) for gather kernel
+            self.layer_index = np.array(
+                [l[0] for l in self.bracketing_layers])
+            self.layer_weight = np.array(
+                [l[1] for l in self.bracketing_layers], dtype=self.dtype)
+        self.bilinear = None
+        if self.Interpolator2DClass is Linear2DInterpolator and \
+                len(self.xgrid) > 1 and len(self.ygrid) > 1:
+            indices, weights = bilinear_weights(
+                self.interpolator2d.xi, self.interpolator2d.yi,
+                len(self.xgrid), len(self.ygrid))
+            self.bilinear = (indices, weights.astype(self.dtype))
+
+    def ensemble_plans(self, block, num_ensembles):
+        """Plans for the elements of each ensemble member.
+
+        Element number i is assigned to ensemble member
+        i modulo num_ensembles. Returns list of (element indices, plan),
+        which is calculated once, and reused for all variables.
+        """
+        if num_ensembles not in self._ensemble_plans:
+            member = np.remainder(np.arange(len(self.x)), num_ensembles)
+            plans = []
+            for en in range(num_ensembles):
+                elements = np.where(member == en)[0]
+                plans.append((elements, InterpolationPlan(
+                    block, self.x[elements], self.y[elements],
+                    self.z[elements] if self.z is not None else None)))
+            self._ensemble_plans[num_ensembles] = plans
+        return self._ensemble_plans[num_ensembles]
+
+    @property
+    def interpolator2d_nearest(self):
+        """Nearest interpolator (for landmask), created when first used."""
+        if self._interpolator2d_nearest is None:
+            self._interpolator2d_nearest = Nearest2DInterpolator(
+                self.xgrid, self.ygrid, self.x, self.y)
+        return self._interpolator2d_nearest
+
+    def applies_to(self, block, x, y, z=None):
+        """Check if plan is valid for given block and positions."""
+        return (block.Interpolator2DClass is self.Interpolator2DClass and
+                block.dtype == self.dtype and
+                block.Interpolator1DClass is self.Interpolator1DClass and
+                np.array_equal(block.x, self.xgrid) and
+                np.array_equal(block.y, self.ygrid) and
+                np.array_equal(block.z, self.zgrid) and
+                np.array_equal(x, self.x) and np.array_equal(y, self.y) and
+                np.array_equal(z, self.z))
+
+    def can_gather(self, data):
+        """Check if data may be interpolated by gather()."""
+        if self.bilinear is None or type(data) is list:
+            return False
+        if data.ndim == 2:
+            return True
+        return data.ndim == 3 and self.bracketing_layers is not None and \
+            data.shape[0] == len(self.zgrid)
+
+    def gather(self, data, weight=1, out=None):
+        """Add weight times interpolated data to out, and return out.
+
+        Interpolates bilinearly in the horizontal, and with bracketing
+        layers in the vertical. Output array is allocated if not given.
+        """
+        indices, weights = self.bilinear
+        if out is None:
+            out = np.zeros(len(self.x), dtype=self.dtype)
+        if data.ndim == 2:
+            layer_index = np.zeros((1, len(self.x)), dtype=np.int)
+            layer_weight = np.ones((1, len(self.x)), dtype=self.dtype)
+        else:
+            layer_index = self.layer_index
+            layer_weight = self.layer_weight
+        return get_kernel('bilinear_gather')(
+            data.ravel(), indices, weights, layer_index, layer_weight,
+            data.shape[-1]*data.shape[-2], weight, out)
 
 
 ###########################
@@ -218,7 +430,8 @@ class ReaderBlock():
 
     def __init__(self, data_dict,
                  interpolation_horizontal='linearNDFast',
-                 interpolation_vertical='linear'):
+                 interpolation_vertical='linear',
+                 seafloor_cache=None, dtype=None):
 
         # Make pointers to data values, for convenience
         self.x = data_dict['x']
@@ -234,6 +447,31 @@ class ReaderBlock():
         except:
             self.z = None
 
+        # Store ensemble members in one contiguous array,
+        # with ensemble member as first dimension
+        self.ensemble_variables = set()
+        for var in self.data_dict:
+            if isinstance(self.data_dict[var], (list,)):
+                self.data_dict[var] = np.ma.stack(
+                    self.data_dict[var]).astype(np.float32)
+                self.ensemble_variables.add(var)
+
+        # Floating point data are stored with dtype, if given,
+        # which is also used for interpolation
+        if dtype is None:
+            self.dtype = np.dtype(np.float64)
+        else:
+            self.dtype = np.dtype(dtype)
+
+        # Indices for extrapolation towards seafloor are reused
+        # for all variables and times of the same grid window
+        if seafloor_cache is not None:
+            window = self._grid_window()
+            if window not in seafloor_cache and len(seafloor_cache) >= 8:
+                seafloor_cache.clear()
+            seafloor_cache = seafloor_cache.setdefault(window,
+                                                       OrderedDict())
+
         # Mask any extremely large values, e.g. if missing netCDF _Fill_value
         filled_variables = set()
         for var in self.data_dict:
@@ -243,11 +481,21 @@ class ReaderBlock():
                 # Convert masked arrays to numpy arrays
                 self.data_dict[var] = np.ma.filled(self.data_dict[var],
                                                    fill_value=np.nan)
+            if dtype is not None and \
+                    isinstance(self.data_dict[var], np.ndarray) and \
+                    np.issubdtype(self.data_dict[var].dtype, np.floating):
+                self.data_dict[var] = self.data_dict[var].astype(
+                    dtype, copy=False)
             # Fill missing data towards seafloor if 3D
-            if isinstance(self.data_dict[var], (list,)):
-                logging.warning('Ensemble data currently not extrapolated towards seafloor')
+            if var in self.ensemble_variables:
+                if self.data_dict[var].ndim == 4:
+                    for member in self.data_dict[var]:
+                        if fill_NaN_towards_seafloor(
+                                member, seafloor_cache) is True:
+                            filled_variables.add(var)
             elif self.data_dict[var].ndim == 3:
-                filled = fill_NaN_towards_seafloor(self.data_dict[var])
+                filled = fill_NaN_towards_seafloor(self.data_dict[var],
+                                                   seafloor_cache)
                 if filled is True:
                     filled_variables.add(var)
                 
@@ -272,57 +520,157 @@ class ReaderBlock():
                 'Valid interpolation methods are: ' +
                 str(vertical_interpolation_methods.keys()))
 
+        # Fill missing data (e.g. land) with nearest valid values once,
+        # so that linearNDFast does not need to extrapolate at each call
+        if self.Interpolator2DClass is Linear2DInterpolator:
+            self._fill_NaN_from_nearest()
+
         if 'land_binary_mask' in self.data_dict.keys() and \
                 interpolation_horizontal != 'nearest':
             logging.debug('Nearest interpolation will be used '
                           'for landmask, and %s for other variables'
                           % interpolation_horizontal)
 
-    def _initialize_interpolator(self, x, y, z=None):
-        logging.debug('Initialising interpolator.')
-        self.interpolator2d = self.Interpolator2DClass(self.x, self.y, x, y)
-        if self.z is not None and len(np.atleast_1d(self.z)) > 1:
-            self.interpolator1d = self.Interpolator1DClass(self.z, z)
+    def blended(self, other, weight_other):
+        """Return block with data weighted together with other block.
+
+        The blocks must have identical grids and variables. Grid,
+        interpolators and plan are shared with this block.
+        """
+        block = copy.copy(self)
+        block.data_dict = {}
+        for var, data in iteritems(self.data_dict):
+            block.data_dict[var] = data*(1 - weight_other) + \
+                other.data_dict[var]*weight_other
+        return block
+
+    def _grid_window(self):
+        """Key identifying the grid (window) of this block."""
+        z = () if self.z is None else tuple(np.atleast_1d(self.z))
+        return (len(self.x), self.x[0], self.x[-1],
+                len(self.y), self.y[0], self.y[-1], z)
+
+    def _fill_NaN_from_nearest(self):
+        """Fill NaN-values of all variables and layers from nearest cells.
+
+        The nearest-valid-cell index map is reused for all
+        layers and variables with the same mask.
+        """
+        mask = indices = None
+        filled_variables = []
+        for var, data in iteritems(self.data_dict):
+            if var == 'land_binary_mask':
+                continue
+            if data.ndim < 2 or not np.issubdtype(data.dtype, np.floating):
+                continue
+            if np.isfinite(data).all():
+                continue
+            for layer in np.ndindex(data.shape[:-2]):
+                mask, indices = fill_NaN_from_nearest(data[layer],
+                                                      mask, indices)
+            filled_variables.append(var)
+        if len(filled_variables) > 0:
+            logging.debug('Filled NaN-values from nearest valid cells for: '
+                          + str(sorted(set(filled_variables))))
+
+    def _initialize_interpolator(self, x, y, z=None, plan=None):
+        if plan is None or not plan.applies_to(self, x, y, z):
+            logging.debug('Initialising interpolator.')
+            plan = InterpolationPlan(self, x, y, z)
+        self.plan = plan
+        self.interpolator2d = plan.interpolator2d
+        if plan.interpolator1d is not None:
+            self.interpolator1d = plan.interpolator1d
 
     def interpolate(self, x, y, z=None, variables=None,
-                    profiles=[], profiles_depth=None):
+                    profiles=[], profiles_depth=None, plan=None):
 
-        self._initialize_interpolator(x, y, z)
+        self._initialize_interpolator(x, y, z, plan)
 
         env_dict = {}
         if profiles is not []:
             profiles_dict = {'z': self.z}
-        for varname, data in iteritems(self.data_dict):
-            nearest = False
-            if varname == 'land_binary_mask':
-                nearest = True
-                self.interpolator2d_nearest = Nearest2DInterpolator(self.x, self.y, x, y)
-            if type(data) is list:
-                num_ensembles = len(data)
-                logging.debug('Interpolating %i ensembles for %s' % (num_ensembles, varname))
-                if data[0].ndim == 2:
-                    horizontal = np.zeros(x.shape)*np.nan
-                else:
-                    horizontal = np.zeros((len(self.z), len(x)))*np.nan
-                ensemble_number = np.remainder(range(len(x)), num_ensembles)
-                for en in range(num_ensembles):
-                    elnum = ensemble_number == en
-                    int_full = self._interpolate_horizontal_layers(data[en], nearest=nearest)
-                    if int_full.ndim == 1:
-                        horizontal[elnum] = int_full[elnum]
-                    else:
-                        horizontal[:, elnum] = int_full[:, elnum]
-            else:
-                horizontal = self._interpolate_horizontal_layers(data, nearest=nearest)
-            if profiles is not None and varname in profiles:
-                profiles_dict[varname] = horizontal
-            if horizontal.ndim > 1:
-                env_dict[varname] = self.interpolator1d(horizontal)
-            else:
-                env_dict[varname] = horizontal
+        for varname in self.data_dict:
+            env_dict[varname], profile = self._interpolate_variable(
+                varname, x, y, profiles)
+            if profile is not None:
+                profiles_dict[varname] = profile
 
         return env_dict, profiles_dict
 
+    def _interpolate_variable(self, varname, x, y, profiles=None):
+        """Interpolate one variable with initialised interpolators.
+
+        Returns interpolated values, and vertical profiles
+        (all layers) if requested, otherwise None.
+        """
+        data = self.data_dict[varname]
+        if varname in self.ensemble_variables:
+            return self._interpolate_ensemble(varname, x, y, profiles)
+        nearest = False
+        if varname == 'land_binary_mask':
+            nearest = True
+            self.interpolator2d_nearest = self.plan.interpolator2d_nearest
+        elif (profiles is None or varname not in profiles) and \
+                self.plan.can_gather(data):
+            return self.plan.gather(data), None
+        if data.ndim == 3 and hasattr(self, 'interpolator1d') and \
+                self.Interpolator2DClass is not LinearND2DInterpolator \
+                and (profiles is None or varname not in profiles):
+            # Interpolating only the layers above and below elements
+            return self._interpolate_bracketing_layers(data, x, y), None
+        else:
+            horizontal = self._interpolate_horizontal_layers(data, nearest=nearest)
+        profile = None
+        if profiles is not None and varname in profiles:
+            profile = horizontal
+        if horizontal.ndim > 1:
+            return self.interpolator1d(horizontal), profile
+        else:
+            return horizontal, profile
+
+    def _interpolate_ensemble(self, varname, x, y, profiles=None):
+        """Interpolate each ensemble member at its own elements only.
+
+        Element number i is assigned to ensemble member
+        i modulo the number of members.
+        """
+        data = self.data_dict[varname]
+        num_ensembles = data.shape[0]
+        logging.debug('Interpolating %i ensembles for %s' %
+                      (num_ensembles, varname))
+        nearest = varname == 'land_binary_mask'
+        want_profile = profiles is not None and varname in profiles
+        values = np.zeros(len(x))*np.nan
+        if want_profile and data.ndim == 4:
+            profile = np.zeros((data.shape[1], len(x)))*np.nan
+        for en, (elements, plan) in enumerate(
+                self.plan.ensemble_plans(self, num_ensembles)):
+            if len(elements) == 0:
+                continue
+            member = data[en]
+            if not nearest and not want_profile and plan.can_gather(member):
+                values[elements] = plan.gather(member)
+                continue
+            if nearest is True:
+                interpolator2d = plan.interpolator2d_nearest
+            else:
+                interpolator2d = plan.interpolator2d
+            if member.ndim == 2:
+                values[elements] = interpolator2d(member)
+            else:
+                horizontal = np.array([interpolator2d(layer)
+                                       for layer in member])
+                if want_profile:
+                    profile[:, elements] = horizontal
+                values[elements] = plan.interpolator1d(horizontal)
+        if not want_profile:
+            return values, None
+        elif data.ndim == 3:
+            return values, values
+        else:
+            return values, profile
+
     def _interpolate_horizontal_layers(self, data, nearest=False):
         '''Interpolate all layers of 3d (or 2d) array.'''
 
@@ -340,6 +688,31 @@ class ReaderBlock():
                 result[layer, :] = self.interpolator2d(data[layer, :, :])
             return result
 
+    def _interpolate_bracketing_layers(self, data, x, y):
+        '''Interpolate 3d array at layers bracketing each element only.
+
+        Horizontal interpolation is performed only at the (typically two)
+        vertical layers which are used by the vertical interpolator for
+        each element, avoiding interpolation of all layers.
+        '''
+        layers = self.interpolator1d.bracketing_layers
+        result = np.zeros(len(x))
+        values = np.empty(len(x))
+        for layer in np.unique(np.concatenate([l[0] for l in layers])):
+            needed = np.zeros(len(x), dtype=bool)
+            for index, weight in layers:
+                needed |= index == layer
+            elements = np.where(needed)[0]
+            interpolator2d = self.Interpolator2DClass(
+                self.x, self.y, x[elements], y[elements])
+            if self.Interpolator2DClass is Linear2DInterpolator:
+                interpolator2d.max_expansions = 0  # Already filled
+            values[elements] = interpolator2d(data[layer, :, :])
+            for index, weight in layers:
+                on_layer = index == layer
+                result[on_layer] += weight[on_layer]*values[on_layer]
+        return result
+
     def covers_positions(self, x, y, z=None):
         '''Check if given positions are covered by this reader block.'''
 
@@ -349,3 +722,124 @@ class ReaderBlock():
             return True
         else:
             return False
+
+
+###########################
+# Space-time interpolation
+###########################
+
+def grid_first_is_faster(block, num_elements):
+    """Check if time interpolation on grid is cheaper than at elements.
+
+    Blending two time levels on the grid requires one operation per grid
+    value, whereas interpolation at elements requires for each time
+    level 4 (2D) or 8 (3D, two layers) grid values per element.
+    """
+    grid_values = 0
+    element_values = 0
+    for data in block.data_dict.values():
+        grid_values += data.size
+        element_values += num_elements*(4 if data.ndim == 2 else 8)
+    return grid_values < element_values
+
+
+def interpolate_blocks_in_time(block_before, block_after, weight_after,
+                               x, y, z=None, profiles=None,
+                               time_interpolation='auto'):
+    """Interpolate two ReaderBlocks in space, and linearly in time.
+
+    The interpolation plan (weights) is calculated once, and shared
+    between the blocks if their grids are identical.
+
+    time_interpolation may be:
+        - 'particles': variables which can be gathered are interpolated
+          for both time levels in a single pass into a preallocated array.
+          Ensembles, landmask, profiles and other horizontal methods than
+          linearNDFast are interpolated with the regular interpolators
+          of each block, and weighted thereafter.
+        - 'grid': the two blocks are weighted together on the grid,
+          and thereafter interpolated once. Requires identical grids.
+        - 'auto' (default): 'grid' if grids are identical and blocks
+          are small compared to the number of elements (see
+          grid_first_is_faster), otherwise 'particles'.
+
+    Returns dictionaries of interpolated values and vertical profiles
+    (None if no profiles are requested).
+    """
+    plan_before = InterpolationPlan(block_before, x, y, z)
+    if plan_before.applies_to(block_after, x, y, z):
+        plan_after = plan_before
+    else:
+        plan_after = InterpolationPlan(block_after, x, y, z)
+
+    if time_interpolation == 'auto':
+        if plan_after is plan_before and \
+                grid_first_is_faster(block_before, len(x)):
+            time_interpolation = 'grid'
+        else:
+            time_interpolation = 'particles'
+    if time_interpolation == 'grid':
+        if plan_after is not plan_before:
+            raise ValueError('Time interpolation on grid requires '
+                             'blocks with identical grids')
+        logging.debug('Interpolating in time on grid, before space')
+        block = block_before.blended(block_after, weight_after)
+        env, env_profiles = block.interpolate(x, y, z, profiles=profiles,
+                                              plan=plan_before)
+        if profiles is None:
+            env_profiles = None
+        return env, env_profiles
+
+    levels = [(block_before, plan_before, 1 - weight_after),
+              (block_after, plan_after, weight_after)]
+
+    env = {}
+    slow = []
+    for var in block_before.data_dict:
+        if var == 'land_binary_mask' or (
+                profiles is not None and var in profiles) or \
+                var in block_before.ensemble_variables or \
+                var in block_after.ensemble_variables or \
+                not plan_before.can_gather(block_before.data_dict[var]) or \
+                not plan_after.can_gather(block_after.data_dict[var]):
+            slow.append(var)
+            continue
+        # Single pass over both time levels
+        out = np.zeros(len(x), dtype=plan_before.dtype)
+        for block, plan, weight in levels:
+            plan.gather(block.data_dict[var], weight, out)
+        env[var] = out
+
+    profiles_levels = []
+    if len(slow) > 0 or profiles is not None:
+        for block, plan, weight in levels:
+            block._initialize_interpolator(x, y, z, plan)
+            profiles_dict = {'z': block.z}
+            for var in slow:
+                values, profile = block._interpolate_variable(
+                    var, x, y, profiles)
+                if var not in env:
+                    env[var] = values*weight
+                else:
+                    env[var] = env[var] + values*weight
+                if profile is not None:
+                    profiles_dict[var] = profile
+            profiles_levels.append(profiles_dict)
+
+    # Interpolating vertical profiles in time
+    env_profiles = None
+    if profiles is not None:
+        env_profiles = {}
+        profiles_before, profiles_after = profiles_levels
+        # Truncating layers not present both before and after
+        numlayers = np.minimum(len(profiles_before['z']),
+                               len(profiles_after['z']))
+        env_profiles['z'] = profiles_before['z'][0:numlayers+1]
+        for var in profiles_before:
+            if var == 'z':
+                continue
+            env_profiles[var] = (
+                profiles_before[var][0:numlayers, :]*(1 - weight_after) +
+                profiles_after[var][0:numlayers, :]*weight_after)
+
+    return env, env_profiles
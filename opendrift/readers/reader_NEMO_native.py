@@ -120,10 +120,14 @@ class Reader(BaseReader):
 
         # Find all variables having standard_name
         self.variables = []
+        self.static_variables = []
         for var_name in self.Dataset.variables:
             if var_name in self.NEMO_variable_mapping.keys():
                 var = self.Dataset.variables[var_name]
                 self.variables.append(self.NEMO_variable_mapping[var_name])
+                if var.ndim == 2:  # No time dimension
+                    self.static_variables.append(
+                        self.NEMO_variable_mapping[var_name])
         logging.debug('reader variables : ' + str(self.variables) )
         # Run constructor of parent Reader class
         super(Reader, self).__init__()
@@ -246,16 +250,13 @@ class Reader(BaseReader):
             variables[par] = np.ma.masked_outside(
                 variables[par], -30000, 30000)
 
-            # Ensemble blocks are split into lists
+            # Ensemble blocks are split into lists (of views, no copies)
+            # and stored as one contiguous array by ReaderBlock
             if ensemble_dim is not None:
                 num_ensembles = variables[par].shape[ensemble_dim]
                 logging.debug('Num ensembles: %i ' % num_ensembles)
-                newvar = [0]*num_ensembles
-                for ensemble_num in range(num_ensembles):
-                    newvar[ensemble_num] = \
-                        np.take(variables[par],
-                                ensemble_num, ensemble_dim)
-                variables[par] = newvar
+                variables[par] = list(np.moveaxis(variables[par],
+                                                  ensemble_dim, 0))
 
         # Store coordinates of returned points
         try:
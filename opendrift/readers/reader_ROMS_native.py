@@ -170,10 +170,15 @@ class Reader(BaseReader):
 
         # Find all variables having standard_name
         self.variables = []
+        self.static_variables = []
         for var_name in self.Dataset.variables:
             if var_name in self.ROMS_variable_mapping.keys():
                 var = self.Dataset.variables[var_name]
                 self.variables.append(self.ROMS_variable_mapping[var_name])
+                if var.ndim == 2 and self.ROMS_variable_mapping[var_name] \
+                        not in self.static_variables:  # No time dimension
+                    self.static_variables.append(
+                        self.ROMS_variable_mapping[var_name])
 
         # Run constructor of parent Reader class
         super(Reader, self).__init__()
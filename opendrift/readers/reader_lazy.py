@@ -14,15 +14,145 @@
 #
 # Copyright 2015, Knut-Frode Dagestad, MET Norway
 
+import os
+import json
 import logging
+from datetime import datetime
+
+import numpy as np
+
 from opendrift.readers.basereader import BaseReader
 from opendrift.readers import reader_from_url
 
+time_format = '%Y-%m-%dT%H:%M:%S'
+
+
+class SourceCatalogue(object):
+    '''Persistent record of the coverage of data sources
+
+    The time span, lon/lat bounding box and variables of each source
+    are stored in a JSON file the first time the source is opened,
+    allowing lazy readers to tell whether they are relevant without
+    being initialised. Entries of local files are invalidated if the
+    modification time of the file has changed. Sources whose coverage
+    changes over time (e.g. "latest" forecast aggregations on Thredds)
+    should not be catalogued, or a max_age (timedelta) should be given.
+    '''
+
+    def __init__(self, filename, max_age=None):
+        self.filename = filename
+        self.max_age = max_age
+        self.entries = {}
+        if os.path.exists(filename):
+            try:
+                with open(filename, 'r') as f:
+                    self.entries = json.load(f)
+                logging.debug('Read %i entries from source catalogue %s' %
+                              (len(self.entries), filename))
+            except Exception as e:
+                logging.warning('Could not read source catalogue %s: %s' %
+                                (filename, str(e)))
+
+    def get(self, url):
+        '''Return catalogue entry for url, or None if missing or outdated'''
+        entry = self.entries.get(url)
+        if entry is None:
+            return None
+        if entry['mtime'] is not None and (not os.path.exists(url) or
+                os.path.getmtime(url) != entry['mtime']):
+            logging.debug('Catalogue entry is outdated: ' + url)
+            return None
+        if self.max_age is not None and datetime.now() - \
+                datetime.strptime(entry['catalogued'], time_format) > \
+                self.max_age:
+            logging.debug('Catalogue entry has expired: ' + url)
+            return None
+        return entry
+
+    def record(self, url, reader):
+        '''Store coverage of an initialised reader, and save catalogue'''
+        self.entries[url] = self.coverage(url, reader)
+        try:
+            with open(self.filename, 'w') as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+            logging.debug('Added %s to source catalogue %s' %
+                          (url, self.filename))
+        except Exception as e:
+            logging.warning('Could not write source catalogue %s: %s' %
+                            (self.filename, str(e)))
+
+    @staticmethod
+    def coverage(url, reader):
+        '''Return dictionary with coverage of given reader'''
+        def timestr(t):
+            if t is None:
+                return None
+            return datetime(t.year, t.month, t.day, t.hour, t.minute,
+                            t.second).strftime(time_format)
+
+        # Boundary of reader domain. Extremes between boundary points
+        # are covered by padding with the largest step between points.
+        npoints = 50
+        x = np.concatenate((np.linspace(reader.xmin, reader.xmax, npoints),
+                            [reader.xmax]*npoints,
+                            np.linspace(reader.xmax, reader.xmin, npoints),
+                            [reader.xmin]*npoints))
+        y = np.concatenate(([reader.ymin]*npoints,
+                            np.linspace(reader.ymin, reader.ymax, npoints),
+                            [reader.ymax]*npoints,
+                            np.linspace(reader.ymax, reader.ymin, npoints)))
+        lon, lat = reader.xy2lonlat(x, y)
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        lonpad = np.nanmax(np.abs(np.diff(lon)))
+        latpad = np.nanmax(np.abs(np.diff(lat)))
+        lonmin = np.nanmin(lon) - lonpad
+        lonmax = np.nanmax(lon) + lonpad
+        latmin = max(-90., np.nanmin(lat) - latpad)
+        latmax = min(90., np.nanmax(lat) + latpad)
+        if lonmax - lonmin > 180:
+            # E.g. crossing the dateline, all longitudes are included
+            lonmin, lonmax = -180., 180.
+        # A domain containing a pole covers all longitudes up to the pole
+        for pole in [-90, 90]:
+            px, py = reader.lonlat2xy(0, pole)
+            px = np.atleast_1d(px)[0]
+            py = np.atleast_1d(py)[0]
+            if np.isfinite(px) and np.isfinite(py) and \
+                    reader.xmin <= px <= reader.xmax and \
+                    reader.ymin <= py <= reader.ymax:
+                lonmin, lonmax = -180., 180.
+                if pole > 0:
+                    latmax = 90.
+                else:
+                    latmin = -90.
+        zmin = getattr(reader, 'zmin', None)
+        zmax = getattr(reader, 'zmax', None)
+        if os.path.exists(url):
+            mtime = os.path.getmtime(url)
+        else:
+            mtime = None  # URL or glob pattern
+
+        return {'start_time': timestr(reader.start_time),
+                'end_time': timestr(reader.end_time),
+                'always_valid': bool(reader.always_valid),
+                'global_coverage': bool(reader.global_coverage()),
+                'lonmin': float(lonmin),
+                'lonmax': float(lonmax),
+                'latmin': float(latmin),
+                'latmax': float(latmax),
+                'zmin': None if zmin is None else float(zmin),
+                'zmax': None if zmax is None else float(zmax),
+                'variables': list(reader.variables),
+                'mtime': mtime,
+                'catalogued': datetime.now().strftime(time_format)}
+
 
 class Reader(object):
     '''For lazy initialisation'''
     
     def __init__(self, *args, **kwargs):
+        self._catalogue = kwargs.pop('catalogue', None)
         self._args = args
         self._kwargs = kwargs
         self.initialised = False
@@ -35,6 +165,16 @@ class Reader(object):
                 return self._lazyname
             if name == 'is_lazy':
                 return True
+            entry = self._catalogue_entry()
+            if entry is not None:
+                if name == 'variables':
+                    return entry['variables']
+                if name in ['start_time', 'end_time']:
+                    if entry[name] is None:
+                        return None
+                    return datetime.strptime(entry[name], time_format)
+                if name == 'always_valid':
+                    return entry['always_valid']
             self.initialise()
 
         try:
@@ -45,6 +185,55 @@ class Reader(object):
     def get_variables(self, *args, **kwargs):
         return self.reader.get_variables(*args, **kwargs)
 
+    def _catalogue_entry(self):
+        if self._catalogue is None:
+            return None
+        return self._catalogue.get(self._args[0])
+
+    def is_catalogued(self):
+        '''Whether coverage is known without initialising'''
+        return self.initialised is False and \
+            self._catalogue_entry() is not None
+
+    def covers_time(self, time):
+        entry = self._catalogue_entry()
+        if self.initialised is True or entry is None:
+            if self.initialised is False:
+                self.initialise()
+            return self.reader.covers_time(time)
+        if entry['always_valid'] is True or entry['start_time'] is None:
+            return True
+        if (time < datetime.strptime(entry['start_time'], time_format)) or \
+                (time > datetime.strptime(entry['end_time'], time_format)):
+            return False
+        return True
+
+    def covers_positions(self, lon, lat, z=0):
+        """Return indices of input points covered by reader.
+
+        If the reader is not initialised, coverage is taken from the
+        lon/lat bounding box of the catalogue, which is padded to
+        contain the actual coverage for projected reader domains,
+        including domains containing a pole or crossing the dateline.
+        """
+        entry = self._catalogue_entry()
+        if self.initialised is True or entry is None:
+            if self.initialised is False:
+                self.initialise()
+            return self.reader.covers_positions(lon, lat, z)
+        lon = np.atleast_1d(lon)
+        lat = np.atleast_1d(lat)
+        zmin = -np.inf if entry['zmin'] is None else entry['zmin']
+        zmax = np.inf if entry['zmax'] is None else entry['zmax']
+        covered = (lat >= entry['latmin']) & (lat <= entry['latmax']) & \
+                  (z >= zmin) & (z <= zmax)
+        if entry['global_coverage'] is False:
+            # Compare modulo 360 to handle 0-360 and -180-180 conventions
+            lonspan = entry['lonmax'] - entry['lonmin']
+            covered = covered & (
+                np.mod(lon - entry['lonmin'], 360) <= lonspan)
+        return np.where(covered)[0]
+
     def initialise(self):
         logging.debug('Initialising: ' + self._lazyname)
         self.reader = reader_from_url(self._args[0])
@@ -53,6 +242,9 @@ class Reader(object):
         else:
             logging.debug('Reader initialised: ' + self.reader.name) 
             self.initialised = True
+            if self._catalogue is not None and \
+                    self._catalogue_entry() is None:
+                self._catalogue.record(self._args[0], self.reader)
 
     def __repr__(self):
         if self.initialised is True:
@@ -51,6 +51,7 @@ class Reader(BaseReader):
         if proj4 is not None:  # If user has provided a projection apriori
             self.proj4 = proj4
         # Find x, y and z coordinates
+        time_dimension = None
         for var_name in self.Dataset.variables:
             logging.debug('Parsing variable: ' +  var_name)
             var = self.Dataset.variables[var_name]
@@ -122,6 +123,7 @@ class Reader(BaseReader):
                 # Read and store time coverage (of this particular file)
                 time = var[:]
                 time_units = units
+                time_dimension = var.dimensions[0]
                 self.times = num2date(time, time_units)
                 self.start_time = self.times[0]
                 self.end_time = self.times[-1]
@@ -191,6 +193,7 @@ class Reader(BaseReader):
 
         # Find all variables having standard_name
         self.variable_mapping = {}
+        self.static_variables = []  # Variables without time dimension
         for var_name in self.Dataset.variables:
             if var_name in [self.xname, self.yname, 'depth']:
                 continue  # Skip coordinate variables
@@ -201,6 +204,9 @@ class Reader(BaseReader):
                 if standard_name in self.variable_aliases:  # Mapping if needed
                     standard_name = self.variable_aliases[standard_name]
                 self.variable_mapping[standard_name] = str(var_name)
+                if time_dimension is not None and var.ndim >= 2 and \
+                        time_dimension not in var.dimensions:
+                    self.static_variables.append(standard_name)
 
         self.variables = self.variable_mapping.keys()
 
@@ -325,16 +331,13 @@ class Reader(BaseReader):
             variables[par] = np.ma.masked_outside(
                 variables[par], -30000, 30000)
 
-            # Ensemble blocks are split into lists
+            # Ensemble blocks are split into lists (of views, no copies)
+            # and stored as one contiguous array by ReaderBlock
             if ensemble_dim is not None:
                 num_ensembles = variables[par].shape[ensemble_dim]
                 logging.debug('Num ensembles: %i ' % num_ensembles)
-                newvar = [0]*num_ensembles
-                for ensemble_num in range(num_ensembles):
-                    newvar[ensemble_num] = \
-                        np.take(variables[par],
-                                ensemble_num, ensemble_dim)
-                variables[par] = newvar
+                variables[par] = list(np.moveaxis(variables[par],
+                                                  ensemble_dim, 0))
 
         # Store coordinates of returned points
         try:
@@ -0,0 +1,344 @@
+# This file is part of OpenDrift.
+#
+# OpenDrift is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2
+#
+# OpenDrift is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OpenDrift.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2015, Knut-Frode Dagestad, MET Norway
+
+"""Online statistics of elements, as an alternative to storing history.
+
+Many products (e.g. oil budget, centre of mass, spread ellipse or number
+of stranded elements) do not need the individual trajectories. Statistics
+objects are added to a simulation with add_statistics, and are updated at
+each output time step, when the state of elements is recorded. Only the
+aggregated values are kept, and may be written to a small netCDF file with
+run(statistics_file=...). With run(export_variables=[]), no history of
+elements is stored at all.
+
+All aggregates are sums over elements (counts, weighted sums, moments and
+histograms). For statistics including deactivated elements, the sum over
+deactivated elements is updated only with newly deactivated elements.
+
+Example:
+    o.add_statistics([StatusCounts(), Moments(['lon', 'lat'])])
+    o.run(export_variables=[], statistics_file='statistics.nc')
+"""
+
+from datetime import datetime
+
+import numpy as np
+from netCDF4 import Dataset
+
+from opendrift.export.io_netcdf import time_units
+
+
+class Statistics(object):
+    """Base class of statistics, aggregated over elements at output times.
+
+    Subclasses implement aggregate, returning an array which is a sum
+    over the given elements, with any status dimension first, and
+    variables, returning the arrays to be written to file.
+
+    Attributes:
+        variables_needed: element or environment variables to aggregate.
+        include_deactivated: if True, deactivated elements (with their
+            properties at deactivation) are included, otherwise only
+            active elements.
+        values: list of aggregated arrays, one per output time step,
+            None for steps not (yet) reached.
+    """
+
+    def __init__(self, variables_needed, include_deactivated=False):
+        self.variables_needed = list(variables_needed)
+        self.include_deactivated = include_deactivated
+
+    def allocate(self, simulation, num_times):
+        """Prepare for a new run with given number of output time steps."""
+        if self.include_deactivated is True:
+            for var in self.variables_needed:
+                if var not in simulation.ElementType.variables:
+                    raise ValueError(
+                        '%s is not an element property, and is not '
+                        'available for deactivated elements' % var)
+        else:
+            for var in self.variables_needed:
+                if var not in simulation.ElementType.variables and \
+                        var not in simulation.required_variables:
+                    raise ValueError('%s is not an element property or '
+                                     'environment variable of %s' %
+                                     (var, type(simulation).__name__))
+        self.values = [None]*num_times
+        self.deactivated = 0  # Sum over elements already deactivated
+        self.num_deactivated = 0
+
+    def element_values(self, elements, environment, index):
+        """Dict with values of needed variables and status of elements."""
+        values = {}
+        for var in self.variables_needed + ['status']:
+            if var in elements.variables:
+                value = getattr(elements, var)
+                if np.ndim(value) == 0 or len(value) < len(elements):
+                    value = value*np.ones(len(elements))  # Scalar
+                values[var] = np.asarray(value)[index]
+            else:
+                values[var] = np.asarray(getattr(environment, var))[index]
+        return values
+
+    def update(self, simulation, time_index):
+        """Aggregate elements of simulation at given output time step."""
+        num_status = len(simulation.status_categories)
+        elements = simulation.elements
+        environment = getattr(simulation, 'environment', None)
+        if self.include_deactivated is False:
+            index = np.where(np.asarray(elements.status) == 0)[0]
+            self.values[time_index] = self.aggregate(
+                self.element_values(elements, environment, index),
+                num_status)
+            return
+
+        deactivated = simulation.elements_deactivated
+        if len(deactivated) > self.num_deactivated:
+            index = np.arange(self.num_deactivated, len(deactivated))
+            self.deactivated = add(self.deactivated, self.aggregate(
+                self.element_values(deactivated, None, index), num_status))
+            self.num_deactivated = len(deactivated)
+        self.values[time_index] = add(self.deactivated, self.aggregate(
+            self.element_values(elements, environment,
+                                np.arange(len(elements))), num_status))
+
+    def aggregate(self, values, num_status):
+        """Sum over elements, given values of needed variables."""
+        raise NotImplementedError
+
+    def stack(self, num_times):
+        """Masked array (time, ...) of aggregates of the first time steps.
+
+        Status categories added during the run are zero before they were
+        added, and time steps which were not reached are masked.
+        """
+        values = self.values[0:num_times]
+        shapes = [v.shape for v in values if v is not None]
+        if len(shapes) == 0:
+            return np.ma.masked_all((num_times,))
+        shape = tuple(np.max(shapes, axis=0))
+        data = np.ma.masked_all((num_times,) + shape)
+        for i, value in enumerate(values):
+            if value is not None:
+                data[i] = 0
+                data[(i,) + tuple(slice(0, s) for s in value.shape)] = value
+        return data
+
+    def variables(self, num_times):
+        """Dict of name: (dimensions, data, attributes) to write to file."""
+        raise NotImplementedError
+
+
+def add(a, b):
+    """Sum of aggregates, padding any status dimension of different length."""
+    a = np.asarray(a)
+    b = np.asarray(b)
+    if a.ndim > 0 and b.ndim > 0 and a.shape[0] != b.shape[0]:
+        if a.shape[0] < b.shape[0]:
+            a, b = b, a
+        b = np.concatenate([b, np.zeros((a.shape[0] - b.shape[0],) +
+                                        b.shape[1:], dtype=b.dtype)])
+    return a + b
+
+
+class StatusCounts(Statistics):
+    """Number of elements of each status category (e.g. stranded)."""
+
+    def __init__(self):
+        super(StatusCounts, self).__init__([], include_deactivated=True)
+
+    def aggregate(self, values, num_status):
+        return np.bincount(values['status'].astype(np.int64),
+                           minlength=num_status)
+
+    def variables(self, num_times):
+        return {'number_of_elements': (
+            ('time', 'status'), self.stack(num_times).astype(np.int32),
+            {'long_name': 'Number of elements of each status category'})}
+
+
+class Sums(Statistics):
+    """Sum of element properties (e.g. mass) for each status category."""
+
+    def __init__(self, variables, include_deactivated=True):
+        super(Sums, self).__init__(variables, include_deactivated)
+
+    def aggregate(self, values, num_status):
+        status = values['status'].astype(np.int64)
+        return np.array(
+            [np.bincount(status, weights=values[var], minlength=num_status)
+             for var in self.variables_needed]).T
+
+    def variables(self, num_times):
+        data = self.stack(num_times)
+        return {'sum_' + var: (
+            ('time', 'status'), data[:, :, i],
+            {'long_name': 'Sum of %s of elements of each status category'
+             % var}) for i, var in enumerate(self.variables_needed)}
+
+
+class Moments(Statistics):
+    """Weighted mean and covariance of element properties.
+
+    With variables lon and lat (default), this gives the centre of mass
+    and the spread ellipse of the elements.
+    """
+
+    def __init__(self, variables=['lon', 'lat'], weight=None,
+                 include_deactivated=False):
+        self.moment_variables = list(variables)
+        self.weight = weight
+        super(Moments, self).__init__(
+            self.moment_variables + ([weight] if weight is not None else []),
+            include_deactivated)
+
+    def aggregate(self, values, num_status):
+        # Sums of weight, weighted values and weighted products of values
+        x = np.array([values[var] for var in self.moment_variables],
+                     dtype=np.float64)
+        w = np.ones(x.shape[1]) if self.weight is None else \
+            np.asarray(values[self.weight], dtype=np.float64)
+        n = len(self.moment_variables)
+        sums = np.zeros(1 + n + n*n)
+        sums[0] = w.sum()
+        sums[1:1 + n] = np.dot(x, w)
+        sums[1 + n:] = np.dot(x*w, x.T).ravel()
+        return sums
+
+    def mean_and_covariance(self, num_times):
+        """Weights, mean (time, variable) and covariance (time, var, var)."""
+        n = len(self.moment_variables)
+        sums = self.stack(num_times).reshape(num_times, -1)
+        weight = sums[:, 0]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = sums[:, 1:1 + n] / weight[:, np.newaxis]
+            covariance = sums[:, 1 + n:].reshape(num_times, n, n) / \
+                weight[:, np.newaxis, np.newaxis] - \
+                mean[:, :, np.newaxis]*mean[:, np.newaxis, :]
+        return weight, np.ma.masked_invalid(mean), \
+            np.ma.masked_invalid(covariance)
+
+    def variables(self, num_times):
+        weight, mean, covariance = self.mean_and_covariance(num_times)
+        name = 'sum_weight' if self.weight is None else \
+            'sum_weight_' + self.weight
+        variables = {name: (('time',), weight, {
+            'long_name': 'Sum of weights of elements for moments'})}
+        for i, var in enumerate(self.moment_variables):
+            variables['mean_' + var] = (('time',), mean[:, i], {
+                'long_name': 'Weighted mean of %s' % var})
+            for j, var2 in enumerate(self.moment_variables[i:], i):
+                variables['covariance_%s_%s' % (var, var2)] = (
+                    ('time',), covariance[:, i, j], {
+                        'long_name': 'Weighted covariance of %s and %s' %
+                        (var, var2)})
+        return variables
+
+
+class Histogram(Statistics):
+    """Weighted histogram of an element property or environment variable.
+
+    E.g. Histogram('z', bins=[-50, -10, -1, 0], weight='mass_oil') gives
+    the mass of oil in given depth intervals.
+    """
+
+    def __init__(self, variable, bins, weight=None,
+                 include_deactivated=False):
+        self.variable = variable
+        self.bins = np.asarray(bins, dtype=np.float64)
+        self.weight = weight
+        super(Histogram, self).__init__(
+            [variable] + ([weight] if weight is not None else []),
+            include_deactivated)
+
+    def aggregate(self, values, num_status):
+        weights = None if self.weight is None else values[self.weight]
+        return np.histogram(values[self.variable], bins=self.bins,
+                            weights=weights)[0].astype(np.float64)
+
+    def variables(self, num_times):
+        dimension = 'bin_' + self.variable
+        name = 'histogram_' + self.variable
+        if self.weight is not None:
+            name = name + '_weight_' + self.weight
+        return {
+            dimension: ((dimension,), 0.5*(self.bins[1:] + self.bins[0:-1]),
+                        {'long_name': 'Centre of bins of %s' %
+                         self.variable,
+                         'bounds': 'bounds_' + dimension}),
+            'bounds_' + dimension: (
+                (dimension, 'bounds'),
+                np.array([self.bins[0:-1], self.bins[1:]]).T, {}),
+            name: (('time', dimension), self.stack(num_times), {
+                'long_name': 'Histogram of %s' % self.variable +
+                ('' if self.weight is None else
+                 ', weighted by %s' % self.weight)})}
+
+
+def write_netcdf(simulation, filename):
+    """Write statistics of last run of simulation to netCDF file."""
+    num_times = simulation.steps_output
+    times = simulation.get_time_array()[0]
+    with Dataset(filename, 'w') as f:
+        f.createDimension('time', num_times)
+        f.createDimension('status', len(simulation.status_categories))
+        f.createVariable('time', 'f8', ('time',))
+        f.variables['time'][:] = [
+            (t - datetime(1970, 1, 1)).total_seconds() for t in times]
+        f.variables['time'].units = time_units
+        f.variables['time'].standard_name = 'time'
+        f.variables['time'].long_name = 'time'
+        f.createVariable('status', 'i4', ('status',))
+        f.variables['status'][:] = np.arange(
+            len(simulation.status_categories))
+        f.variables['status'].flag_values = np.arange(
+            len(simulation.status_categories))
+        f.variables['status'].flag_meanings = \
+            ' '.join(simulation.status_categories)
+
+        f.Conventions = 'CF-1.6'
+        f.history = 'Created ' + str(datetime.now())
+        f.source = 'Statistics from simulation with OpenDrift'
+        f.opendrift_class = simulation.__class__.__name__
+        f.opendrift_module = simulation.__class__.__module__
+        f.time_coverage_start = str(simulation.start_time)
+        f.time_coverage_end = str(times[-1])
+        f.time_step_output = str(simulation.time_step_output)
+        f.num_elements_activated = simulation.num_elements_activated()
+
+        for statistics in simulation.statistics:
+            for name, (dimensions, data, attributes) in \
+                    statistics.variables(num_times).items():
+                if name in f.variables:
+                    raise ValueError('Statistics variable %s is written '
+                                     'by several statistics' % name)
+                for dimension, size in zip(dimensions, np.shape(data)):
+                    if dimension not in f.dimensions:
+                        f.createDimension(dimension, size)
+                if dimensions == ('time', 'status'):
+                    # Pad status categories added after the last update
+                    steps = ~np.ma.getmaskarray(data)[:, 0]
+                    padded = np.ma.masked_all(
+                        (num_times, len(f.dimensions['status'])),
+                        dtype=data.dtype)
+                    padded[steps] = 0
+                    padded[steps, 0:data.shape[1]] = data[steps]
+                    data = padded
+                var = f.createVariable(name, np.ma.asarray(data).dtype,
+                                       dimensions)
+                var[:] = data
+                for key, value in attributes.items():
+                    var.setncattr(key, value)
@@ -18,6 +18,7 @@
 # Copyright 2015, Knut-Frode Dagestad, MET Norway
 
 import unittest
+import weakref
 
 import numpy as np
 
@@ -84,5 +85,57 @@ class TestElements(unittest.TestCase):
         self.assertEqual(len(e2), 2)
         self.assertEqual(len(e3), 1)
 
+    def test_reserve(self):
+        """Preallocated buffers are reused when moving elements"""
+        A1 = LagrangianArray(lon=np.arange(10.), lat=60.0)
+        A2 = LagrangianArray()
+        A2.reserve(10)
+        buffer = A2._buffers['lon']
+        # Moving first elements only moves offset of A1
+        A1.move_elements(A2, np.arange(10) < 3)
+        self.assertEqual(len(A1), 7)
+        self.assertEqual(A1._offsets['lon'], 3)
+        self.assertListEqual(list(A2.lon), [0., 1., 2.])
+        A1.move_elements(A2, np.arange(7) % 2 == 1)
+        self.assertListEqual(list(A1.lon), [3., 5., 7., 9.])
+        self.assertListEqual(list(A2.lon), [0., 1., 2., 4., 6., 8.])
+        self.assertIs(A2._buffers['lon'], buffer)
+        # Compacting in place
+        A2.move_elements(A1, np.array([False, True, False, True,
+                                       False, False]))
+        self.assertIs(A2._buffers['lon'], buffer)
+        self.assertListEqual(list(A2.lon), [0., 2., 6., 8.])
+        self.assertListEqual(list(A1.lon), [3., 5., 7., 9., 1., 4.])
+        self.assertListEqual(list(A2.lat), [60.]*4)
+        self.assertEqual(len(A2), 4)
+        # Setting new arrays
+        A2.lon = np.array([1., 2., 3., 4.])
+        self.assertEqual(len(A2), 4)
+        self.assertListEqual(list(A2.lon), [1., 2., 3., 4.])
+
+    def test_reserve_reassign(self):
+        """Reassigned arrays replace values, buffers are reused"""
+        A = LagrangianArray(lon=np.arange(3.), lat=np.arange(3.))
+        A.reserve(100)
+        buffers = [weakref.ref(A._buffers['lon']),
+                   weakref.ref(A._buffers['lat'])]
+        for i in range(5):
+            # As update_positions, assigning new arrays each step
+            A.lon, A.lat = A.lon + 1, A.lat + 2
+            A.extend(LagrangianArray(lon=np.zeros(3), lat=np.zeros(3)))
+        self.assertIs(A._buffers['lon'], buffers[0]())
+        self.assertIs(A._buffers['lat'], buffers[1]())
+        self.assertEqual(len(A), 18)
+        self.assertListEqual(list(A.lon[0:3]), [5., 6., 7.])
+        self.assertListEqual(list(A.lat[-6:]), [2.]*3 + [0.]*3)
+        # Earlier references are not modified by assignment or appending
+        lon = A.lon
+        A.lon = A.lon + 1
+        self.assertListEqual(list(lon[0:3]), [5., 6., 7.])
+        A.extend(LagrangianArray(lon=np.zeros(3), lat=np.zeros(3)))
+        self.assertListEqual(list(lon[0:3]), [5., 6., 7.])
+        self.assertListEqual(list(A.lon[0:3]), [6., 7., 8.])
+        self.assertIsNot(A._buffers['lon'], buffers[0]())
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of OpenDrift.
+#
+# OpenDrift is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2
+#
+# OpenDrift is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OpenDrift.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2015, Knut-Frode Dagestad, MET Norway
+
+import unittest
+import os
+import tempfile
+
+import numpy as np
+from netCDF4 import Dataset
+
+from opendrift.history import RaggedHistory, FileHistory
+
+
+class TestRaggedHistory(unittest.TestCase):
+
+    dtype = np.dtype([('lon', np.float32), ('status', np.int32)])
+
+    def test_dense(self):
+        h = RaggedHistory(self.dtype, (3, 4), capacity=2)
+        h.append(np.array([0, 1]), 0, {'lon': np.array([1., 2.]),
+                                       'status': np.array([0, 0])})
+        h.append(np.array([1, 2]), 1, {'lon': np.array([3., 4.]),
+                                       'status': np.array([0, 1])})
+        # Element-step written twice, last value is kept
+        h.append(np.array([2]), 1, {'lon': np.array([5.]),
+                                    'status': np.array([1])})
+        self.assertEqual(h.num_observations, 5)
+        self.assertEqual(len(h.unique_observations()), 4)
+        lon = h['lon']
+        self.assertEqual(lon.shape, (3, 4))
+        self.assertEqual(lon.count(), 4)
+        self.assertEqual(lon[2, 1], 5)
+        self.assertEqual(h['status'][2, 1], 1)
+        self.assertTrue(lon.mask[0, 1])
+        dense = h.dense()
+        np.testing.assert_array_equal(dense['lon'], lon)
+
+        h.truncate(2, 2)
+        self.assertEqual(h['lon'].shape, (2, 2))
+        h.clear()
+        self.assertEqual(h['lon'].count(), 0)
+
+    def test_missing_values(self):
+        h = RaggedHistory(self.dtype, (2, 1))
+        h.append(np.array([0, 1]), 0,
+                 {'lon': np.ma.masked_array([1., 2.], mask=[False, True]),
+                  'status': np.array([0, 0])})
+        self.assertEqual(h['lon'].count(), 1)
+        self.assertEqual(h['status'].count(), 2)
+
+
+class TestFileHistory(unittest.TestCase):
+
+    def test_read(self):
+        lon = np.ma.masked_invalid(np.arange(12.).reshape(3, 4))
+        lon[2, 0:2] = np.ma.masked  # Seeded later
+        with Dataset('file_history.nc', 'w') as f:
+            f.createDimension('trajectory', 4)
+            f.createDimension('time', 5)
+            f.createVariable('time', 'f8', ('time',))[:] = np.arange(5)*3600
+            var = f.createVariable('lon', 'f4', ('trajectory', 'time'))
+            var[0:3, 0:4] = lon
+        h = FileHistory('file_history.nc', shape=(3, 4))
+        self.assertEqual(h.dtype.names, ('lon',))
+        np.testing.assert_array_equal(h['lon'], lon)
+        np.testing.assert_array_equal(h['lon'].mask, lon.mask)
+        subset = h.read('lon', elements=slice(1, 3), times=slice(1, 3))
+        np.testing.assert_array_equal(subset, lon[1:3, 1:3])
+        self.assertRaises(KeyError, h.__getitem__, 'lat')
+        self.assertEqual(FileHistory('file_history.nc').shape, (4, 5))
+        os.remove('file_history.nc')
+
+
+    def test_read_ragged_cached(self):
+        fd, filename = tempfile.mkstemp(suffix='.nc')
+        os.close(fd)
+        self.addCleanup(os.remove, filename)
+        with Dataset(filename, 'w') as f:
+            f.createDimension('trajectory', 3)
+            f.createDimension('obs', 4)
+            f.createVariable('trajectory_index', 'i4', ('obs',))[:] = \
+                [0, 1, 0, 2]
+            f.createVariable('time', 'f8', ('obs',))[:] = \
+                [0, 0, 3600, 3600]
+            for name in ['lon', 'lat']:
+                f.createVariable(name, 'f4', ('obs',))[:] = [1, 2, 3, 4]
+            f.steps_output = 3
+            f.num_elements_activated = 3
+        h = FileHistory(filename)
+        self.assertEqual(h.shape, (3, 3))
+        lon = h['lon']
+        np.testing.assert_array_equal(lon[:, 0:2], [[1, 3], [2, 0], [0, 4]])
+        np.testing.assert_array_equal(
+            lon.mask, [[False, False, True], [False, True, True],
+                       [True, False, True]])
+        # Fields and index arrays are not read again from file
+        with Dataset(filename, 'a') as f:
+            f.variables['lon'][:] = 0
+            f.variables['trajectory_index'][:] = 0
+        self.assertIs(h['lon'], lon)
+        np.testing.assert_array_equal(h['lat'][:, 0:2].mask,
+                                      lon[:, 0:2].mask)
+        # Only the last few fields are kept
+        for i in range(h.max_cached):
+            h.read('lat', elements=slice(i, i + 1))
+        self.assertIsNot(h['lon'], lon)
+        self.assertEqual(h['lon'].sum(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
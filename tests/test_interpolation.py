@@ -26,10 +26,13 @@ from opendrift.models.oceandrift import OceanDrift
 from opendrift.readers import reader_netCDF_CF_generic
 from opendrift.readers import reader_ROMS_native
 from opendrift.readers.interpolation import \
-        expand_numpy_array, \
+        expand_numpy_array, fill_NaN_from_nearest, \
+        fill_NaN_towards_seafloor, \
         ReaderBlock, LinearND2DInterpolator, \
         NDImage2DInterpolator, Nearest2DInterpolator, \
-        Nearest1DInterpolator, Linear1DInterpolator
+        Nearest1DInterpolator, Linear1DInterpolator, \
+        interpolate_blocks_in_time, InterpolationPlan, Linear2DInterpolator, \
+        grid_first_is_faster
 
 o = OceanDrift()
 
@@ -135,6 +138,152 @@ class TestInterpolation(unittest.TestCase):
         self.assertEqual(v3e[1], 32)
         self.assertAlmostEqual(v3e[3], 31)
 
+        # Ensembles are stored as one contiguous array
+        self.assertEqual(b.data_dict['var3de'].shape, (3, 5, 100, 200))
+        self.assertEqual(b.data_dict['var3de'].dtype, np.float32)
+        self.assertTrue(b.data_dict['var3de'].flags['C_CONTIGUOUS'])
+        self.assertEqual(b.ensemble_variables, set(['var2de', 'var3de']))
+
+        # Each member is interpolated at its own elements only
+        data_dict, x, y, z = self.get_synthetic_data_dict()
+        members = [data_dict['var3d']*(en + 1) for en in range(3)]
+        data_dict['var3de'] = members
+        for method in ['linearNDFast', 'ndimage']:
+            b = ReaderBlock(data_dict.copy(),
+                            interpolation_horizontal=method)
+            env, prof = b.interpolate(x, y, z.copy(), profiles=['var3de'])
+            env2, prof2 = b.interpolate(x, y, z.copy())
+            self.assertIsNone(np.testing.assert_array_almost_equal(
+                env['var3de'], env2['var3de'], 5))
+            for en in range(3):
+                elements = np.arange(en, len(x), 3)
+                bm = ReaderBlock({'x': b.x, 'y': b.y, 'z': b.z,
+                                  'time': b.time,
+                                  'var3d': b.data_dict['var3de'][en]},
+                                 interpolation_horizontal=method)
+                envm, profm = bm.interpolate(x[elements], y[elements],
+                                             z[elements].copy(),
+                                             profiles=['var3d'])
+                self.assertIsNone(np.testing.assert_array_almost_equal(
+                    env['var3de'][elements], envm['var3d'], 5))
+                self.assertIsNone(np.testing.assert_array_almost_equal(
+                    prof['var3de'][:, elements], profm['var3d'], 5))
+
+    def test_interpolation_bracketing_layers(self):
+        """Interpolating only bracketing layers equals interpolating all"""
+        for method in ['linearNDFast', 'ndimage', 'nearest']:
+            data_dict, x, y, z = self.get_synthetic_data_dict()
+            b = ReaderBlock(data_dict, interpolation_horizontal=method)
+            var3d = b.data_dict['var3d'].copy()
+            # Fused interpolation (no profiles requested)
+            env, prof = b.interpolate(x, y, z.copy(), ['var3d'])
+            # Interpolating all layers, and thereafter vertically
+            b.data_dict['var3d'] = var3d
+            b._initialize_interpolator(x, y, z.copy())
+            all_layers = b._interpolate_horizontal_layers(var3d)
+            self.assertEqual(all_layers.shape, (len(b.z), len(x)))
+            self.assertIsNone(np.testing.assert_array_almost_equal(
+                env['var3d'], b.interpolator1d(all_layers)))
+        # Profiles are still provided when requested
+        env, prof = b.interpolate(x, y, z, ['var3d'], profiles=['var3d'],
+                                  profiles_depth=[-30, 0])
+        self.assertEqual(prof['var3d'].shape, (len(b.z), len(x)))
+
+    def test_interpolation_space_time(self):
+        """Single pass space-time kernel equals separate interpolation"""
+        for method, profiles in [('linearNDFast', None),
+                                 ('linearNDFast', ['var3d']),
+                                 ('ndimage', ['var3d'])]:
+            blocks = []
+            for factor in [1, 2]:
+                data_dict, x, y, z = self.get_synthetic_data_dict()
+                data_dict['var2d'] = data_dict['var2d']*factor
+                data_dict['var3d'] = data_dict['var3d']*factor + factor
+                data_dict['land_binary_mask'] = \
+                    np.ma.array(data_dict['var2d'].mask*1.)
+                blocks.append([ReaderBlock(data_dict.copy(),
+                                           interpolation_horizontal=method),
+                               ReaderBlock(data_dict.copy(),
+                                           interpolation_horizontal=method)])
+            env, prof = interpolate_blocks_in_time(
+                blocks[0][0], blocks[1][0], .3, x, y, z.copy(), profiles)
+            env_before, prof_before = blocks[0][1].interpolate(
+                x, y, z.copy(), profiles=profiles)
+            env_after, prof_after = blocks[1][1].interpolate(
+                x, y, z.copy(), profiles=profiles)
+            for var in ['var2d', 'var3d', 'land_binary_mask']:
+                self.assertIsNone(np.testing.assert_array_almost_equal(
+                    env[var], env_before[var]*.7 + env_after[var]*.3))
+            if profiles is None:
+                self.assertIsNone(prof)
+            else:
+                self.assertIsNone(np.testing.assert_array_almost_equal(
+                    prof['var3d'], prof_before['var3d']*.7 +
+                    prof_after['var3d']*.3))
+                self.assertIsNone(np.testing.assert_array_equal(
+                    prof['z'], blocks[0][0].z))
+
+    def test_interpolation_grid_first(self):
+        """Time interpolation on grid equals time interpolation at elements"""
+        for method in ['linearNDFast', 'ndimage']:
+            env = {}
+            for time_interpolation in ['particles', 'grid']:
+                blocks = []
+                for factor in [1, 2]:
+                    data_dict, x, y, z = self.get_synthetic_data_dict()
+                    data_dict['var2d'] = data_dict['var2d']*factor
+                    data_dict['var3d'] = data_dict['var3d']*factor + factor
+                    blocks.append(ReaderBlock(
+                        data_dict, interpolation_horizontal=method))
+                env[time_interpolation], prof = interpolate_blocks_in_time(
+                    blocks[0], blocks[1], .3, x, y, z.copy(),
+                    time_interpolation=time_interpolation)
+                self.assertIsNone(prof)
+            for var in ['var2d', 'var3d']:
+                self.assertIsNone(np.testing.assert_array_almost_equal(
+                    env['particles'][var], env['grid'][var]))
+        # Grid first is chosen only if many elements within small block
+        self.assertFalse(grid_first_is_faster(blocks[0], 100))
+        self.assertTrue(grid_first_is_faster(blocks[0], 100000))
+
+    def test_interpolation_plan(self):
+        """Interpolation plan is shared, and gather equals linearNDFast"""
+        data_dict, x, y, z = self.get_synthetic_data_dict()
+        b = ReaderBlock(data_dict)
+        plan = InterpolationPlan(b, x, y, z)
+        self.assertTrue(plan.applies_to(b, x, y, z))
+        self.assertFalse(plan.applies_to(b, x, y + 1, z))
+        self.assertTrue(plan.can_gather(b.data_dict['var3d']))
+        # Positions also at (and beyond) the grid edges
+        x2 = np.concatenate((x, [b.x.max() + 1, b.x.min()]))
+        y2 = np.concatenate((y, [b.y.max(), b.y.min() - 1]))
+        plan2 = InterpolationPlan(b, x2, y2)
+        self.assertIsNone(np.testing.assert_array_almost_equal(
+            plan2.gather(b.data_dict['var2d']),
+            Linear2DInterpolator(b.x, b.y, x2, y2)(b.data_dict['var2d'])))
+        # Plan given to interpolate is reused
+        env, prof = b.interpolate(x, y, z, plan=plan)
+        self.assertIs(b.plan, plan)
+        self.assertIs(b.interpolator2d, plan.interpolator2d)
+        env2, prof2 = b.interpolate(x, y + 1, z, plan=plan)
+        self.assertIsNot(b.plan, plan)
+
+    def test_interpolation_float32(self):
+        """Blocks and interpolation may be kept in float32"""
+        data_dict, x, y, z = self.get_synthetic_data_dict()
+        b64 = ReaderBlock(data_dict.copy())
+        b32 = ReaderBlock(data_dict.copy(), dtype=np.float32)
+        for var in ['var2d', 'var3d']:
+            self.assertEqual(b32.data_dict[var].dtype, np.float32)
+        env64, prof64 = b64.interpolate(x, y, z.copy())
+        env32, prof32 = b32.interpolate(x, y, z.copy())
+        for var in ['var2d', 'var3d']:
+            self.assertEqual(env32[var].dtype, np.float32)
+            self.assertIsNone(np.testing.assert_array_almost_equal(
+                env32[var], env64[var], 5))
+        env, prof = interpolate_blocks_in_time(b32, b32, .5, x, y, z.copy())
+        self.assertEqual(env['var3d'].dtype, np.float32)
+
     def test_interpolation_vertical(self):
 
         # 3 elements, 4 depths
@@ -304,9 +453,13 @@ class TestInterpolation(unittest.TestCase):
         z2 = np.random.uniform(-20, 0, num_points)
         self.assertTrue(b.covers_positions(x, y, z))
         self.assertTrue(b.covers_positions(x2, y2, z2))
-        # Check that there are holes in the arrays of the ReaderBlock
+        # Check that holes in the arrays have been filled when
+        # creating the ReaderBlock
         self.assertEqual(
-            np.sum(~np.isfinite(b.data_dict['x_sea_water_velocity'])), 1001)
+            np.sum(~np.isfinite(data['x_sea_water_velocity'].filled(np.nan))),
+            1001)
+        self.assertEqual(
+            np.sum(~np.isfinite(b.data_dict['x_sea_water_velocity'])), 0)
         # Check that LinearNDFast interpolation gives a real value
         env, prof = b.interpolate(x2, y2, z2,
                                   variables,
@@ -327,6 +480,73 @@ class TestInterpolation(unittest.TestCase):
         self.assertEqual(
             np.sum(~np.isfinite(env['x_sea_water_velocity'])), 31)
 
+    def test_fill_NaN_from_nearest(self):
+        data = np.arange(12.).reshape(3, 4)
+        data[1, 1:3] = np.nan
+        data[0, 0] = np.nan
+        mask, indices = fill_NaN_from_nearest(data)
+        self.assertTrue(np.isfinite(data).all())
+        self.assertEqual(data[0, 0], 4)
+        self.assertEqual(data[1, 2], 2)
+        self.assertEqual(mask.sum(), 3)
+        # Cells far from valid data remain NaN
+        data = np.ones((3, 30))
+        data[:, 10:] = np.nan
+        fill_NaN_from_nearest(data)
+        self.assertTrue(np.isfinite(data[:, 0:20]).all())
+        self.assertFalse(np.isfinite(data[:, 21:]).any())
+
+        # Missing values are filled once for linearNDFast blocks only
+        data_dict, x, y, z = self.get_synthetic_data_dict()
+        b = ReaderBlock(data_dict.copy())
+        self.assertTrue(np.isfinite(b.data_dict['var2d']).all())
+        self.assertTrue(np.isfinite(b.data_dict['var3d']).all())
+        data_dict, x, y, z = self.get_synthetic_data_dict()
+        b = ReaderBlock(data_dict, interpolation_horizontal='ndimage')
+        self.assertFalse(np.isfinite(b.data_dict['var2d']).all())
+
+    def test_fill_NaN_towards_seafloor(self):
+        data = np.random.RandomState(0).rand(5, 4, 3)
+        data[1:, 0, 0] = np.nan  # Seafloor below first layer
+        data[3:, 2, 1] = np.nan
+        data[2, 3, 2] = np.nan   # Hole within column
+        data[:, 1, 1] = np.nan   # Land
+        expected = data.copy()
+        for i in range(1, expected.shape[0]):
+            mask = np.isnan(expected[i, :, :])
+            expected[i, mask] = expected[i-1, mask]
+        cache = {}
+        filled = data.copy()
+        self.assertTrue(fill_NaN_towards_seafloor(filled, cache))
+        self.assertIsNone(np.testing.assert_array_equal(filled, expected))
+        self.assertEqual(len(cache), 1)
+        # Indices are reused for another array with same mask
+        filled = data.copy()*2
+        self.assertTrue(fill_NaN_towards_seafloor(filled, cache))
+        self.assertIsNone(np.testing.assert_array_equal(filled, expected*2))
+        self.assertEqual(len(cache), 1)
+        self.assertFalse(fill_NaN_towards_seafloor(expected[0:1], cache))
+        # Only the most recently used masks are kept
+        for i in range(5):
+            varying = data.copy()
+            varying[4, 3, i % 3] = np.nan
+            self.assertTrue(fill_NaN_towards_seafloor(varying, cache))
+            self.assertLessEqual(len(cache), 2)
+        self.assertTrue(fill_NaN_towards_seafloor(data.copy(), cache))
+        self.assertEqual(len(cache), 2)
+
+        # Cache is shared by blocks of the same grid window
+        seafloor_cache = {}
+        for i in range(2):
+            data_dict, x, y, z = self.get_synthetic_data_dict()
+            ReaderBlock(data_dict, seafloor_cache=seafloor_cache)
+        self.assertEqual(len(seafloor_cache), 1)
+        self.assertEqual(len(list(seafloor_cache.values())[0]), 1)
+        data_dict, x, y, z = self.get_synthetic_data_dict()
+        data_dict['x'] = data_dict['x'] + 1
+        ReaderBlock(data_dict, seafloor_cache=seafloor_cache)
+        self.assertEqual(len(seafloor_cache), 2)
+
     def test_expand_array(self):
         reader = reader_ROMS_native.Reader(o.test_data_folder() +
             '2Feb2016_Nordic_sigma_3d/Nordic-4km_SLEVELS_avg_00_subset2Feb2016.nc')
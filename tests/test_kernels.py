@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of OpenDrift.
+#
+# OpenDrift is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2
+#
+# OpenDrift is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with OpenDrift.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright 2015, Knut-Frode Dagestad, MET Norway
+
+import unittest
+
+import numpy as np
+
+from opendrift import kernels
+from opendrift.kernels import kernel_backends, set_backend, get_kernel
+
+
+class TestKernels(unittest.TestCase):
+    """Tests that numpy and numba kernels give the same results"""
+
+    def setUp(self):
+        self.random = np.random.RandomState(0)
+
+    def tearDown(self):
+        set_backend('auto')
+
+    def test_bilinear_gather(self):
+        num = 50
+        data = self.random.rand(3, 6, 7)
+        indices = self.random.randint(0, 6*7, (4, num))
+        weights = self.random.rand(4, num)
+        layer_index = self.random.randint(0, 3, (2, num))
+        layer_weight = self.random.rand(2, num)
+        results = []
+        for backend in ['numpy', 'numba']:
+            gather = kernel_backends[backend]['bilinear_gather']
+            out = np.ones(num)
+            results.append(gather(data.ravel(), indices, weights,
+                                  layer_index, layer_weight, 6*7, .5, out))
+            self.assertIs(results[-1], out)
+        self.assertTrue(np.allclose(results[0], results[1]))
+
+    def test_profile_at_index(self):
+        profiles = self.random.rand(10, 30)
+        zi = self.random.uniform(0, 9, 30)
+        zi[[3, 5]] = np.nan
+        results = [kernel_backends[backend]['profile_at_index'](
+            profiles, zi) for backend in ['numpy', 'numba']]
+        self.assertTrue(np.allclose(results[0], results[1]))
+        self.assertEqual(results[1][3], profiles[0, 3])
+
+    def test_geod_fwd(self):
+        num = 30
+        lon = self.random.uniform(-179, 179, num)
+        lat = self.random.uniform(-80, 80, num)
+        azimuth = self.random.uniform(-180, 180, num)
+        distance = self.random.uniform(0, 50000, num)
+        distance[0] = 0
+        lon1, lat1 = kernel_backends['numpy']['geod_fwd'](
+            lon, lat, azimuth, distance)
+        lon2, lat2 = kernel_backends['numba']['geod_fwd'](
+            lon, lat, azimuth, distance)
+        self.assertTrue(np.allclose(lat1, lat2, atol=1e-7))
+        self.assertTrue(np.allclose(
+            np.mod(lon1 - lon2 + 180, 360) - 180, 0, atol=1e-7))
+
+    def test_set_backend(self):
+        set_backend('numpy')
+        self.assertIs(get_kernel('geod_fwd'),
+                      kernel_backends['numpy']['geod_fwd'])
+        set_backend('numba')
+        if kernels.has_numba:
+            self.assertEqual(kernels.backend, 'numba')
+        else:
+            self.assertEqual(kernels.backend, 'numpy')
+        self.assertRaises(ValueError, set_backend, 'fortran')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -17,10 +17,14 @@
 #
 # Copyright 2015, Knut-Frode Dagestad, MET Norway
 
+import os
+import json
+import tempfile
 import unittest
 from datetime import datetime, timedelta
 
 import numpy as np
+from netCDF4 import Dataset
 
 from opendrift.models.oceandrift import OceanDrift
 from opendrift.models.leeway import Leeway
@@ -29,7 +33,9 @@ from opendrift.readers import reader_netCDF_CF_generic
 from opendrift.readers import reader_ROMS_native
 from opendrift.readers import reader_basemap_landmask
 from opendrift.readers import reader_constant
+from opendrift.readers import reader_oscillating
 from opendrift.readers import reader_lazy
+from opendrift.readers.basereader import pyproj
 from opendrift.readers import reader_from_url
 from opendrift.models.pelagicegg import PelagicEggDrift
 
@@ -134,6 +140,232 @@ class TestReaders(unittest.TestCase):
         self.assertEqual(len(o._lazy_readers()), 2)
         self.assertEqual(len(o.discarded_readers), 1)
 
+    def test_cluster_elements(self):
+        r = reader_constant.Reader({'x_sea_water_velocity': 1})
+        np.random.seed(0)
+        x = np.concatenate((np.random.uniform(20, 21, 50),
+                            np.random.uniform(0, 1, 50)))
+        y = np.random.uniform(60, 61, 100)
+        # Not clustered without known pixel size
+        self.assertEqual(len(r.cluster_elements(x, y)), 1)
+        r.delta_x = r.delta_y = .1
+        r.buffer = 2
+        clusters = r.cluster_elements(x, y)
+        self.assertEqual(len(clusters), 2)
+        self.assertEqual(sorted(clusters[0]), list(range(50, 100)))
+        self.assertEqual(sorted(clusters[1]), list(range(0, 50)))
+        # Clusters also along y, and within clusters
+        y[0:25] = y[0:25] + 10
+        self.assertEqual(len(r.cluster_elements(x, y)), 3)
+        # Not clustered if area is not reduced enough
+        r.buffer = 60
+        self.assertEqual(len(r.cluster_elements(x, y)), 1)
+
+    def test_discard_cluster_blocks(self):
+        r = reader_constant.Reader({'x_sea_water_velocity': 1})
+        variables = ['x_sea_water_velocity']
+        for var_block in [r.var_block_before, r.var_block_after]:
+            var_block[str(variables)] = 'all elements'
+            var_block["['y_sea_water_velocity']"] = 'other variables'
+        # Block of all elements is discarded when clustering starts
+        r._discard_cluster_blocks(variables, 2)
+        for i in range(3):
+            r.var_block_before['%s cluster %i' % (variables, i)] = i
+        self.assertEqual(sorted(r.var_block_after),
+                         ["['y_sea_water_velocity']"])
+        r._discard_cluster_blocks(variables, 2)
+        self.assertEqual(len(r.var_block_before), 3)
+        # Cluster blocks are discarded when clustering stops
+        r._discard_cluster_blocks(variables, 1)
+        self.assertEqual(sorted(r.var_block_before),
+                         ["['y_sea_water_velocity']"])
+
+    def test_static_variables(self):
+        r = reader_netCDF_CF_generic.Reader(o.test_data_folder() +
+            '2Feb2016_Nordic_sigma_3d/Arctic20_1to5Feb_2016.nc')
+        self.assertTrue('sea_floor_depth_below_sea_level' in
+                        r.static_variables)
+        self.assertFalse('sea_ice_area_fraction' in r.static_variables)
+        variables = ['sea_floor_depth_below_sea_level',
+                     'sea_ice_area_fraction']
+        lon = np.array([15.5, 15.6, 15.7])
+        lat = np.array([70.5, 70.6, 70.4])
+        z = np.zeros(3)
+        env = []
+        for hours in [1, 40]:
+            env.append(r.get_variables_interpolated(
+                variables, time=r.start_time + timedelta(hours=hours),
+                lon=lon, lat=lat, z=z, block=True)[0])
+            if hours == 1:
+                static_block = r.var_block_static[
+                    str(['sea_floor_depth_below_sea_level'])][0]
+        # Static block is read only once, and not swapped
+        self.assertIs(r.var_block_static[
+            str(['sea_floor_depth_below_sea_level'])][0], static_block)
+        self.assertFalse(str(variables) in r.var_block_before)
+        self.assertTrue(np.allclose(
+            env[0]['sea_floor_depth_below_sea_level'],
+            env[1]['sea_floor_depth_below_sea_level']))
+        # Same values as when read as time dependent variable
+        r2 = reader_netCDF_CF_generic.Reader(o.test_data_folder() +
+            '2Feb2016_Nordic_sigma_3d/Arctic20_1to5Feb_2016.nc')
+        r2.static_variables = []
+        env2, profiles = r2.get_variables_interpolated(
+            variables, time=r.start_time + timedelta(hours=40),
+            lon=lon, lat=lat, z=z, block=True)
+        for var in variables:
+            self.assertTrue(np.allclose(env[1][var], env2[var]))
+
+    def test_rotation_angle_from_block(self):
+        r = reader_netCDF_CF_generic.Reader(o.test_data_folder() +
+            '2Feb2016_Nordic_sigma_3d/Arctic20_1to5Feb_2016.nc')
+        proj = '+proj=stere +lat_0=90 +lon_0=70 +lat_ts=60 +R=6370997'
+        np.random.seed(0)
+        lon = np.random.uniform(5, 25, 1000)
+        lat = np.random.uniform(70, 78, 1000)
+        variables = ['x_sea_water_velocity', 'y_sea_water_velocity']
+        env, profiles = r.get_variables_interpolated(
+            variables, time=r.start_time, lon=lon, lat=lat,
+            z=np.zeros(1000), block=True, rotate_to_proj=proj)
+        self.assertEqual(len(r.rotation_cache), 1)
+        x, y = r.lonlat2xy(lon, lat)
+        block = r.var_block_before[str(variables)]
+        u, v = r.rotate_vectors(
+            x, y, block.interpolate(x, y, variables=variables)[0][
+                'x_sea_water_velocity'],
+            block.interpolate(x, y, variables=variables)[0][
+                'y_sea_water_velocity'], r.proj, proj)
+        self.assertTrue(np.allclose(u, env['x_sea_water_velocity']))
+        self.assertTrue(np.allclose(v, env['y_sea_water_velocity']))
+
+    def test_coordinate_cache(self):
+        from opendrift.readers.basereader import CoordinateCache
+        cache = CoordinateCache()
+        calls = []
+        def transform(lon, lat):
+            calls.append(len(lon))
+            return lon*2, lat*3
+        lon = np.array([1., 2., 3.])
+        lat = np.array([60., 61., 62.])
+        # Positions which are not registered are not cached
+        cache.lonlat2xy('proj', lon, lat, transform)
+        cache.lonlat2xy('proj', lon, lat, transform)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(len(cache.entries), 0)
+        cache.new_positions(lon, lat)
+        x, y = cache.lonlat2xy('proj', lon, lat, transform)
+        x[0] = 100  # Modifying result shall not modify cache
+        x, y = cache.lonlat2xy('proj', lon.copy(), lat.copy(), transform)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(x.tolist(), [2., 4., 6.])
+        self.assertEqual(y.tolist(), [180., 183., 186.])
+        # Other projection, or other positions
+        cache.lonlat2xy('proj2', lon, lat, transform)
+        self.assertEqual(len(calls), 4)
+        x, y = cache.lonlat2xy('proj', lon[::-1], lat, transform)
+        self.assertEqual(x.tolist(), [6., 4., 2.])
+        self.assertEqual(len(calls), 5)
+        # Only a few projections are kept
+        for i in range(cache.max_entries + 1):
+            cache.lonlat2xy('proj%i' % i, lon, lat, transform)
+        self.assertEqual(len(cache.entries), cache.max_entries)
+        # Entries are discarded when positions are updated
+        version = cache.version
+        lon = lon + 1
+        cache.new_positions(lon, lat)
+        self.assertEqual(cache.version, version + 1)
+        self.assertEqual(len(cache.entries), 0)
+        x, y = cache.lonlat2xy('proj', lon, lat, transform)
+        self.assertEqual(x.tolist(), [4., 6., 8.])
+
+    def test_coordinate_cache_threads(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from opendrift.readers.basereader import CoordinateCache
+        cache = CoordinateCache()
+        lon = np.linspace(0, 10, 1000)
+        lat = np.linspace(60, 70, 1000)
+        cache.new_positions(lon, lat)
+        def lookup(i):
+            factor = i % 3 + 1  # Same transform for each projection
+            x, y = cache.lonlat2xy('proj%i' % factor, lon, lat,
+                                   lambda lon, lat: (lon*factor, lat*factor))
+            return np.allclose(x, lon*factor) and np.allclose(y, lat*factor)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            self.assertTrue(all(executor.map(lookup, range(100))))
+        self.assertEqual(cache.hits + cache.misses, 100)
+
+    def test_lazy_reader_catalogue(self):
+        fd, catfile = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.addCleanup(os.remove, catfile)
+        entry = {'start_time': '2016-02-01T00:00:00',
+                 'end_time': '2016-02-05T00:00:00',
+                 'always_valid': False, 'global_coverage': False,
+                 'lonmin': 10., 'lonmax': 20., 'latmin': 65.,
+                 'latmax': 70., 'zmin': None, 'zmax': None,
+                 'variables': ['x_sea_water_velocity',
+                               'y_sea_water_velocity'],
+                 'mtime': None, 'catalogued': '2016-02-01T00:00:00'}
+        wind = entry.copy()
+        wind['variables'] = ['x_wind', 'y_wind']
+        with open(catfile, 'w') as f:
+            json.dump({'www.nonexistingurl.com/current': entry,
+                       'www.nonexistingurl.com/wind': wind}, f)
+        o = OceanDrift(loglevel=20)
+        o.add_readers_from_list(['www.nonexistingurl.com/current',
+                                 'www.nonexistingurl.com/wind'],
+                                catalogue=catfile)
+        lr = o.readers['LazyReader: www.nonexistingurl.com/current']
+        self.assertTrue(lr.is_catalogued())
+        self.assertEqual(lr.variables, entry['variables'])
+        self.assertEqual(lr.start_time, datetime(2016, 2, 1))
+        self.assertTrue(lr.covers_time(datetime(2016, 2, 2)))
+        self.assertFalse(lr.covers_time(datetime(2016, 3, 2)))
+        self.assertEqual(len(lr.covers_positions([15, 15, 25],
+                                                 [66, 72, 66])), 1)
+        self.assertEqual(len(lr.covers_positions([375], [66])), 1)
+        self.assertFalse(lr.initialised)
+        # Readers outside time coverage are neither opened nor discarded
+        o.time = datetime(2016, 3, 1)
+        self.assertIsNone(o._initialise_next_lazy_reader())
+        self.assertEqual(len(o._lazy_readers()), 2)
+        self.assertFalse(lr.initialised)
+
+    def test_source_catalogue_coverage(self):
+        class PolarReader(object):
+            # Polar stereographic domain containing the north pole
+            proj = pyproj.Proj('+proj=stere +lat_0=90 +lon_0=70 '
+                               '+lat_ts=60 +ellps=WGS84')
+            xmin, xmax, ymin, ymax = -3e6, 2e6, -2e6, 1e6
+            start_time = end_time = None
+            always_valid = False
+            variables = ['x_sea_water_velocity']
+
+            def global_coverage(self):
+                return False
+
+            def xy2lonlat(self, x, y):
+                return self.proj(x, y, inverse=True)
+
+            def lonlat2xy(self, lon, lat):
+                return self.proj(lon, lat)
+
+        r = PolarReader()
+        entry = reader_lazy.SourceCatalogue.coverage('polar', r)
+        self.assertEqual(entry['latmax'], 90)
+        self.assertEqual(entry['lonmax'] - entry['lonmin'], 360)
+        # Without the pole, the padded bounding box contains the domain
+        r.ymax = -5e5
+        entry = reader_lazy.SourceCatalogue.coverage('polar', r)
+        self.assertLess(entry['latmax'], 90)
+        x, y = np.meshgrid(np.linspace(r.xmin, r.xmax, 200),
+                           np.linspace(r.ymin, r.ymax, 200))
+        lon, lat = r.xy2lonlat(x.ravel(), y.ravel())
+        self.assertTrue(np.all(lat <= entry['latmax']))
+        self.assertTrue(np.all(lat >= entry['latmin']))
+        self.assertTrue(np.all(np.mod(lon - entry['lonmin'], 360) <=
+                               entry['lonmax'] - entry['lonmin']))
+
     #def test_lazy_readers_and_corrupt_data(self):
     #    o = OceanDrift(loglevel=0)
 
@@ -463,6 +695,101 @@ class TestReaders(unittest.TestCase):
         o.seed_elements(lon=4, lat=60, time=r.start_time, number=5)
         o.run(steps=3)
 
+    def test_analytical_reader_between_times(self):
+        # Analytical reader with time step, requested between its times
+        r = reader_oscillating.Reader('x_sea_water_velocity', amplitude=1)
+        r.start_time = datetime(2017, 1, 1)
+        r.end_time = datetime(2017, 1, 3)
+        r.time_step = timedelta(hours=1)
+        time = datetime(2017, 1, 1, 6, 30)
+        env, env_profiles = r.get_variables_interpolated(
+            ['x_sea_water_velocity'], profiles=['x_sea_water_velocity'],
+            profiles_depth=[0, -10], time=time, lon=np.array([4., 5.]),
+            lat=np.array([60., 60.]), z=np.zeros(2), block=False,
+            rotate_to_proj=None)
+        expected = np.sin(6.5*3600/r.period_seconds*np.pi)
+        np.testing.assert_array_almost_equal(
+            env['x_sea_water_velocity'], [expected]*2)
+        np.testing.assert_array_almost_equal(
+            env_profiles['x_sea_water_velocity'], [[expected]*2]*2)
+
+    def test_fallback_far_from_valid_data(self):
+        # Elements far from valid reader data get the fallback value,
+        # while NaN-values close to valid data are filled
+        fd, filename = tempfile.mkstemp(suffix='.nc')
+        os.close(fd)
+        self.addCleanup(os.remove, filename)
+        with Dataset(filename, 'w') as f:
+            for name, values, standard_name, units in [
+                    ('lon', np.linspace(0, 10, 101), 'longitude',
+                     'degrees_east'),
+                    ('lat', np.linspace(60, 65, 51), 'latitude',
+                     'degrees_north')]:
+                f.createDimension(name, len(values))
+                var = f.createVariable(name, 'f8', (name,))
+                var[:] = values
+                var.standard_name = standard_name
+                var.units = units
+            f.createDimension('time', 2)
+            var = f.createVariable('time', 'f8', ('time',))
+            var[:] = [0, 24]
+            var.units = 'hours since 2015-01-01'
+            var.standard_name = 'time'
+            for name in ['x_sea_water_velocity', 'y_sea_water_velocity']:
+                var = f.createVariable(name, 'f4', ('time', 'lat', 'lon'),
+                                       fill_value=np.nan)
+                var.standard_name = name
+                var.units = 'm/s'
+                data = np.ones((2, 51, 101))
+                data[:, :, 51:] = np.nan  # No data east of 5E
+                var[:] = data
+        o = OceanDrift(loglevel=50)
+        o.add_reader(reader_netCDF_CF_generic.Reader(filename))
+        o.fallback_values['land_binary_mask'] = 0
+        o.fallback_values['x_sea_water_velocity'] = .3
+        o.seed_elements(lon=np.array([4, 5.3, 8]), lat=np.array([62.5]*3),
+                        time=datetime(2015, 1, 1))
+        o.run(steps=1, time_step=60)
+        np.testing.assert_array_almost_equal(
+            o.history['x_sea_water_velocity'][:, 0], [1, 1, .3])
+
+    def test_static_variables_valid_range(self):
+        # Static variables are checked against valid ranges, as
+        # time dependent variables
+        fd, filename = tempfile.mkstemp(suffix='.nc')
+        os.close(fd)
+        self.addCleanup(os.remove, filename)
+        with Dataset(filename, 'w') as f:
+            for name, values, standard_name, units in [
+                    ('lon', np.linspace(0, 10, 11), 'longitude',
+                     'degrees_east'),
+                    ('lat', np.linspace(60, 65, 6), 'latitude',
+                     'degrees_north')]:
+                f.createDimension(name, len(values))
+                var = f.createVariable(name, 'f8', (name,))
+                var[:] = values
+                var.standard_name = standard_name
+                var.units = units
+            f.createDimension('time', 2)
+            var = f.createVariable('time', 'f8', ('time',))
+            var[:] = [0, 24]
+            var.units = 'hours since 2015-01-01'
+            var.standard_name = 'time'
+            var = f.createVariable('x_wind', 'f4', ('lat', 'lon'))
+            var.standard_name = 'x_wind'
+            var.units = 'm/s'
+            data = 5*np.ones((6, 11))
+            data[:, 6:] = 100  # Outside valid range east of 5E
+            var[:] = data
+        r = reader_netCDF_CF_generic.Reader(filename)
+        self.assertEqual(r.static_variables, ['x_wind'])
+        env, profiles = r.get_variables_interpolated(
+            ['x_wind'], time=r.start_time + timedelta(hours=6),
+            lon=np.array([2., 8.]), lat=np.array([62., 62.]),
+            z=np.zeros(2), block=True)
+        self.assertAlmostEqual(env['x_wind'][0], 5)
+        self.assertTrue(np.isnan(np.ma.filled(env['x_wind'][1], np.nan)))
+
     def test_clip_domain(self):
         o = OceanDrift(loglevel=50)
         r1 = reader_ROMS_native.Reader(o.test_data_folder() +
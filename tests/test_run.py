@@ -21,9 +21,12 @@ import unittest
 from datetime import datetime, timedelta
 import os
 import inspect
+import tempfile
 
 import numpy as np
+import netCDF4
 
+import opendrift
 from opendrift.readers import reader_ArtificialOceanEddy
 from opendrift.readers import reader_basemap_landmask
 from opendrift.readers import reader_netCDF_CF_generic
@@ -33,6 +36,13 @@ from opendrift.models.oceandrift import OceanDrift
 from opendrift.models.oceandrift3D import OceanDrift3D
 from opendrift.models.openoil3D import OpenOil3D
 from opendrift.models.pelagicegg import PelagicEggDrift
+from opendrift.statistics import StatusCounts, Sums, Moments, Histogram
+
+try:
+    import pyarrow
+    has_pyarrow = True
+except ImportError:
+    has_pyarrow = False
 
 def gdal_error_handler(err_class, err_num, err_msg):
     errtype = {
@@ -76,6 +86,26 @@ class TestRun(unittest.TestCase):
             urcrnrlon=7, urcrnrlat=64, resolution='c')
         self.o.add_reader([self.fake_eddy, self.reader_basemap])
 
+    def make_drifting_simulation(self, iomodule='netcdf', **kwargs):
+        """OceanDrift with eastwards current and no land, and seeded
+        elements (50 elements at two times, unless given in kwargs)."""
+        o = OceanDrift(loglevel=50, iomodule=iomodule)
+        o.fallback_values['land_binary_mask'] = 0
+        o.fallback_values['x_sea_water_velocity'] = .3
+        seed = {'lon': 4.8, 'lat': 60.0, 'number': 50, 'radius': 1000,
+                'time': [datetime(2015, 11, 16, 0),
+                         datetime(2015, 11, 16, 6)]}
+        seed.update(kwargs)
+        o.seed_elements(**seed)
+        return o
+
+    def make_outfile(self, suffix='.nc'):
+        """Name of temporary output file, removed after the test."""
+        fd, outfile = tempfile.mkstemp(suffix=suffix)
+        os.close(fd)
+        self.addCleanup(os.remove, outfile)
+        return outfile
+
     def test_seed(self):
         """Test seeding"""
         o = OceanDrift(loglevel=20)
@@ -487,6 +517,30 @@ class TestRun(unittest.TestCase):
         self.assertEqual(o.time_step_output.total_seconds(), 7200)
 
 
+    def test_float_precision(self):
+        o = OceanDrift(loglevel=50)
+        self.assertEqual(o.get_float_precision(),
+                         (None, np.dtype('float32')))
+        o.set_config('general:float_precision', 'float16')
+        self.assertEqual(o.get_float_precision(),
+                         (np.dtype('float32'), np.dtype('float16')))
+        lon = {}
+        for precision in ['float64', 'float32']:
+            o = OceanDrift(loglevel=50)
+            o.set_config('general:float_precision', precision)
+            o.add_reader(reader_netCDF_CF_generic.Reader(
+                o.test_data_folder() +
+                '16Nov2015_NorKyst_z_surface/norkyst800_subset_16Nov2015.nc'))
+            o.fallback_values['land_binary_mask'] = 0
+            o.seed_elements(lon=4.8, lat=60.0, number=10, radius=1000,
+                            time=datetime(2015, 11, 16, 0))
+            o.run(steps=3)
+            lon[precision] = o.elements.lon
+            self.assertEqual(o.history['x_sea_water_velocity'].dtype,
+                             np.float32)
+        self.assertTrue(np.allclose(lon['float64'], lon['float32']))
+
+
     def test_reader_boundary(self):
         # Check that the element outside reader coverage is
         # not deactivated if fallback value exist
@@ -550,6 +604,229 @@ class TestRun(unittest.TestCase):
         self.assertIsNone(np.testing.assert_array_almost_equal(
             o.elements.lon, o2.elements.lon))
 
+    def test_reader_threads(self):
+        # Check that concurrent fetching from readers gives same result
+        lon = {}
+        for threads in [1, 4]:
+            o = OceanDrift(loglevel=50)
+            o.set_config('general:reader_threads', threads)
+            o.add_reader([
+                reader_netCDF_CF_generic.Reader(o.test_data_folder() +
+                    '16Nov2015_NorKyst_z_surface/norkyst800_subset_16Nov2015.nc'),
+                reader_netCDF_CF_generic.Reader(o.test_data_folder() +
+                    '16Nov2015_NorKyst_z_surface/arome_subset_16Nov2015.nc')])
+            o.fallback_values['land_binary_mask'] = 0
+            o.seed_elements(lon=4.8, lat=60.0, number=10, radius=1000,
+                            time=datetime(2015, 11, 16, 0))
+            o.run(steps=5)
+            lon[threads] = o.elements.lon
+        self.assertTrue(np.allclose(lon[1], lon[4]))
+
+    def test_ragged_history(self):
+        # Check that ragged history gives same result as dense history
+        history = {}
+        for storage in ['dense', 'ragged']:
+            o = self.make_drifting_simulation()
+            o.set_config('general:history_storage', storage)
+            o.set_config('drift:deactivate_east_of', 4.9)
+            o.run(steps=12, time_step=1800, time_step_output=3600,
+                  export_buffer_length=4, outfile=self.make_outfile())
+            history[storage] = {var: o.history[var] for var in
+                                ['lon', 'lat', 'status']}
+        for var in ['lon', 'lat', 'status']:
+            np.testing.assert_array_equal(history['dense'][var].mask,
+                                          history['ragged'][var].mask)
+            np.testing.assert_array_equal(history['dense'][var].compressed(),
+                                          history['ragged'][var].compressed())
+
+    def test_ragged_import(self):
+        # Number of elements and output steps are taken from metadata,
+        # as these may have no observations in ragged files
+        outfile = self.make_outfile()
+        o = self.make_drifting_simulation(time=datetime(2015, 11, 16, 0))
+        o.seed_elements(lon=4.8, lat=60.0, number=10, radius=1000,
+                        time=datetime(2015, 11, 17, 0))  # Never seeded
+        o.set_config('general:history_storage', 'ragged')
+        o.run(steps=6, export_buffer_length=4, outfile=outfile)
+        with netCDF4.Dataset(outfile, 'a') as f:
+            self.assertEqual(len(f.dimensions['trajectory']), 60)
+            self.assertEqual(f.steps_output, o.steps_output)
+            self.assertEqual(f.num_elements_activated, 50)
+            # As if last elements and steps had no observations
+            f.steps_output = o.steps_output + 2
+            f.num_elements_activated = 55
+        o2 = OceanDrift(loglevel=50)
+        o2.io_import_file(outfile)
+        self.assertEqual(o2.steps_output, o.steps_output + 2)
+        self.assertEqual(o2.history['lon'].shape, (55, o.steps_output + 2))
+        np.testing.assert_array_equal(
+            o2.history['lon'][0:50, 0:o.steps_output], o.history['lon'])
+        self.assertTrue(o2.history['lon'][50:, :].mask.all())
+        self.assertTrue(o2.history['lon'][:, o.steps_output:].mask.all())
+
+    def test_export_encoding(self):
+        outfile = self.make_outfile()
+        o = self.make_drifting_simulation(number=100,
+                                          time=datetime(2015, 11, 16, 0))
+        o.run(steps=10, export_buffer_length=5, outfile=outfile,
+              export_encoding={'default': {'zlib': True,
+                                           'chunksizes': 'trajectory'},
+                               'lon': {'least_significant_digit': 2}})
+        with netCDF4.Dataset(outfile) as f:
+            self.assertTrue(f.variables['lat'].filters()['zlib'])
+            self.assertEqual(f.variables['lat'].chunking(), [100, 5])
+            self.assertTrue(np.allclose(f.variables['lon'][:],
+                                        o.history['lon'], atol=.01))
+
+    def test_output_dimensions(self):
+        # Simulation stopping before end, and file dimensions sized
+        # from expected number of steps and elements
+        outfile = self.make_outfile()
+        o = self.make_drifting_simulation(radius=100,
+                                          time=datetime(2015, 11, 16, 0))
+        o.set_config('drift:deactivate_east_of', 4.85)
+        o.run(steps=20, export_buffer_length=4, outfile=outfile)
+        with netCDF4.Dataset(outfile) as f:
+            self.assertEqual(len(f.dimensions['time']), 21)
+            self.assertEqual(f.variables['time'][:].count(), 21)
+        self.assertTrue(o.steps_output < 21)
+        o2 = OceanDrift(loglevel=50)
+        o2.io_import_file(outfile)
+        self.assertEqual(o2.history['lon'].shape, o.history['lon'].shape)
+        self.assertEqual(o2.end_time, o.get_time_array()[0][-1])
+
+    def test_async_export(self):
+        # Check that writing buffers from writer thread gives same output
+        lon = {}
+        for async_export in [False, True]:
+            o = self.make_drifting_simulation()
+            o.set_config('general:async_export', async_export)
+            o.run(steps=20, export_buffer_length=3,
+                  outfile=self.make_outfile())
+            lon[async_export] = o.history['lon']
+        np.testing.assert_array_equal(lon[False], lon[True])
+
+    def test_selective_import(self):
+        outfile = self.make_outfile()
+        o = self.make_drifting_simulation()
+        o.run(steps=20, export_buffer_length=5, outfile=outfile)
+        lon = o.history['lon']
+        o2 = opendrift.open(outfile, variables=['z'],
+                            elements=slice(10, 30),
+                            time_range=(datetime(2015, 11, 16, 3),
+                                        datetime(2015, 11, 16, 8)))
+        self.assertEqual(sorted(o2.history.dtype.names),
+                         ['lat', 'lon', 'status', 'z'])
+        self.assertEqual(o2.start_time, datetime(2015, 11, 16, 3))
+        np.testing.assert_array_equal(o2.history['lon'], lon[10:30, 3:9])
+        # Restart from a given time reads only this time step
+        o3 = opendrift.open(outfile, time=datetime(2015, 11, 16, 4))
+        self.assertEqual(o3.history['lon'].shape, (50, 1))
+        self.assertEqual(o3.time, datetime(2015, 11, 16, 4))
+        self.assertEqual(len(o3.elements), lon[:, 4].count())
+        self.assertRaises(ValueError, opendrift.open, outfile,
+                          time=datetime(2015, 11, 17, 4))
+
+    @unittest.skipIf(has_pyarrow is False, 'pyarrow is needed for Parquet')
+    def test_parquet_export(self):
+        lon = {}
+        for iomodule, suffix in [('netcdf', '.nc'), ('parquet', '.parquet')]:
+            outfile = self.make_outfile(suffix)
+            o = self.make_drifting_simulation(iomodule=iomodule)
+            o.run(steps=20, export_buffer_length=3, outfile=outfile)
+            lon[iomodule] = o.history['lon']
+        o2 = opendrift.open(outfile)
+        self.assertIsInstance(o2, OceanDrift)
+        self.assertEqual(o2.steps_output, o.steps_output)
+        for lons in [lon['parquet'], o2.history['lon']]:
+            np.testing.assert_array_equal(lons, lon['netcdf'])
+            np.testing.assert_array_equal(lons.mask, lon['netcdf'].mask)
+
+    @unittest.skipIf(has_pyarrow is False, 'pyarrow is needed for Parquet')
+    def test_parquet_import_metadata(self):
+        # Number of elements and output steps are taken from metadata,
+        # as these may have no rows in the table
+        import pyarrow.parquet as pq
+        outfile = self.make_outfile('.parquet')
+        o = self.make_drifting_simulation(iomodule='parquet',
+                                          time=datetime(2015, 11, 16, 0))
+        o.run(steps=6, export_buffer_length=4, outfile=outfile)
+        table = pq.read_table(outfile)
+        metadata = pq.ParquetFile(outfile).metadata.metadata
+        del metadata[b'ARROW:schema']
+        if b'steps_output' not in metadata:
+            self.skipTest('pyarrow >= 17 is needed to add metadata')
+        self.assertEqual(int(metadata[b'steps_output']), o.steps_output)
+        self.assertEqual(int(metadata[b'num_elements_activated']), 50)
+        # As if last elements and steps had no rows
+        metadata[b'steps_output'] = str(o.steps_output + 2).encode()
+        metadata[b'num_elements_activated'] = b'55'
+        pq.write_table(table.replace_schema_metadata(metadata), outfile)
+        o2 = opendrift.open(outfile)
+        self.assertEqual(o2.steps_output, o.steps_output + 2)
+        self.assertEqual(o2.history['lon'].shape, (55, o.steps_output + 2))
+        np.testing.assert_array_equal(
+            o2.history['lon'][0:50, 0:o.steps_output], o.history['lon'])
+        self.assertTrue(o2.history['lon'][50:, :].mask.all())
+
+    def test_constant_properties(self):
+        # Properties constant per element are stored once per trajectory
+        outfile = self.make_outfile()
+        o = self.make_drifting_simulation(
+            wind_drift_factor=np.linspace(0, .04, 50))
+        o.run(steps=12, export_buffer_length=4, outfile=outfile)
+        self.assertFalse('wind_drift_factor' in o.history.dtype.names)
+        wdf = o.get_property('wind_drift_factor')[0]
+        self.assertEqual(wdf.shape, o.history['lon'].shape[::-1])
+        np.testing.assert_array_equal(wdf.mask, o.get_property('lon')[0].mask)
+        with netCDF4.Dataset(outfile) as f:
+            self.assertEqual(f.variables['wind_drift_factor'].dimensions,
+                             ('trajectory',))
+        o2 = opendrift.open(outfile)
+        np.testing.assert_array_equal(
+            o2.get_property('wind_drift_factor')[0], wdf)
+        self.assertTrue(np.allclose(
+            o2.elements.wind_drift_factor,
+            np.linspace(0, .04, 50)[o2.elements.ID - 1]))
+
+    def test_statistics(self):
+        # Statistics collected without history, compared to history
+        statistics = {}
+        for export_variables in [None, []]:
+            statistics_file = self.make_outfile()
+            o = self.make_drifting_simulation(
+                wind_drift_factor=np.linspace(0, .04, 50))
+            o.set_config('drift:deactivate_east_of', 4.9)
+            o.add_statistics([StatusCounts(), Sums(['wind_drift_factor']),
+                              Moments(['lon', 'lat']),
+                              Histogram('lat', bins=[59.9, 60, 60.1])])
+            o.run(steps=16, time_step=1800, time_step_output=3600,
+                  export_variables=export_variables,
+                  statistics_file=statistics_file)
+            with netCDF4.Dataset(statistics_file) as f:
+                self.assertEqual(f.variables['status'].flag_meanings,
+                                 'active outside')
+                statistics[str(export_variables)] = {
+                    var: f.variables[var][:] for var in f.variables}
+            if export_variables is None:
+                lon = o.history['lon']
+                status = o.history['status']
+        self.assertIsNone(o.history)
+        for var, value in statistics['None'].items():
+            np.testing.assert_array_almost_equal(value, statistics['[]'][var])
+        lon_active = np.ma.masked_where(status != 0, lon)
+        np.testing.assert_array_almost_equal(
+            statistics['[]']['mean_lon'], lon_active.mean(axis=0))
+        np.testing.assert_array_almost_equal(
+            statistics['[]']['covariance_lon_lon'], lon_active.var(axis=0))
+        np.testing.assert_array_equal(
+            statistics['[]']['number_of_elements'][:, 0],
+            np.sum(status == 0, axis=0))
+        self.assertEqual(statistics['[]']['number_of_elements'][-1].sum(),
+                         50)
+        self.assertRaises(ValueError, o.run, steps=2,
+                          outfile=self.make_outfile(), export_variables=[])
+
     def test_seed_seafloor(self):
         o = OpenOil3D(loglevel=30)
         reader_norkyst = reader_netCDF_CF_generic.Reader(o.test_data_folder() + '14Jan2016_NorKyst_z_3d/NorKyst-800m_ZDEPTHS_his_00_3Dsubset.nc')